@@ -39,6 +39,11 @@ from scc.github import GitWebHookHandler
 from tabix.tabix_lookup import TabixLookupHandler
 from tabix.seqpeek_data_lookup import SeqPeekDataHandler
 from tabix.variant_summary_handler import VariantSummaryHandler
+from tabix.lookup_stats_handler import LookupStatsHandler
+from tabix.tabix_utils import TABIX_READERS, TABIX_READER_SUBPROCESS
+from tabix import lookup_executor
+from tabix import tabix_reader
+from tabix import variant_summary_lookup
 
 define("data_path", default="../..", help="Path to data files")
 define("port", default=8000, help="run on the given port", type=int)
@@ -64,9 +69,15 @@ define("github_branches_json_path", help="Path to publish branches json", defaul
 define("verbose", default=False, type=bool, help="Enable verbose printouts")
 
 define("tabix_executable", default="tabix", help="Tabix executable")
+define("tabix_max_processes", default=0, type=int, help="Run tabix lookups off the IOLoop, at most this many at a time (0 = run synchronously)")
+define("tabix_max_streams", default=0, type=int, help="Open streamed tabix lookups at a time, each with a tabix process, in addition to --tabix_max_processes (0 = same as --tabix_max_processes)")
+define("tabix_block_cache_size", default=64 * 1024 * 1024, type=int, help="Memory budget in bytes for decompressed BGZF blocks shared by native tabix readers")
 define("tabix_lookups", default={}, help="Tabix lookups configurations")
+define("tabix_batch_max_size", default=1000, type=int, help="Maximum number of coordinates in a tabix batch lookup")
+define("tabix_batch_merge_distance", default=10000, type=int, help="Tabix batch lookups scan coordinates closer than this many bases as one region")
 define("seqpeek_data_lookups", default={}, help="SeqPeek data lookups configurations")
 define("variant_summary_sources", default={}, help="Variant Summary configurations")
+define("variant_summary_fetch_workers", default=0, type=int, help="Threads fetching the feature, triotype and VCF data of Variant Summary queries at the same time (0 = one after another)")
 
 settings = {
     "debug": True,
@@ -150,6 +161,8 @@ def parse_tabix_lookup_configuration():
     for tabix_id, config in options.tabix_lookups.iteritems():
         if len(config.keys()) == 0:
             logging.warn("Tabix lookup \'" + tabix_id + "\' disabled - empty configuration.")
+        elif config.get('reader', TABIX_READER_SUBPROCESS) not in TABIX_READERS:
+            logging.warn("Tabix lookup \'" + tabix_id + "\' disabled - unknown reader \'" + str(config['reader']) + "\'.")
         else:
             tabix_file_map[tabix_id] = config
             logging.info("Tabix lookup \'" + tabix_id + "\' enabled.")
@@ -162,6 +175,8 @@ def parse_seqpeek_data_configuration():
     for seqpeek_data_id, config in options.seqpeek_data_lookups.iteritems():
         if len(config.keys()) == 0:
             logging.warn("SeqPeek data lookup \'" + seqpeek_data_id + "\' disabled - empty configuration.")
+        elif config.get('reader', TABIX_READER_SUBPROCESS) not in TABIX_READERS:
+            logging.warn("SeqPeek data lookup \'" + seqpeek_data_id + "\' disabled - unknown reader \'" + str(config['reader']) + "\'.")
         else:
             seqpeek_data_map[seqpeek_data_id] = config
             logging.info("SeqPeek data lookup \'" + seqpeek_data_id + "\' enabled.")
@@ -177,12 +192,15 @@ def parse_variant_summary_configuration():
             logging.warn("Variant Summary lookup \'" + data_id + "\' disabled - empty configuration.")
             continue
 
-        if set(config.keys()).issubset(REQUIRED_KEYS):
-            data_map[data_id] = config
-            logging.info("Variant Summary lookup \'" + data_id + "\' enabled.")
+        if not REQUIRED_KEYS.issubset(config.keys()):
+            logging.warn("Variant Summary lookup \'" + data_id + "\' disabled - missing fields in configuration.")
+
+        elif config.get('reader', TABIX_READER_SUBPROCESS) not in TABIX_READERS:
+            logging.warn("Variant Summary lookup \'" + data_id + "\' disabled - unknown reader \'" + str(config['reader']) + "\'.")
 
         else:
-            logging.warn("Variant Summary lookup \'" + data_id + "\' disabled - missing fields in configuration.")
+            data_map[data_id] = config
+            logging.info("Variant Summary lookup \'" + data_id + "\' enabled.")
 
     return data_map
 
@@ -224,6 +242,14 @@ def main():
     if not options.config_file_json is None:
         MongoDbQueryHandler.datastores_config = json.load(open(options.config_file_json))
 
+    if options.tabix_max_processes > 0:
+        logging.info("--tabix_max_processes=%s" % options.tabix_max_processes)
+    if options.tabix_max_streams > 0:
+        logging.info("--tabix_max_streams=%s" % options.tabix_max_streams)
+    lookup_executor.configure(options.tabix_max_processes, options.tabix_max_streams)
+    tabix_reader.configure_block_cache(options.tabix_block_cache_size)
+    variant_summary_lookup.configure_fetch_pool(options.variant_summary_fetch_workers)
+
     TabixLookupHandler.tabix_file_map = parse_tabix_lookup_configuration()
 
     SeqPeekDataHandler.seqpeek_data_map = parse_seqpeek_data_configuration()
@@ -244,8 +270,10 @@ def main():
         (r"/collections/(.*)", MongoDbCollectionsHandler),
         (r"/tabix/(\w+)/(X|Y|M|\d{1,2})/(\d+)", TabixLookupHandler),
         (r"/tabix/(\w+)/(X|Y|M|\d{1,2})/(\d+)/(\d+)", TabixLookupHandler),
+        (r"/tabix/(\w+)/batch", TabixLookupHandler),
         (r"/seqpeek_data/(.*)", SeqPeekDataHandler),
         (r"/variant_summary/(.*)", VariantSummaryHandler),
+        (r"/lookup_stats", LookupStatsHandler),
         (r"/gitWebHook?(.*)", GitWebHookHandler)
     ], **settings)
     application.listen(options.port, **server_settings)
@@ -0,0 +1,210 @@
+from tornado.options import logging
+
+from collections import Counter
+
+import heapq
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import feature_data_source
+from lru_cache import LRUCache
+
+# Scans all features of a feature matrix for the one variant: for every feature, the units (families
+# for triotypes, samples for VCF data) of each feature category are counted per genotype or trio
+# type group, and the features are ranked by a statistic of that table.
+#
+# The category membership of each feature, and the units in each group, are encoded as bitsets
+# over the units: rows of packed bytes with NumPy, or Python long integers without it. The count of
+# a table cell is the popcount of the AND of a feature bitset and a group bitset, and is taken for
+# all features at once with NumPy.
+
+FEATURE_CATEGORIES = ["false", "true"]
+
+# Memory budget in bytes for the encoded feature bitsets
+FEATURE_BITSETS_SIZE = 64 * 1024 * 1024
+
+# (JSON path, unit family IDs, selected families) -> (FeatureMatrix, FeatureBitsets), or
+# (MongoDB host, database, collection, unit family IDs, selected families) ->
+# (feature matrix version, FeatureBitsets)
+FEATURE_BITSETS = LRUCache(FEATURE_BITSETS_SIZE, size_fn=lambda entry: entry[1].size())
+
+# Bits set in each byte value
+POPCOUNT_TABLE = None
+if numpy is not None:
+    POPCOUNT_TABLE = numpy.array([bin(value).count('1') for value in xrange(256)], dtype=numpy.uint8)
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+def bits_from_flags(flags):
+    # Bit i is set for flags[i] == True
+    if len(flags) == 0:
+        return 0
+    return int(''.join(['1' if flag else '0' for flag in reversed(flags)]), 2)
+
+class FeatureBitsets:
+    def __init__(self, feature_ids, category_bits, category_sizes):
+        self.feature_ids = feature_ids
+        # category -> bitsets in the order of feature_ids: a list of longs, or with NumPy a uint8
+        # array of one row of packed bits per feature
+        self.category_bits = category_bits
+        # category -> number of samples of the feature in the category, in the order of
+        # feature_ids, as in FeatureData.aggregate
+        self.category_sizes = category_sizes
+
+    def size(self):
+        # Bytes of the bitsets
+        if numpy is not None:
+            return sum(bits.nbytes for bits in self.category_bits.itervalues())
+        return sum((bits.bit_length() + 7) // 8 for category_bits in self.category_bits.itervalues() for bits in category_bits)
+
+def encode_features(feature_rows, unit_count):
+    # 'feature_rows' yields (feature ID, category of each unit, values of the feature counted in
+    # its category sizes) tuples.
+    feature_ids = []
+    category_bits = dict((category, []) for category in FEATURE_CATEGORIES)
+    category_sizes = dict((category, []) for category in FEATURE_CATEGORIES)
+    for feature_id, unit_values, feature_values in feature_rows:
+        feature_ids.append(feature_id)
+        aggregate = Counter(feature_values)
+        for category in FEATURE_CATEGORIES:
+            category_sizes[category].append(aggregate[category])
+        if numpy is not None:
+            unit_values = numpy.array(unit_values, dtype=object)
+            for category in FEATURE_CATEGORIES:
+                category_bits[category].append(numpy.packbits(unit_values == category))
+        else:
+            for category in FEATURE_CATEGORIES:
+                category_bits[category].append(bits_from_flags([value == category for value in unit_values]))
+
+    if numpy is not None:
+        row_bytes = (unit_count + 7) // 8
+        for category in FEATURE_CATEGORIES:
+            category_bits[category] = numpy.array(category_bits[category], dtype=numpy.uint8).reshape(len(feature_ids), row_bytes)
+    return FeatureBitsets(feature_ids, category_bits, category_sizes)
+
+def iter_json_feature_rows(matrix, unit_families, selected_families=None):
+    # As in FeatureData, the last of any duplicate sample IDs wins. As in do_query, a family
+    # without a value raises KeyError.
+    column_index = dict((sample_id, index) for index, sample_id in enumerate(matrix.sample_ids))
+    columns = [column_index[family_id] for family_id in unit_families]
+    if selected_families is None:
+        selected_families = column_index.iterkeys()
+    size_columns = sorted(column_index[family_id] for family_id in selected_families if family_id in column_index)
+    all_columns = len(size_columns) == len(matrix.sample_ids)
+    for feature_id, index in sorted(matrix.feature_index.iteritems(), key=lambda item: item[1]):
+        row = matrix.feature_value_arrays[index]
+        values = row
+        if not all_columns:
+            values = [row[column] for column in size_columns]
+        yield feature_id, [row[column] for column in columns], values
+
+def iter_mongodb_feature_rows(config, unit_families, selected_families=None):
+    client = feature_data_source.create_mongo_connection(config['host'])
+    collection = client[config['database']][config['collection']]
+    for feature in collection.find({}, {"id": 1, "v": 1}):
+        value_dict = feature["v"]
+        values = value_dict.values()
+        if selected_families is not None:
+            values = [value for family_id, value in value_dict.iteritems() if family_id in selected_families]
+        yield feature["id"], [value_dict[family_id] for family_id in unit_families], values
+
+def get_feature_bitsets(config, unit_families, selected_families=None):
+    # Bitsets are kept per set of units and version of the feature matrix: the parsed JSON file, or
+    # the feature_matrix_version of a MongoDB collection. With 'selected_families', the category
+    # sizes only count those families, as do_query does for a sample selection.
+    if selected_families is not None:
+        selected_families = frozenset(selected_families)
+    if config['type'] == 'json':
+        version = feature_data_source.get_feature_matrix(config['path'])
+        key = (config['path'], tuple(unit_families), selected_families)
+        feature_rows = iter_json_feature_rows(version, unit_families, selected_families)
+    else:
+        version = feature_data_source.feature_matrix_version(config)
+        key = (config['host'], config['database'], config['collection'], tuple(unit_families), selected_families)
+        feature_rows = iter_mongodb_feature_rows(config, unit_families, selected_families)
+
+    cached = FEATURE_BITSETS.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    started = time.time()
+    bitsets = encode_features(feature_rows, len(unit_families))
+    logging.debug("Association scan - encoded %d features in %.1f ms" % (len(bitsets.feature_ids), (time.time() - started) * 1000.0))
+    FEATURE_BITSETS.put(key, (version, bitsets))
+    return bitsets
+
+def encode_groups(unit_values, group_types, count_map):
+    # group type -> bitset of the units with a value in that group, after 'count_map' is applied
+    group_flags = dict((group_type, [False] * len(unit_values)) for group_type in group_types)
+    for unit, value in enumerate(unit_values):
+        group_type = count_map.get(value, value)
+        if group_type in group_flags:
+            group_flags[group_type][unit] = True
+
+    if numpy is not None:
+        return dict((group_type, numpy.packbits(numpy.array(flags, dtype=bool))) for group_type, flags in group_flags.iteritems())
+    return dict((group_type, bits_from_flags(flags)) for group_type, flags in group_flags.iteritems())
+
+def count_groups(category_bits, group_bits):
+    # Units in both the category and the group, for every feature
+    if numpy is not None:
+        return POPCOUNT_TABLE[numpy.bitwise_and(category_bits, group_bits)].sum(axis=1, dtype=numpy.intp).tolist()
+    return [popcount(bits & group_bits) if bits else 0 for bits in category_bits]
+
+def chi_square(table, group_types):
+    # Pearson's chi-square statistic of the category x group table, over the groups with units.
+    row_totals = dict((category, sum(table[category].itervalues())) for category in FEATURE_CATEGORIES)
+    total = sum(row_totals.itervalues())
+    if total == 0:
+        return 0.0
+
+    statistic = 0.0
+    for group_type in group_types:
+        column_total = sum(table[category][group_type] for category in FEATURE_CATEGORIES)
+        for category in FEATURE_CATEGORIES:
+            expected = float(row_totals[category]) * column_total / total
+            if expected > 0:
+                statistic += (table[category][group_type] - expected) ** 2 / expected
+    return statistic
+
+def max_difference(table, group_types):
+    # Largest difference between the categories in the fraction of units in a group.
+    row_totals = dict((category, sum(table[category].itervalues())) for category in FEATURE_CATEGORIES)
+    if any(row_totals[category] == 0 for category in FEATURE_CATEGORIES):
+        return 0.0
+
+    false_total = float(row_totals["false"])
+    true_total = float(row_totals["true"])
+    return max([abs(table["true"][group_type] / true_total - table["false"][group_type] / false_total)
+                for group_type in group_types] + [0.0])
+
+STATISTICS = {
+    "chi2": chi_square,
+    "max_diff": max_difference
+}
+
+def scan(feature_bitsets, group_bits, group_types, statistic, top):
+    # Returns the 'top' features with the highest statistic, highest first.
+    statistic_fn = STATISTICS[statistic]
+    counts = dict((category, [(group_type, count_groups(feature_bitsets.category_bits[category], group_bits[group_type]))
+                              for group_type in group_types])
+                  for category in FEATURE_CATEGORIES)
+
+    scored = []
+    for index, feature_id in enumerate(feature_bitsets.feature_ids):
+        table = dict((category, dict((group_type, group_counts[index]) for group_type, group_counts in counts[category]))
+                     for category in FEATURE_CATEGORIES)
+        scored.append((statistic_fn(table, group_types), feature_id, index, table))
+
+    best = heapq.nlargest(top, scored, key=lambda item: (item[0], item[1]))
+    return [{
+        "id": feature_id,
+        "score": score,
+        "counts": table,
+        "category_sizes": dict((category, feature_bitsets.category_sizes[category][index]) for category in FEATURE_CATEGORIES)
+    } for score, feature_id, index, table in best]
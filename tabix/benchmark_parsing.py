@@ -0,0 +1,186 @@
+from collections import OrderedDict
+
+import argparse
+import json
+import random
+import resource
+import subprocess
+import sys
+import time
+
+from tabix_utils import parse_vcf_line, parse_region_lookup_result, parse_triotype_lookup_with_headers
+from tabix_utils import RowHeader
+from feature_data_source import FeatureData
+import variant_summary_lookup as vsl
+
+# Microbenchmarks for the parsing and aggregation steps of the tabix lookups and the Variant
+# Summary service, on synthetic data. Each stage and sample count runs in a child process, so that
+# the peak memory of one measurement does not include the others.
+#
+#   python benchmark_parsing.py --samples 100 1000 10000 --output results.json
+#   python benchmark_parsing.py --baseline results.json --output new_results.json
+
+DEFAULT_SAMPLE_COUNTS = [100, 1000, 10000]
+DEFAULT_REGION_ROWS = 200
+DEFAULT_MIN_TIME = 1.0
+DEFAULT_THRESHOLD = 0.1
+
+GENOTYPES = ['0/0', '0/1', '1/0', '1/1', './.']
+FAMILY_ROLES = ['F', 'M', 'NB1']
+
+class SyntheticData:
+    def __init__(self, sample_count, region_rows, seed=0):
+        rng = random.Random(seed)
+        family_count = max(sample_count // len(FAMILY_ROLES), 1)
+        self.family_ids = ["%d-%d" % (100 + i, 600 + i) for i in xrange(family_count)]
+        self.sample_ids = [family_id + "-" + role for family_id in self.family_ids for role in FAMILY_ROLES]
+
+        self.vcf_header = RowHeader(self.sample_ids)
+        self.vcf_line = "\t".join(["chr1", "1000", "rs1000", "A", "G", "50", "PASS", "DP=20", "GT"] +
+                                  [rng.choice(GENOTYPES) for sample_id in self.sample_ids])
+
+        triotype_header = "\t".join(["#CHR", "POS"] + self.family_ids)
+        triotype_line = "\t".join(["chr1", "1000"] + [rng.choice(vsl.TRIO_TYPES) for family_id in self.family_ids])
+        self.triotype_lines = ["##fileformat=triotypes", triotype_header, triotype_line]
+
+        tsv_lines = ["#" + "\t".join(["chromosome", "coordinate"] + self.sample_ids)]
+        for row in xrange(region_rows):
+            tsv_lines.append("\t".join(["chr1", str(1000 + row)] +
+                                       [rng.choice(GENOTYPES) for sample_id in self.sample_ids]))
+        self.tsv_region = "\n".join(tsv_lines) + "\n"
+
+        self.feature = FeatureData("B:CLIN:synthetic",
+                                   dict((family_id, rng.choice(vsl.FEATURE_CATEGORIES)) for family_id in self.family_ids))
+
+# Each stage returns the function to time, given the synthetic data.
+def stage_parse_vcf_line(data):
+    return lambda: parse_vcf_line(data.vcf_line, data.vcf_header)
+
+def stage_parse_region_lookup_result(data):
+    return lambda: parse_region_lookup_result(data.tsv_region)
+
+def stage_parse_triotype_lookup_with_headers(data):
+    return lambda: parse_triotype_lookup_with_headers(data.triotype_lines)
+
+def stage_process_triotypes(data):
+    triotypes = parse_triotype_lookup_with_headers(data.triotype_lines)
+    return lambda: vsl.process_triotypes(triotypes, data.feature)
+
+def stage_process_vcf(data):
+    vcf_data = parse_vcf_line(data.vcf_line, data.vcf_header)
+    return lambda: vsl.process_vcf(vcf_data, data.feature, '1')
+
+STAGES = OrderedDict([
+    ("parse_vcf_line", stage_parse_vcf_line),
+    ("parse_region_lookup_result", stage_parse_region_lookup_result),
+    ("parse_triotype_lookup_with_headers", stage_parse_triotype_lookup_with_headers),
+    ("process_triotypes", stage_process_triotypes),
+    ("process_vcf", stage_process_vcf)
+])
+
+def peak_rss_kb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measure(stage, sample_count, region_rows, min_time):
+    data = SyntheticData(sample_count, region_rows)
+    fn = STAGES[stage](data)
+    setup_rss = peak_rss_kb()
+
+    fn()
+    ops = 0
+    started = time.time()
+    elapsed = 0.0
+    while elapsed < min_time:
+        fn()
+        ops += 1
+        elapsed = time.time() - started
+
+    return {
+        "stage": stage,
+        "samples": sample_count,
+        "ops": ops,
+        "ops_per_sec": ops / elapsed,
+        "mean_us": elapsed / ops * 1e6,
+        "setup_rss_kb": setup_rss,
+        "peak_rss_kb": peak_rss_kb()
+    }
+
+def run_in_child(stage, sample_count, region_rows, min_time):
+    command = [sys.executable, __file__, "--child", stage, str(sample_count),
+               "--region-rows", str(region_rows), "--min-time", str(min_time)]
+    return json.loads(subprocess.check_output(command))
+
+def compare_to_baseline(results, baseline, threshold):
+    # Flags results with a throughput more than 'threshold' below the baseline.
+    baseline_results = dict(((r["stage"], r["samples"]), r) for r in baseline["results"])
+    regressions = []
+    for result in results:
+        previous = baseline_results.get((result["stage"], result["samples"]))
+        if previous is None:
+            continue
+        result["baseline_ops_per_sec"] = previous["ops_per_sec"]
+        result["change"] = result["ops_per_sec"] / previous["ops_per_sec"] - 1.0
+        result["regression"] = result["change"] < -threshold
+        if result["regression"]:
+            regressions.append(result)
+    return regressions
+
+def format_result(result):
+    line = "%-36s %6d samples %12.1f ops/s %12.1f us/op %9d kB peak" % (
+        result["stage"], result["samples"], result["ops_per_sec"], result["mean_us"], result["peak_rss_kb"])
+    if "change" in result:
+        line += " %+7.1f%%" % (result["change"] * 100.0)
+        if result["regression"]:
+            line += " REGRESSION"
+    return line
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks tabix_utils parsing and variant summary aggregation")
+    parser.add_argument('--samples', nargs='+', type=int, default=DEFAULT_SAMPLE_COUNTS, help='Sample counts')
+    parser.add_argument('--stages', nargs='+', choices=STAGES.keys(), default=STAGES.keys(), help='Stages to run')
+    parser.add_argument('--region-rows', type=int, default=DEFAULT_REGION_ROWS, help='Rows in the TSV region')
+    parser.add_argument('--min-time', type=float, default=DEFAULT_MIN_TIME, help='Seconds to run each measurement')
+    parser.add_argument('--output', help='Path of the JSON results file')
+    parser.add_argument('--baseline', help='JSON results file to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Relative slowdown against the baseline reported as a regression')
+    parser.add_argument('--child', nargs=2, metavar=('STAGE', 'SAMPLES'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        result = measure(args.child[0], int(args.child[1]), args.region_rows, args.min_time)
+        sys.stdout.write(json.dumps(result))
+        return 0
+
+    results = []
+    for sample_count in args.samples:
+        for stage in args.stages:
+            results.append(run_in_child(stage, sample_count, args.region_rows, args.min_time))
+
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_to_baseline(results, json.load(baseline_file), args.threshold)
+
+    for result in results:
+        print(format_result(result))
+
+    if args.output is not None:
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "region_rows": args.region_rows,
+            "min_time": args.min_time,
+            "results": results
+        }
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=4, sort_keys=True)
+
+    if len(regressions) > 0:
+        print(str(len(regressions)) + " regression(s) against " + args.baseline)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
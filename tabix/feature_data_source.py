@@ -1,8 +1,19 @@
 from collections import Counter
 
 import json
+import os
+import threading
 
+from lru_cache import LRUCache
 from pymongo import MongoClient
+from pymongo import DESCENDING
+
+# Parsed features kept per feature matrix file
+FEATURE_CACHE_SIZE = 1024
+
+# JSON feature matrix path -> FeatureMatrix
+FEATURE_MATRICES = {}
+FEATURE_MATRICES_LOCK = threading.Lock()
 
 class FeatureNotFoundError(Exception):
     def __init__(self, feature_id):
@@ -15,27 +26,68 @@ class FeatureData:
     def __init__(self, feature_id, value_dict):
         self.id = feature_id
         self.values = value_dict
-        self.value_array = [{'id': x[0], 'value': x[1]} for x in value_dict.iteritems()]
         self.aggregate = Counter(value_dict.values())
 
+class FeatureMatrix:
+    # Parsed feature matrix JSON file. FeatureData objects are built when a feature is first
+    # requested, and the most recently used ones are kept for later requests.
+    def __init__(self, signature, json_data):
+        self.signature = signature
+        self.sample_ids = json_data['sample_id_array']
+        self.feature_value_arrays = json_data['feature_value_array']
+        # As when building a dictionary of all features, the last of any duplicate IDs wins.
+        self.feature_index = dict((feature_id, index) for index, (feature_id, text_name) in enumerate(json_data['ordered_list']))
+        self.features = LRUCache(FEATURE_CACHE_SIZE, size_fn=lambda feature: 1)
+
+    def get_feature(self, feature_id):
+        feature = self.features.get(feature_id)
+        if feature is None:
+            if feature_id not in self.feature_index:
+                raise FeatureNotFoundError(feature_id)
+            value_dict = dict(zip(self.sample_ids, self.feature_value_arrays[self.feature_index[feature_id]]))
+            feature = FeatureData(feature_id, value_dict)
+            self.features.put(feature_id, feature)
+        return feature
+
+def file_signature(path):
+    stat = os.stat(path)
+    return (stat.st_mtime, stat.st_size)
+
+def get_feature_matrix(path):
+    # The file is parsed again when its modification time or size changes.
+    signature = file_signature(path)
+    matrix = FEATURE_MATRICES.get(path)
+    if matrix is not None and matrix.signature == signature:
+        return matrix
+
+    with FEATURE_MATRICES_LOCK:
+        matrix = FEATURE_MATRICES.get(path)
+        if matrix is None or matrix.signature != signature:
+            with open(path) as json_file:
+                json_data = json.load(json_file)
+            matrix = FeatureMatrix(signature, json_data)
+            FEATURE_MATRICES[path] = matrix
+        return matrix
+
 def create_mongo_connection(uri):
     c = MongoClient(uri)
     return c
 
+def feature_matrix_version(config):
+    # Changes when the feature matrix changes: the signature of a JSON file, or the number of
+    # documents and the largest ObjectId of a MongoDB collection.
+    if config['type'] == 'json':
+        return file_signature(config['path'])
+
+    client = create_mongo_connection(config['host'])
+    feature_matrix_collection = client[config['database']][config['collection']]
+    last_id = None
+    for feature_matrix in feature_matrix_collection.find({}, {"_id": 1}).sort("_id", DESCENDING).limit(1):
+        last_id = feature_matrix["_id"]
+    return (feature_matrix_collection.count(), last_id)
+
 def get_feature_by_id_from_json(config, param_feature_id):
-    with open(config['path']) as json_file:
-        json_data = json.load(json_file)
-    feature_map = {}
-    sample_ids = json_data['sample_id_array']
-    feature_value_arrays = json_data['feature_value_array']
-    feature_list = json_data['ordered_list']
-    for index, (feature_id, text_name) in zip(xrange(len(feature_list)), feature_list):
-        feature_map[feature_id] = dict(zip(sample_ids, feature_value_arrays[index]))
-
-    if param_feature_id in feature_map:
-        return feature_map[param_feature_id]
-    else:
-        raise FeatureNotFoundError(param_feature_id)
+    return get_feature_matrix(config['path']).get_feature(param_feature_id).values
 
 def get_feature_by_id_from_mongodb(config, feature_id):
     client = create_mongo_connection(config['host'])
@@ -59,6 +111,7 @@ def get_feature_by_id(config, feature_id):
     if matrix_datasource_type  == 'mongodb':
         value_dict = get_feature_by_id_from_mongodb(config, feature_id)
     elif matrix_datasource_type == 'json':
-        value_dict = get_feature_by_id_from_json(config, feature_id)
+        # Cached FeatureData, shared by all requests for the feature
+        return get_feature_matrix(config['path']).get_feature(feature_id)
 
     return FeatureData(feature_id, value_dict)
@@ -0,0 +1,181 @@
+import collections
+import functools
+import sys
+import threading
+
+import tornado.ioloop
+
+# Runs blocking lookups (tabix processes, file reads, MongoDB queries) for the request handlers.
+# When no pool is configured, lookups run synchronously on the IOLoop as before. Otherwise they run
+# on a bounded thread pool; requests beyond the pool size wait for a free slot, so at most
+# 'max_workers' lookups, and their tabix processes, are running at any time.
+#
+# Usage from a handler decorated with @tornado.web.asynchronous and @tornado.gen.engine:
+#
+#     outcome = yield tornado.gen.Task(lookup_executor.run, lookup_fn, arg1, arg2)
+#     result = outcome.get()
+#
+# A lookup that fetches several parts at the same time, on a pool of its own, runs each part in a
+# slot taken with try_acquire_slot, or in its own slot one after another if no slot is free.
+#
+# Streamed lookups keep their tabix process running between chunks, while no pool thread is busy
+# with them. They have a budget of 'max_streams' stream slots of their own, so that slow clients
+# cannot hold the slots of other lookups, and read their chunks with run_in_slot:
+#
+#     yield tornado.gen.Task(lookup_executor.acquire_stream_slot)
+#     try:
+#         outcome = yield tornado.gen.Task(lookup_executor.run_in_slot, next_chunk_fn, rows)
+#         ...
+#     finally:
+#         lookup_executor.release_stream_slot()
+
+POOL = None
+SLOTS = None
+STREAM_SLOTS = None
+
+class LookupOutcome(object):
+    def __init__(self, result=None, exc_info=None):
+        self.result = result
+        self.exc_info = exc_info
+
+    def get(self):
+        # Re-raises the exception of a failed lookup in the handler, with the original traceback.
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result
+
+class LookupSlots(object):
+    # Counts the lookups running in the pool, or the open streamed lookups. Waiting lookups are
+    # queued on the IOLoop thread; slots are taken without waiting and released from any thread.
+    def __init__(self, size):
+        self.size = size
+        self.used = 0
+        self._waiting = collections.deque()
+        self._lock = threading.Lock()
+
+    def acquire(self, callback):
+        with self._lock:
+            acquired = self.used < self.size
+            if acquired:
+                self.used += 1
+            else:
+                self._waiting.append(callback)
+        if acquired:
+            callback()
+
+    def try_acquire(self):
+        # Returns True if a free slot was taken.
+        with self._lock:
+            if self.used < self.size:
+                self.used += 1
+                return True
+            return False
+
+    def release(self):
+        # A released slot is handed to the next waiting lookup, if any.
+        with self._lock:
+            next_callback = None
+            if self._waiting:
+                next_callback = self._waiting.popleft()
+            else:
+                self.used -= 1
+        if next_callback is not None:
+            tornado.ioloop.IOLoop.instance().add_callback(next_callback)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "used": self.used,
+                "waiting": len(self._waiting)
+            }
+
+def configure(max_workers, max_streams=None):
+    # 'max_streams' defaults to 'max_workers'.
+    global POOL, SLOTS, STREAM_SLOTS
+
+    if POOL is not None:
+        POOL.terminate()
+        POOL = None
+        SLOTS = None
+        STREAM_SLOTS = None
+
+    if max_workers is not None and max_workers > 0:
+        from multiprocessing.pool import ThreadPool
+        POOL = ThreadPool(max_workers)
+        SLOTS = LookupSlots(max_workers)
+        if not max_streams:
+            max_streams = max_workers
+        STREAM_SLOTS = LookupSlots(max_streams)
+
+def is_async():
+    return POOL is not None
+
+def slot_stats():
+    if SLOTS is None:
+        return None
+    return SLOTS.stats()
+
+def stream_slot_stats():
+    if STREAM_SLOTS is None:
+        return None
+    return STREAM_SLOTS.stats()
+
+def call_lookup(fn, args, kwargs):
+    try:
+        return LookupOutcome(result=fn(*args, **kwargs))
+    except Exception:
+        return LookupOutcome(exc_info=sys.exc_info())
+
+def acquire_slot(callback):
+    # Without a pool, lookups run one at a time on the IOLoop and are not limited.
+    if SLOTS is None:
+        callback()
+        return
+    SLOTS.acquire(callback)
+
+def try_acquire_slot():
+    # May be called from any thread. Without a pool, there is no limit.
+    if SLOTS is None:
+        return True
+    return SLOTS.try_acquire()
+
+def release_slot():
+    if SLOTS is not None:
+        SLOTS.release()
+
+def acquire_stream_slot(callback):
+    # Without a pool, streams are not limited.
+    if STREAM_SLOTS is None:
+        callback()
+        return
+    STREAM_SLOTS.acquire(callback)
+
+def release_stream_slot():
+    if STREAM_SLOTS is not None:
+        STREAM_SLOTS.release()
+
+def run_in_slot(fn, *args, **kwargs):
+    # Runs a lookup for a caller that holds a lookup or stream slot already.
+    callback = kwargs.pop('callback')
+
+    if POOL is None:
+        callback(call_lookup(fn, args, kwargs))
+        return
+
+    io_loop = tornado.ioloop.IOLoop.instance()
+
+    def on_done(outcome):
+        # Called on a pool thread, add_callback hands the outcome back to the IOLoop thread.
+        io_loop.add_callback(functools.partial(callback, outcome))
+
+    POOL.apply_async(call_lookup, (fn, args, kwargs), callback=on_done)
+
+def run(fn, *args, **kwargs):
+    callback = kwargs.pop('callback')
+
+    def on_done(outcome):
+        release_slot()
+        callback(outcome)
+
+    acquire_slot(lambda: run_in_slot(fn, *args, callback=on_done, **kwargs))
@@ -0,0 +1,22 @@
+import tornado.web
+
+import json
+
+import lookup_executor
+import single_flight
+import tabix_reader
+from tabix_lookup import RESULT_CACHES
+
+class LookupStatsHandler(tornado.web.RequestHandler):
+    # Counters of the lookup services: requests and deduplicated requests per handler, and the
+    # usage of the lookup and stream slots, the BGZF block cache and the tabix result caches.
+    def get(self):
+        stats = {
+            "single_flight": single_flight.all_stats(),
+            "lookup_slots": lookup_executor.slot_stats(),
+            "stream_slots": lookup_executor.stream_slot_stats(),
+            "block_cache": tabix_reader.block_cache_stats(),
+            "result_caches": dict((tabix_id, cache.stats()) for tabix_id, cache in RESULT_CACHES.iteritems())
+        }
+        self.write(json.dumps(stats, sort_keys=True))
+        self.set_status(200)
@@ -0,0 +1,68 @@
+from collections import OrderedDict
+
+import threading
+import time
+
+class LRUCache(object):
+    # Thread-safe least-recently-used cache with a budget on the total size of the cached values.
+    # 'size_fn' returns the size of a value in bytes. With 'ttl' set, entries expire that many
+    # seconds after they were stored.
+    def __init__(self, max_bytes, size_fn=len, ttl=None):
+        self.max_bytes = max_bytes
+        self.size_fn = size_fn
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[2] is not None and entry[2] < time.time():
+                self._bytes -= entry[1]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.size_fn(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+
+            expires = None
+            if self.ttl is not None:
+                expires = time.time() + self.ttl
+
+            self._entries[key] = (value, size, expires)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                evicted_key, evicted_entry = self._entries.popitem(last=False)
+                self._bytes -= evicted_entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes
+            }
@@ -0,0 +1,163 @@
+from array import array
+from tornado.options import logging
+
+import argparse
+import bisect
+import cPickle
+import os
+import sys
+import threading
+
+import tabix_reader
+
+# Sorted start positions of all records per sequence name, so that lookups of positions without
+# a record can be answered without running tabix. The index of "<file>" is saved as "<file>.pos",
+# together with the signature of the data file it was built from, and is rebuilt when the data
+# file changes.
+
+PRESENCE_INDEX_SUFFIX = ".pos"
+PRESENCE_INDEX_VERSION = 1
+
+# data file path -> PresenceIndex
+INDEXES = {}
+INDEXES_LOCK = threading.Lock()
+
+class PresenceIndex(object):
+    def __init__(self, signature, positions):
+        self.signature = signature
+        # Sequence name -> array('I') of one-based start positions, in ascending order
+        self.positions = positions
+
+    def has_record(self, sequence, start, end):
+        # True if a record starts within the one-based, inclusive range [start, end]. Only start
+        # positions are indexed: a record that starts before 'start' and overlaps the range, as a VCF
+        # record with a long reference allele does, is not reported. The index can therefore only
+        # answer lookups of the record starting at one position, never region lookups.
+        positions = self.positions.get(sequence)
+        if positions is None:
+            return False
+        first = bisect.bisect_left(positions, int(start))
+        return first < len(positions) and positions[first] <= int(end)
+
+def iter_record_starts(reader):
+    # Yields (sequence name, one-based start) for every record of a tabix-indexed file. The blocks
+    # are read past the block cache, which should only hold blocks of queried regions.
+    index = reader.index
+    col_seq = index.col_seq - 1
+    col_beg = index.col_beg - 1
+    offset = 0
+    if index.format & tabix_reader.TBI_FORMAT_ZERO_BASED:
+        offset = 1
+
+    line_number = 0
+    remainder = ""
+    with open(reader.path, 'rb') as file_handle:
+        coffset = 0
+        while True:
+            data, coffset = tabix_reader.read_bgzf_block(file_handle, coffset)
+            if data is None:
+                break
+            lines = (remainder + data).split("\n")
+            remainder = lines.pop()
+            for line in lines:
+                line_number += 1
+                if line_number <= index.skip or not line or line[0] == index.meta_char:
+                    continue
+                fields = line.split('\t')
+                yield fields[col_seq], int(fields[col_beg]) + offset
+
+    if remainder and line_number >= index.skip and remainder[0] != index.meta_char:
+        fields = remainder.split('\t')
+        yield fields[col_seq], int(fields[col_beg]) + offset
+
+def build_presence_index(file_path):
+    signature = tabix_reader.file_signature(file_path)
+    positions = {}
+    for sequence, start in iter_record_starts(tabix_reader.TabixReader(file_path)):
+        if sequence not in positions:
+            positions[sequence] = array('I')
+        positions[sequence].append(start)
+
+    for sequence, sequence_positions in positions.items():
+        if any(sequence_positions[i] > sequence_positions[i + 1] for i in xrange(len(sequence_positions) - 1)):
+            positions[sequence] = array('I', sorted(sequence_positions))
+
+    return PresenceIndex(signature, positions)
+
+def save_presence_index(presence_index, index_path):
+    data = {
+        "version": PRESENCE_INDEX_VERSION,
+        "signature": presence_index.signature,
+        "positions": dict((sequence, positions.tostring()) for sequence, positions in presence_index.positions.iteritems())
+    }
+    # Written to a temporary file first, so that other processes never read a partial index.
+    temp_path = index_path + "." + str(os.getpid()) + ".tmp"
+    with open(temp_path, 'wb') as index_file:
+        cPickle.dump(data, index_file, cPickle.HIGHEST_PROTOCOL)
+    os.rename(temp_path, index_path)
+
+def load_presence_index(index_path, signature):
+    # Returns None if there is no saved index, or if it was built from another version of the file.
+    try:
+        with open(index_path, 'rb') as index_file:
+            data = cPickle.load(index_file)
+    except IOError:
+        return None
+    except Exception as e:
+        logging.warn("Presence index \'" + index_path + "\' could not be read: " + str(e))
+        return None
+
+    if not isinstance(data, dict) or data.get("version") != PRESENCE_INDEX_VERSION:
+        return None
+    if tuple(data.get("signature", ())) != tuple(signature):
+        return None
+
+    positions = {}
+    for sequence, packed in data["positions"].iteritems():
+        positions[sequence] = array('I')
+        positions[sequence].fromstring(packed)
+    return PresenceIndex(signature, positions)
+
+def get_presence_index(file_path):
+    signature = tabix_reader.file_signature(file_path)
+    presence_index = INDEXES.get(file_path)
+    if presence_index is not None and presence_index.signature == signature:
+        return presence_index
+
+    with INDEXES_LOCK:
+        presence_index = INDEXES.get(file_path)
+        if presence_index is not None and presence_index.signature == signature:
+            return presence_index
+
+        index_path = file_path + PRESENCE_INDEX_SUFFIX
+        presence_index = load_presence_index(index_path, signature)
+        if presence_index is None:
+            logging.info("Building presence index for \'" + file_path + "\'")
+            presence_index = build_presence_index(file_path)
+            try:
+                save_presence_index(presence_index, index_path)
+            except (IOError, OSError) as e:
+                # The index is still used from memory, and built again after a restart.
+                logging.warn("Presence index \'" + index_path + "\' could not be saved: " + str(e))
+
+        INDEXES[file_path] = presence_index
+        return presence_index
+
+def has_record(file_path, chromosome, start, end):
+    # 'chromosome' is given without the "chr" prefix, as in the lookup functions. See
+    # PresenceIndex.has_record for what the index can answer.
+    return get_presence_index(file_path).has_record("chr" + str(chromosome), start, end)
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds the presence index of tabix-indexed files")
+    parser.add_argument('files', nargs='+', help='bgzip-compressed, tabix-indexed data files')
+    args = parser.parse_args()
+
+    for file_path in args.files:
+        presence_index = build_presence_index(file_path)
+        save_presence_index(presence_index, file_path + PRESENCE_INDEX_SUFFIX)
+        sys.stdout.write(file_path + PRESENCE_INDEX_SUFFIX + ": " +
+                         str(sum(len(positions) for positions in presence_index.positions.itervalues())) + " positions\n")
+
+if __name__ == "__main__":
+    main()
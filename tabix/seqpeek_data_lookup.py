@@ -1,12 +1,18 @@
 from tornado.options import options, logging
+import tornado.gen
 import tornado.web
 
 import json
+import urlparse
 
 import seqpeek_data_service as sds
+from single_flight import get_single_flight
 
 sds.local_pprint = logging.debug
 
+# Identical gene queries in flight at the same time are run once, see single_flight.py
+QUERIES = get_single_flight("seqpeek_data")
+
 class SeqPeekDataHandler(tornado.web.RequestHandler):
     def initialize(self):
         sds.mDEBUG = options.verbose
@@ -22,6 +28,8 @@ class SeqPeekDataHandler(tornado.web.RequestHandler):
         else:
             self.write("Server error occurred")
 
+    @tornado.web.asynchronous
+    @tornado.gen.engine
     def get(self, *uri_path):
         sub_path = self.request.path.replace("/seqpeek_data", "")
         uri_parts = sub_path.split("/")
@@ -42,15 +50,32 @@ class SeqPeekDataHandler(tornado.web.RequestHandler):
         gene_label = self.get_argument("gene")
         logging.debug("Querying SeqPeek data for gene \'" + gene_label + "\'")
 
+        # Optional comma-separated feature IDs, to count only those features. The query string is read
+        # with blank values, which request.arguments leaves out, so that "features=" is rejected.
+        feature_ids = None
+        feature_arguments = urlparse.parse_qs(self.request.query, keep_blank_values=True).get("features")
+        if feature_arguments is not None:
+            feature_ids = [feature_id.strip() for value in feature_arguments for feature_id in value.split(',')
+                           if len(feature_id.strip()) > 0]
+            if len(feature_ids) == 0:
+                logging.error("Empty feature list in request arguments: [%s]" % str(self.request.arguments))
+                self.send_error(400)
+                return
+
         seqObj = sds.SeqPeekResult(config)
         
         seqObj.full_gene = False
         seqObj.gene_name = gene_label
+        seqObj.feature_ids = feature_ids
+
+        query_key = (data_id, gene_label, None if feature_ids is None else tuple(feature_ids))
+        outcome = yield tornado.gen.Task(QUERIES.run, query_key, sds.do_gene_query, seqObj)
 
         try:
-            result = sds.do_gene_query(seqObj)
+            result = outcome.get()
             self.write(json.dumps(result, sort_keys=True))
             self.set_status(200)
+            self.finish()
 
         except Exception as e:
             logging.error("Running SeqPeek data service failed: " + str(e))
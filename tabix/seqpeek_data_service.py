@@ -3,11 +3,20 @@ from collections import Counter
 import sys
 import argparse
 import json
+import operator
+import threading
+import time
 from pprint import pprint
 from pymongo import MongoClient
 from pymongo import ASCENDING
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 import tabix_utils as TU
+from feature_data_source import feature_matrix_version
 
 CHROMOSOME_SET = [str(x) for x in xrange(1, 23)] + list(['M', 'X', 'Y'])
 
@@ -90,6 +99,9 @@ def set_parameters(seqObj, args):
 
     if 'full_gene' in args and args.full_gene is not None:
         seqObj.full_gene = args.full_gene # true/false
+
+    if 'features' in args and args.features is not None:
+        seqObj.feature_ids = args.features
     
     if 'debug' in args and args.debug is not False:
         global mDEBUG
@@ -256,14 +268,15 @@ def get_features_from_json(seqObj):
 
     seqObj.features = feature_map  
 
+def get_feature_matrix_collection(matrix_datasource_config):
+    client = create_mongo_connection(matrix_datasource_config['host'])
+    db = client[matrix_datasource_config['database']]
+    return db[matrix_datasource_config['collection']]
+
 # create a mongo connection to the feature_matrix_uri
 # retrieve and store feature results
 def get_features_from_mongodb(seqObj):
-    matrix_datasource_config = seqObj.config['feature_matrix']
-
-    client = create_mongo_connection(matrix_datasource_config['host'])
-    db = client[matrix_datasource_config['database']]
-    feature_matrix_collection = db[matrix_datasource_config['collection']]
+    feature_matrix_collection = get_feature_matrix_collection(seqObj.config['feature_matrix'])
     all_features = {}
     for feature_matrix in feature_matrix_collection.find():
         all_features[feature_matrix["id"]] = feature_matrix["v"]
@@ -283,6 +296,181 @@ def get_features(seqObj):
     elif matrix_datasource_type == 'json':
         get_features_from_json(seqObj)
 
+# The feature matrix and its aggregates are loaded once per process and shared by all requests,
+# which must not modify them. They are loaded again when the JSON file or the number of documents
+# or largest ObjectId of the MongoDB collection changes, and at least every "refresh_interval"
+# seconds of the feature matrix configuration.
+DEFAULT_FEATURE_REFRESH_INTERVAL = 600
+
+# feature matrix key -> CachedFeatures
+FEATURE_CACHE = {}
+FEATURE_CACHE_LOCK = threading.Lock()
+
+class CachedFeatures():
+    def __init__(self, version, features, feature_aggregates):
+        self.version = version
+        self.features = features
+        self.feature_aggregates = feature_aggregates
+        self.loaded = time.time()
+
+def feature_matrix_key(matrix_datasource_config):
+    if matrix_datasource_config['type'] == 'json':
+        return ('json', matrix_datasource_config['path'])
+    return ('mongodb', matrix_datasource_config['host'], matrix_datasource_config['database'],
+            matrix_datasource_config['collection'])
+
+def load_features(seqObj):
+    # Sets the features and feature aggregates of seqObj from the cache.
+    matrix_datasource_config = seqObj.config['feature_matrix']
+    key = feature_matrix_key(matrix_datasource_config)
+    refresh_interval = matrix_datasource_config.get('refresh_interval', DEFAULT_FEATURE_REFRESH_INTERVAL)
+
+    version = feature_matrix_version(matrix_datasource_config)
+    cached = FEATURE_CACHE.get(key)
+    if cached is None or cached.version != version or time.time() - cached.loaded > refresh_interval:
+        with FEATURE_CACHE_LOCK:
+            cached = FEATURE_CACHE.get(key)
+            if cached is None or cached.version != version or time.time() - cached.loaded > refresh_interval:
+                control_print("loading feature matrix " + str(key))
+                get_features(seqObj)
+                aggregate_features(seqObj)
+                cached = CachedFeatures(version, seqObj.features, seqObj.feature_aggregates)
+                FEATURE_CACHE[key] = cached
+
+    seqObj.features = cached.features
+    seqObj.feature_aggregates = cached.feature_aggregates
+
+def select_features(seqObj):
+    # With seqObj.feature_ids, only those features are counted and aggregated. IDs that are not in
+    # the feature matrix are left out.
+    feature_ids = getattr(seqObj, 'feature_ids', None)
+    if feature_ids is None:
+        return
+
+    seqObj.features = dict((feature_id, seqObj.features[feature_id]) for feature_id in feature_ids
+                           if feature_id in seqObj.features)
+    seqObj.feature_aggregates = dict((feature_id, seqObj.feature_aggregates[feature_id]) for feature_id in feature_ids
+                                     if feature_id in seqObj.feature_aggregates)
+
+COMPOSITE_KEY_FIELDS = ['chr',
+                        'coordinate',
+                        'gene',
+                        'transcript',
+                        'variant',
+                        'type',
+                        'uniprot_id',
+                        'protein_change']
+
+# Fields read from each row: the composite key, the sample ID and the genotype
+ROW_FIELDS = COMPOSITE_KEY_FIELDS + ['sample_id', 'genotype']
+
+def iter_row_fields(rows):
+    # Yields the ROW_FIELDS values of each row, up to the first empty row. Complete rows that share
+    # a header are read by position instead of by key.
+    header = None
+    getter = None
+    for row in rows:
+        if isinstance(row, TU.SharedHeaderRow) and len(row.value_list) >= len(row.header.names) > 0:
+            if row.header is not header:
+                header = row.header
+                getter = operator.itemgetter(*[header.index[field] for field in ROW_FIELDS])
+            yield getter(row.value_list)
+        elif not row:
+            return
+        else:
+            yield [row[field] for field in ROW_FIELDS]
+
+# The statistics of a variant map each feature to the number of rows per feature value of the
+# row's family, with 'na' for families missing from the feature. Variants with the same counts
+# share one statistic dictionary, which must not be modified. The key order of the dictionaries is
+# not kept, the handler serializes them with sorted keys.
+
+class ValueCodes(dict):
+    # Feature value -> code, numbered in the order the values are first looked up
+    def __init__(self):
+        dict.__init__(self)
+        self.names = []
+
+    def __missing__(self, value):
+        self[value] = len(self.names)
+        self.names.append(value)
+        return self[value]
+
+def family_value_codes(feature_values, families, value_codes):
+    return map(value_codes.__getitem__, map(feature_values.get, families, ['na'] * len(families)))
+
+def shared_statistic(shared, value_codes, signature):
+    # 'signature' is a tuple of (value code, count) pairs, in ascending order of value codes
+    if signature not in shared:
+        shared[signature] = dict((value_codes.names[value], count) for value, count in signature)
+    return shared[signature]
+
+def build_statistics(feature_ids, statistics_by_feature, key_count):
+    # One statistics_by_feature dictionary per variant, from a list of statistics per feature
+    if len(feature_ids) == 0:
+        return [{} for key in xrange(key_count)]
+    return [dict(zip(feature_ids, key_statistics)) for key_statistics in zip(*statistics_by_feature)]
+
+def count_feature_values(features, row_keys, row_families, families, key_count):
+    feature_ids = list(features)
+    if key_count == 0:
+        return []
+    value_codes = ValueCodes()
+    # ((value code, count), ...) -> statistic dictionary
+    shared = {}
+
+    statistics_by_feature = []
+    for feature_id in feature_ids:
+        family_values = family_value_codes(features[feature_id], families, value_codes)
+        key_counts = [{} for key in xrange(key_count)]
+        for key, family in zip(row_keys, row_families):
+            counts = key_counts[key]
+            value = family_values[family]
+            counts[value] = counts.get(value, 0) + 1
+
+        statistics_by_feature.append([shared_statistic(shared, value_codes, tuple(sorted(counts.iteritems())))
+                                      for counts in key_counts])
+
+    return build_statistics(feature_ids, statistics_by_feature, key_count)
+
+def count_feature_values_vectorized(features, row_keys, row_families, families, key_count):
+    # As count_feature_values, with the rows of all variants counted at once for each feature.
+    feature_ids = list(features)
+    if key_count == 0:
+        return []
+    value_codes = ValueCodes()
+    # ((value code, count), ...) -> statistic dictionary
+    shared = {}
+
+    keys = numpy.array(row_keys, dtype=numpy.intp)
+    row_families = numpy.array(row_families, dtype=numpy.intp)
+
+    statistics_by_feature = []
+    for feature_id in feature_ids:
+        family_values = numpy.array(family_value_codes(features[feature_id], families, value_codes), dtype=numpy.intp)
+        codes, row_values = numpy.unique(family_values[row_families], return_inverse=True)
+
+        # Rows per variant and value of the feature. Variants with the same counts are grouped by
+        # the flat index of their counts in a table of all possible counts, or by the rows of the
+        # counts if that index does not fit.
+        counts = numpy.bincount(keys * len(codes) + row_values,
+                                minlength=key_count * len(codes)).reshape(key_count, len(codes))
+        try:
+            flat_counts = numpy.ravel_multi_index(counts.T, (int(counts.max()) + 1,) * len(codes))
+            unique_flat_counts, first_keys, inverse = numpy.unique(flat_counts, return_index=True, return_inverse=True)
+            unique_counts = counts[first_keys]
+        except ValueError:
+            unique_counts, inverse = numpy.unique(counts, axis=0, return_inverse=True)
+
+        codes = codes.tolist()
+        unique_statistics = numpy.empty(len(unique_counts), dtype=object)
+        for index, value_counts in enumerate(unique_counts.tolist()):
+            signature = tuple((code, count) for code, count in zip(codes, value_counts) if count > 0)
+            unique_statistics[index] = shared_statistic(shared, value_codes, signature)
+        statistics_by_feature.append(unique_statistics[inverse].tolist())
+
+    return build_statistics(feature_ids, statistics_by_feature, key_count)
+
 # create the variants dict
 # query the variants from the variant file
 # calculate the statistics for each gene_name, transcript_id, variant
@@ -290,53 +478,49 @@ def get_features(seqObj):
 def tabix_query_variant(seqObj):
     tabix_variant_file = seqObj.config['variant_file']
     tabix_exe = seqObj.config['tabix_executable'] + " -h" 
-    tabix_output = TU.tsv_region_lookup(tabix_exe, tabix_variant_file, seqObj.chromosome, seqObj.start, seqObj.end)
+    tabix_output = TU.tsv_region_lookup(tabix_exe, tabix_variant_file, seqObj.chromosome, seqObj.start, seqObj.end,
+                                        reader=seqObj.config.get('reader'))
 
     features = seqObj.features
     # chromosome position gene_name transcript_id variant family_id variant_type uniprot_id zygosity amino_acid_variant
     #chr1    908929  PLEKHN1 NM_032129       C->T    101-641-NB      SUBSTITUTION    Q494U1-2  ''  heterozygous '' S448L
-    counter = {}
-    for row in tabix_output.values:
-        if not row:
-            break
-        composite_key_fields = ['chr',
-                                'coordinate',
-                                'gene',
-                                'transcript',
-                                'variant',
-                                'type',
-                                'uniprot_id',
-                                'protein_change']
-        
-        composite_key = "\t".join([(lambda key: row[key])(key) for key in composite_key_fields])
-        id = row['sample_id']
-        zygosity = row['genotype']
-        control_print("processing composite_key %s id %s zygosity %s" % (composite_key, id, zygosity))
-        if composite_key not in counter:
-            counter[composite_key] = {}
-        for feature in features:
-            if feature not in counter[composite_key]:
-                counter[composite_key][feature] = {}
-
+    # Composite keys and families are numbered in the order they are first seen. The composite
+    # keys are iterated in the order of this dictionary below.
+    key_index = {}
+    row_keys = []
+    family_index = {}
+    row_families = []
+    key_field_count = len(COMPOSITE_KEY_FIELDS)
+    for fields in iter_row_fields(tabix_output.values):
+        composite_key = "\t".join(fields[:key_field_count])
+        id, zygosity = fields[key_field_count:]
+        if mDEBUG:
+            control_print("processing composite_key %s id %s zygosity %s" % (composite_key, id, zygosity))
+        if composite_key not in key_index:
+            key_index[composite_key] = len(key_index)
+        row_keys.append(key_index[composite_key])
+
+        if len(features) > 0:
             # take the member off the end of the id
-            family_info = id.split('-')
-            member_id = family_info.pop()
-            family_id = ('-').join(family_info)
-            # get the feature matrix value of this 
-            if family_id not in features[feature]:
-                feature_value = 'na'
-            else:
-                feature_value = features[feature][family_id] # should be true, false, or na
-            #control_print("found feature_value %s for id %s for feature %s" % (feature_value, family_id, feature))
-            if feature_value not in counter[composite_key][feature]:
-                counter[composite_key][feature][feature_value] = []
-            counter[composite_key][feature][feature_value].append(id)
-        
-    control_pprint(counter)
+            family_id = id.rsplit('-', 1)[0] if '-' in id else ''
+            if family_id not in family_index:
+                family_index[family_id] = len(family_index)
+            row_families.append(family_index[family_id])
+
+    families = [None] * len(family_index)
+    for family_id, family_code in family_index.iteritems():
+        families[family_code] = family_id
+
+    if numpy is not None:
+        statistics_by_key = count_feature_values_vectorized(features, row_keys, row_families, families, len(key_index))
+    else:
+        statistics_by_key = count_feature_values(features, row_keys, row_families, families, len(key_index))
+    control_print("counted %d rows of %d variants for %d features" % (len(row_keys), len(key_index), len(features)))
+
     results = {}
     transcripts = {}
 
-    for composite_key in counter:
+    for composite_key in key_index:
         split_key = composite_key.split('\t')
         chromosome = split_key[0]
         coordinate = split_key[1]
@@ -380,15 +564,7 @@ def tabix_query_variant(seqObj):
         local_result['uniprot_id'] = uniprot
         local_result['protein_change'] = protein_change
         local_result['variant_type'] = variant_type
-        local_result['statistics_by_feature'] = {}
-        
-        for feature in features:
-            control_print("feature is "+feature)
-            local_statistic = {}
-            
-            for count_type in counter[composite_key][feature]:
-                local_statistic[count_type] = len(counter[composite_key][feature][count_type])
-            local_result['statistics_by_feature'][feature] = local_statistic
+        local_result['statistics_by_feature'] = statistics_by_key[key_index[composite_key]]
         control_print("local results is :")
         control_pprint(local_result)
         transcripts[transcript]['id'] = transcript
@@ -437,12 +613,12 @@ def example_object():
 
 def do_gene_query(seq_obj):
     get_region_data(seq_obj)
-    get_features(seq_obj)
-    aggregate_features(seq_obj)
+    load_features(seq_obj)
+    select_features(seq_obj)
     return tabix_query_variant(seq_obj)
 
 
-def main():
+def create_argument_parser():
     mainparser = argparse.ArgumentParser(description="SeqPeekDataService")
 
     mainparser.add_argument('--config',nargs=1,help='Config File')
@@ -450,9 +626,14 @@ def main():
     mainparser.add_argument('--start', nargs=1, type=int, help='Coordinate Start')
     mainparser.add_argument('--end', nargs=1, type=int, help='Coordinate End')
     mainparser.add_argument('--gene_name', nargs=1, help='Gene Name')
+    mainparser.add_argument('--features', nargs='+', help='Feature IDs to count, default all')
     mainparser.add_argument('--full_gene', help='Return entire gene information (not variants) for partial overlap of coordinates',action="store_true")
     mainparser.add_argument('--debug', help='Print debug information',action="store_true")
     mainparser.add_argument('--example',help="Produce an Example object",action="store_true")
+    return mainparser
+
+def main():
+    mainparser = create_argument_parser()
 
     try:
         args = mainparser.parse_args()
@@ -484,6 +665,7 @@ def main():
         get_region_data(seqObj)
         get_features(seqObj)
         aggregate_features(seqObj)
+        select_features(seqObj)
         results = tabix_query_variant(seqObj)
         control_print(seqObj)
         control_print("\n\n")
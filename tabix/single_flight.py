@@ -0,0 +1,63 @@
+import functools
+
+import tornado.ioloop
+
+import lookup_executor
+
+# Coalesces identical lookups that are in flight at the same time: the first request for a key
+# starts the lookup on the executor, and requests for the same key arriving before it completes
+# wait for the same outcome instead of running the lookup again.
+#
+# Usage from a handler decorated with @tornado.web.asynchronous and @tornado.gen.engine:
+#
+#     outcome = yield tornado.gen.Task(LOOKUPS.run, key, lookup_fn, arg1, arg2)
+#     result = outcome.get()
+#
+# Callbacks are registered and called on the IOLoop thread only, so no locking is needed. The
+# result is shared by all waiting requests and must not be modified by them.
+
+# name -> SingleFlight
+REGISTRY = {}
+
+class SingleFlight(object):
+    def __init__(self, name):
+        self.name = name
+        self.requests = 0
+        self.deduplicated = 0
+        # key -> callbacks waiting for the lookup in flight
+        self._waiters = {}
+
+    def run(self, key, fn, *args, **kwargs):
+        callback = kwargs.pop('callback')
+        self.requests += 1
+
+        if key in self._waiters:
+            self.deduplicated += 1
+            self._waiters[key].append(callback)
+            return
+
+        self._waiters[key] = [callback]
+
+        def on_done(outcome):
+            # Each request continues in its own IOLoop callback, so that an error in one of them
+            # does not keep the outcome from the others.
+            io_loop = tornado.ioloop.IOLoop.instance()
+            for waiting_callback in self._waiters.pop(key):
+                io_loop.add_callback(functools.partial(waiting_callback, outcome))
+
+        lookup_executor.run(fn, *args, callback=on_done, **kwargs)
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "deduplicated": self.deduplicated,
+            "in_flight": len(self._waiters)
+        }
+
+def get_single_flight(name):
+    if name not in REGISTRY:
+        REGISTRY[name] = SingleFlight(name)
+    return REGISTRY[name]
+
+def all_stats():
+    return dict((name, single_flight.stats()) for name, single_flight in REGISTRY.iteritems())
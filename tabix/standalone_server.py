@@ -0,0 +1,30 @@
+from tornado.options import logging
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+import tornado.process
+import tornado.web
+
+# Starts the standalone lookup servers. With 'processes' other than 1, the listening socket is
+# bound once and shared by that many forked worker processes (one per CPU for 0). Each worker has
+# its own IOLoop and its own caches. Debug mode is turned off in that case, because autoreload
+# does not work with forked processes.
+
+def run_server(handlers, settings, server_settings, port, processes=1):
+    settings = dict(settings)
+    if processes != 1:
+        settings["debug"] = False
+
+    application = tornado.web.Application(handlers, **settings)
+
+    if processes == 1:
+        application.listen(port, **server_settings)
+    else:
+        server_settings = dict(server_settings)
+        sockets = tornado.netutil.bind_sockets(port, server_settings.pop("address", ""))
+        tornado.process.fork_processes(processes)
+        logging.info("Worker %d started" % tornado.process.task_id())
+        server = tornado.httpserver.HTTPServer(application, **server_settings)
+        server.add_sockets(sockets)
+
+    tornado.ioloop.IOLoop.instance().start()
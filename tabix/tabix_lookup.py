@@ -1,11 +1,102 @@
 from tornado.options import options, logging
+import tornado.gen
 import tornado.web
 
+import itertools
 import json
+import re
 
-from tabix_utils import tsv_region_lookup, vcf_singleline_lookup, triotype_singleline_lookup
+from tabix_utils import tsv_region_lookup, vcf_singleline_lookup, triotype_singleline_lookup, singleline_batch_lookup
+from tabix_utils import tsv_region_lookup_iter, json_default, get_sample_selection
+from tabix_utils import vcf_region_lookup, triotype_region_lookup, iter_tabix_lines
 
 from tabix_utils import CoordinateRangeEmptyError, WrongLineFoundError, TabixExecutionError, UnexpectedTabixOutputError
+from tabix_utils import UnknownSampleError
+
+import lookup_executor
+from lru_cache import LRUCache
+from single_flight import get_single_flight
+from tabix_reader import file_signature
+
+CHROMOSOME_PATTERN = re.compile(r"^(X|Y|M|\d{1,2})$")
+
+# Streamed region lookups: 'json' writes the same document as a buffered lookup, 'ndjson' writes
+# one JSON object per row and line.
+STREAM_CONTENT_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson"
+}
+STREAM_CHUNK_ROWS = 1000
+
+# With output=raw, the lines of the data file are passed through as tabix returns them.
+OUTPUT_FORMATS = frozenset(["json", "raw"])
+RAW_CONTENT_TYPE = "text/tab-separated-values"
+
+def serialize_next_rows(rows, count):
+    return [json.dumps(row, sort_keys=True, default=json_default) for row in itertools.islice(rows, count)]
+
+def read_next_lines(lines, count):
+    return list(itertools.islice(lines, count))
+
+# Identical lookups in flight at the same time are run once, see single_flight.py
+LOOKUPS = get_single_flight("tabix")
+
+DEFAULT_RESULT_CACHE_SIZE = 16 * 1024 * 1024
+
+# Serialized responses per tabix lookup ID, for entries configured with "result_cache", e.g.
+#   "result_cache": {"max_bytes": 16777216, "ttl": 3600}
+RESULT_CACHES = {}
+
+def get_result_cache(tabix_id, file_info):
+    cache_config = file_info.get('result_cache')
+    if not cache_config:
+        return None
+
+    if tabix_id not in RESULT_CACHES:
+        if not isinstance(cache_config, dict):
+            cache_config = {}
+        RESULT_CACHES[tabix_id] = LRUCache(cache_config.get('max_bytes', DEFAULT_RESULT_CACHE_SIZE),
+                                           ttl=cache_config.get('ttl'))
+    return RESULT_CACHES[tabix_id]
+
+def result_cache_key(file_path, chromosome, start, end, samples=None, region=False):
+    # Results are only valid for the current version of the data file and its index.
+    if samples is not None:
+        samples = tuple(samples)
+    return (chromosome, int(start), int(end), samples, region,
+            file_signature(file_path), file_signature(file_path + ".tbi"))
+
+def parse_batch_coordinates(body, max_size):
+    # Accepts either a JSON list of [chromosome, start, end] entries, or an object with such a
+    # list under "coordinates". The end coordinate is optional. A batch looks up single positions:
+    # as a GET with an end coordinate is a region lookup, entries with an end other than the start
+    # are rejected.
+    request = json.loads(body)
+    if isinstance(request, dict):
+        request = request.get("coordinates")
+    if not isinstance(request, list):
+        raise ValueError("expected a list of coordinates")
+    if len(request) > max_size:
+        raise ValueError("too many coordinates: " + str(len(request)) + ", maximum is " + str(max_size))
+
+    coordinates = []
+    for entry in request:
+        if not isinstance(entry, list) or len(entry) not in (2, 3):
+            raise ValueError("invalid coordinate " + repr(entry))
+        chromosome = str(entry[0])
+        if CHROMOSOME_PATTERN.match(chromosome) is None:
+            raise ValueError("invalid chromosome " + repr(entry[0]))
+        start = int(entry[1])
+        end = start
+        if len(entry) == 3:
+            end = int(entry[2])
+        if start < 0 or end < start:
+            raise ValueError("invalid range " + repr(entry))
+        if end != start:
+            raise ValueError("region lookups are not supported in batches: " + repr(entry))
+        coordinates.append((chromosome, start, end))
+
+    return coordinates
 
 class TabixLookupHandler(tornado.web.RequestHandler):
     def initialize(self):
@@ -17,9 +108,17 @@ class TabixLookupHandler(tornado.web.RequestHandler):
     def write_error(self, status_code, **kwargs):
         if status_code == 400:
             self.write("Bad request")
+        elif status_code == 405:
+            self.set_header("Allow", self._allowed_methods)
+            self.write("Method not allowed")
         else:
             self.write("Server error occurred")
 
+    def method_not_allowed(self, allowed_methods):
+        # The lookup routes accept GET, the batch route accepts POST.
+        self._allowed_methods = allowed_methods
+        self.send_error(405)
+
     def build_response_object(self, chromosome, start, end, values=None, snpid="", ref="", alt="", info=""):
         if values == None:
             values = []
@@ -35,7 +134,25 @@ class TabixLookupHandler(tornado.web.RequestHandler):
             "info": info
         }
 
-    def get(self, tabix_id, chromosome, start_coordinate, end_coordinate=None):
+    def build_result_response_object(self, result):
+        return self.build_response_object(result.chromosome,
+                                          result.start,
+                                          result.end,
+                                          values=result.values,
+                                          snpid=result.snpid,
+                                          ref=result.ref,
+                                          alt=result.alt,
+                                          info=result.info)
+
+    @tornado.web.asynchronous
+    @tornado.gen.engine
+    def get(self, tabix_id, chromosome=None, start_coordinate=None, end_coordinate=None):
+        if chromosome is None:
+            self.method_not_allowed("POST")
+            return
+
+        # With an end coordinate, VCF and triotype lookups return all records in the region.
+        region = end_coordinate is not None
         if end_coordinate is None:
             end_coordinate = start_coordinate
         
@@ -50,10 +167,10 @@ class TabixLookupHandler(tornado.web.RequestHandler):
         tabix_exe = None
         
         if file_info['type'] == 'vcf':
-            lookup_fn = vcf_singleline_lookup
+            lookup_fn = vcf_region_lookup if region else vcf_singleline_lookup
             tabix_exe = options.tabix_executable
         elif file_info['type'] == 'trio':
-            lookup_fn = triotype_singleline_lookup
+            lookup_fn = triotype_region_lookup if region else triotype_singleline_lookup
             tabix_exe = options.tabix_executable
         elif file_info['type'] == 'tsv':
             lookup_fn = tsv_region_lookup
@@ -65,25 +182,101 @@ class TabixLookupHandler(tornado.web.RequestHandler):
             self.send_error(500)
             return
         
+        # A subset of the value columns can be requested for VCF and triotype files, either as a
+        # comma-separated list of sample IDs, or as the name of a cohort from the configuration.
+        try:
+            samples = get_sample_selection(file_info, self.get_argument("samples", None), self.get_argument("cohort", None))
+        except ValueError as ve:
+            logging.error("Invalid sample selection for tabix lookup ID [%s]: %s" % (tabix_id, str(ve)))
+            self.send_error(400)
+            return
+
+        lookup_kwargs = {'reader': file_info.get('reader')}
+        if samples is not None:
+            if file_info['type'] == 'tsv':
+                logging.error("Sample selection not supported for type \'tsv\' [%s]" % tabix_id)
+                self.send_error(400)
+                return
+            lookup_kwargs['samples'] = samples
+
+        # Empty positions are answered from the presence index of the file, see presence_index.py
+        if file_info.get('presence_index', False) and file_info['type'] in ('vcf', 'trio') and not region:
+            lookup_kwargs['presence_index'] = True
+
+        output_format = self.get_argument("output", "json")
+        if output_format not in OUTPUT_FORMATS or (output_format == "raw" and samples is not None):
+            logging.error("Invalid output format [%s] for tabix lookup ID [%s]" % (output_format, tabix_id))
+            self.send_error(400)
+            return
+
+        if output_format == "raw":
+            raw_tabix_exe = options.tabix_executable
+            if self.get_argument("header", "false").lower() in ("true", "1"):
+                raw_tabix_exe += " -h"
+            lines = iter_tabix_lines(raw_tabix_exe, file_path, chromosome, start_coordinate, end_coordinate,
+                                     reader=file_info.get('reader'))
+            self.stream_lookup(lines, read_next_lines, "raw", chromosome, start_coordinate, end_coordinate)
+            return
+
+        stream_format = self.get_argument("stream", None)
+        if stream_format is not None:
+            if file_info['type'] != 'tsv' or stream_format not in STREAM_CONTENT_TYPES:
+                logging.error("Invalid stream format [%s] for tabix lookup ID [%s]" % (stream_format, tabix_id))
+                self.send_error(400)
+                return
+
+            rows = tsv_region_lookup_iter(tabix_exe, file_path, chromosome, start_coordinate, end_coordinate,
+                                          reader=file_info.get('reader'))
+            self.stream_lookup(rows, serialize_next_rows, stream_format, chromosome, start_coordinate, end_coordinate)
+            return
+
+        result_cache = get_result_cache(tabix_id, file_info)
+        cache_key = None
+        if result_cache is not None:
+            try:
+                cache_key = result_cache_key(file_path, chromosome, start_coordinate, end_coordinate, samples, region)
+            except OSError as ose:
+                logging.error("Tabix result cache disabled for request: " + str(ose))
+
+        if cache_key is not None:
+            cached_response = result_cache.get(cache_key)
+            if cached_response is not None:
+                self.write(cached_response)
+                self.set_status(200)
+                self.finish()
+                return
+
+        lookup_key = (tabix_id, lookup_fn.__name__, chromosome, int(start_coordinate), int(end_coordinate),
+                      tuple(samples or ()))
+        outcome = yield tornado.gen.Task(LOOKUPS.run, lookup_key, lookup_fn, tabix_exe, file_path, chromosome,
+                                         start_coordinate, end_coordinate, **lookup_kwargs)
+
         try:
-            result = lookup_fn(tabix_exe, file_path, chromosome, start_coordinate, end_coordinate)
-            response = self.build_response_object(result.chromosome,
-                                                  result.start,
-                                                  result.end,
-                                                  values=result.values,
-                                                  snpid=result.snpid,
-                                                  ref=result.ref,
-                                                  alt=result.alt,
-                                                  info=result.info)
-            
-            self.write(json.dumps(response, sort_keys=True))
+            result = outcome.get()
+            response_object = self.build_result_response_object(result)
+            if lookup_fn in (vcf_region_lookup, triotype_region_lookup):
+                response_object["values"] = [self.build_result_response_object(record) for record in result.values]
+            response = json.dumps(response_object, sort_keys=True, default=json_default)
+            if cache_key is not None:
+                result_cache.put(cache_key, response)
+
+            self.write(response)
             self.set_status(200)
+            self.finish()
 
         except CoordinateRangeEmptyError as cnf:
             logging.info(cnf)
-            response = self.build_response_object(chromosome, start_coordinate, end_coordinate)
-            self.write(json.dumps(response, sort_keys=True))
+            response = json.dumps(self.build_response_object(chromosome, start_coordinate, end_coordinate), sort_keys=True)
+            if cache_key is not None:
+                result_cache.put(cache_key, response)
+
+            self.write(response)
             self.set_status(200)
+            self.finish()
+
+        except UnknownSampleError as use:
+            logging.error(use)
+            self.send_error(400)
 
         except WrongLineFoundError as wlf:
             logging.error(wlf)
@@ -100,3 +293,147 @@ class TabixLookupHandler(tornado.web.RequestHandler):
         except Exception as e:
             logging.error("Running tabix failed: " + str(e))
             self.send_error(500)
+
+    def on_connection_close(self):
+        # A stream waiting for a flush is resumed, as the flush callback is not run once the
+        # connection is closed.
+        self.resume_stream()
+
+    def client_gone(self):
+        return self.request.connection.stream.closed()
+
+    def wait_for_flush(self, callback):
+        self._flush_callback = callback
+        if self.client_gone():
+            self.resume_stream()
+        else:
+            self.flush(callback=self.resume_stream)
+
+    def resume_stream(self):
+        callback = getattr(self, "_flush_callback", None)
+        self._flush_callback = None
+        if callback is not None:
+            callback()
+
+    @tornado.gen.engine
+    def stream_lookup(self, rows, next_chunk_fn, stream_format, chromosome, start_coordinate, end_coordinate):
+        # Writes the rows in chunks as tabix produces them, and waits for each chunk to be flushed to
+        # the client before reading the next one, so memory use does not grow with the region size.
+        # 'next_chunk_fn' returns the next chunk of serialized rows, or lines for the "raw" format.
+        # The open stream holds a stream slot, see lookup_executor.py. If the client goes away, the
+        # rows are closed, which stops the tabix process.
+        yield tornado.gen.Task(lookup_executor.acquire_stream_slot)
+        try:
+            started = False
+
+            self.set_header("Content-Type", STREAM_CONTENT_TYPES.get(stream_format, RAW_CONTENT_TYPE))
+            while True:
+                if self.client_gone():
+                    logging.info("Client closed the connection, stopping tabix lookup")
+                    rows.close()
+                    return
+
+                outcome = yield tornado.gen.Task(lookup_executor.run_in_slot, next_chunk_fn, rows, STREAM_CHUNK_ROWS)
+
+                try:
+                    chunk = outcome.get()
+                except Exception as e:
+                    logging.error("Running tabix failed: " + str(e))
+                    rows.close()
+                    if not started:
+                        self.send_error(500)
+                    else:
+                        # The status line has been sent already, a truncated response tells the client.
+                        self.request.connection.stream.close()
+                    return
+
+                if self.client_gone():
+                    continue
+
+                if stream_format == "json":
+                    if not started:
+                        # Same document as json.dumps(response, sort_keys=True), where "values" is the last key.
+                        envelope = self.build_response_object(chromosome, int(start_coordinate), int(end_coordinate), info={})
+                        self.write(json.dumps(envelope, sort_keys=True)[:-len("[]}")] + "[")
+                    elif len(chunk) > 0:
+                        self.write(", ")
+                    self.write(", ".join(chunk))
+                else:
+                    self.write("".join(row + "\n" for row in chunk))
+
+                started = True
+                if len(chunk) < STREAM_CHUNK_ROWS:
+                    break
+
+                yield tornado.gen.Task(self.wait_for_flush)
+
+            if stream_format == "json":
+                self.write("]}")
+            self.set_status(200)
+            self.finish()
+
+        finally:
+            lookup_executor.release_stream_slot()
+
+    @tornado.web.asynchronous
+    @tornado.gen.engine
+    def post(self, tabix_id, *uri_path):
+        # Batch lookup: one response object per requested coordinate, in request order. Nearby
+        # coordinates are fetched with a single region scan.
+        if len(uri_path) > 0:
+            self.method_not_allowed("GET")
+            return
+
+        if tabix_id not in self._config_map.keys():
+            logging.error("Unknown tabix lookup ID [%s]" % tabix_id)
+            self.send_error(400)
+            return
+
+        file_info = self._config_map[tabix_id]
+        if file_info['type'] not in ('vcf', 'trio'):
+            logging.error("Batch lookups not supported for type \'" + file_info['type'] + "\' [%s]" % tabix_id)
+            self.send_error(400)
+            return
+
+        try:
+            coordinates = parse_batch_coordinates(self.request.body, options.tabix_batch_max_size)
+        except (ValueError, TypeError) as e:
+            logging.error("Invalid tabix batch request: " + str(e))
+            self.send_error(400)
+            return
+
+        outcome = yield tornado.gen.Task(lookup_executor.run, singleline_batch_lookup, options.tabix_executable,
+                                         file_info['path'], file_info['type'], coordinates,
+                                         max_gap=options.tabix_batch_merge_distance, reader=file_info.get('reader'),
+                                         presence_index=file_info.get('presence_index', False))
+
+        try:
+            items = []
+            for (chromosome, start, end), result in zip(coordinates, outcome.get()):
+                # Items without a record have the shape of the response to a GET of the coordinate.
+                if result is None:
+                    items.append(self.build_response_object(chromosome, str(start), str(end)))
+                elif isinstance(result, UnexpectedTabixOutputError):
+                    # Only this coordinate failed, the other items are still returned.
+                    logging.error(result)
+                    item = self.build_response_object(chromosome, str(start), str(end))
+                    item["error"] = str(result)
+                    items.append(item)
+                else:
+                    items.append(self.build_result_response_object(result))
+
+            self.write(json.dumps({"items": items}, sort_keys=True, default=json_default))
+            self.set_status(200)
+            self.finish()
+
+        except UnexpectedTabixOutputError as eto:
+            logging.error(eto)
+            self.send_error(500)
+
+        except TabixExecutionError as tee:
+            logging.error(tee)
+            self.send_error(500)
+
+        except Exception as e:
+            logging.error("Running tabix batch lookup failed: " + str(e))
+            self.send_error(500)
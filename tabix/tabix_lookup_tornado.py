@@ -6,6 +6,8 @@ import json
 import sys
 
 from tabix_lookup import tsv_region_lookup
+from tabix_utils import json_default
+from standalone_server import run_server
 
 server_settings = {
     "xheaders" : True,
@@ -47,7 +49,7 @@ class TabixLookup(tornado.web.RequestHandler):
                 "values": result.values
             }
             
-            self.write(json.dumps(response, sort_keys=True))
+            self.write(json.dumps(response, sort_keys=True, default=json_default))
             self.set_status(200)
         except Exception as e:
             logging.error("Running tabix failed:")
@@ -66,6 +68,7 @@ def main():
     define("verbose", default=False, help="Prints debugging statements")
     define("tabix_executable", default=".", help="Path to tabix executable")
     define("data_config", default=".", help="Path to data file configuration JSON")
+    define("processes", default=1, help="Number of server processes, 0 for one per CPU", type=int)
 
     tornado.options.parse_command_line()
 
@@ -73,6 +76,7 @@ def main():
     logging.info("--tabix_executable=%s" % options.tabix_executable)
     logging.info("--data_config=%s" % options.data_config)
     logging.info("--verbose=%s" % options.verbose)
+    logging.info("--processes=%s" % options.processes)
 
     # Try loading the VCF mapping
     logging.info("Loading VCF configuration file \'" + options.data_config + "\'...")
@@ -84,11 +88,9 @@ def main():
         logging.error(e)
         sys.exit(1)
 
-    application = tornado.web.Application([
+    run_server([
         (r"/(\w+)/(X|Y|M|\d{1,2})/(\d+)/(\d+)", TabixLookup)
-    ], **settings)
-    application.listen(options.port, **server_settings)
-    tornado.ioloop.IOLoop.instance().start()
+    ], settings, server_settings, options.port, options.processes)
 
 
 if __name__ == "__main__":
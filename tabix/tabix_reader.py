@@ -0,0 +1,300 @@
+import os
+import struct
+import zlib
+
+from lru_cache import LRUCache
+
+# In-process reader for bgzip-compressed, tabix-indexed files. Answers the same region queries
+# as the 'tabix' executable without spawning a process per lookup.
+
+BGZF_HEADER_SIZE = 18
+BGZF_FOOTER_SIZE = 8
+
+TBI_MAGIC = "TBI\1"
+TBI_FORMAT_VCF = 2
+TBI_FORMAT_ZERO_BASED = 0x10000
+TBI_LINEAR_SHIFT = 14
+
+# Inflated BGZF blocks, shared by all readers. Keys are (path, file signature, compressed offset),
+# values are (data, next compressed offset).
+BLOCK_CACHE = None
+
+def configure_block_cache(max_bytes):
+    global BLOCK_CACHE
+
+    if max_bytes is None or max_bytes <= 0:
+        BLOCK_CACHE = None
+    else:
+        BLOCK_CACHE = LRUCache(max_bytes, size_fn=lambda block: len(block[0]))
+
+def block_cache_stats():
+    if BLOCK_CACHE is None:
+        return None
+    return BLOCK_CACHE.stats()
+
+class TabixReaderError(Exception):
+    def __init__(self, path, msg):
+        self.path = path
+        self.msg = msg
+    def __str__(self):
+        return "Tabix reader - " + str(self.path) + ": " + repr(self.msg)
+
+def file_signature(path):
+    stat = os.stat(path)
+    return (stat.st_mtime, stat.st_size)
+
+def read_bgzf_block(file_handle, coffset):
+    file_handle.seek(coffset)
+    header = file_handle.read(BGZF_HEADER_SIZE)
+    if len(header) == 0:
+        return None, coffset
+
+    if len(header) < BGZF_HEADER_SIZE or header[:4] != "\x1f\x8b\x08\x04":
+        raise TabixReaderError(file_handle.name, "invalid BGZF block at offset " + str(coffset))
+
+    extra_length = struct.unpack("<H", header[10:12])[0]
+    extra = header[12:]
+    if extra_length > 6:
+        extra += file_handle.read(extra_length - 6)
+
+    block_size = None
+    position = 0
+    while position < extra_length:
+        subfield_id, subfield_length = struct.unpack("<2sH", extra[position:position + 4])
+        if subfield_id == "BC":
+            block_size = struct.unpack("<H", extra[position + 4:position + 6])[0] + 1
+        position += 4 + subfield_length
+
+    if block_size is None:
+        raise TabixReaderError(file_handle.name, "missing BSIZE field at offset " + str(coffset))
+
+    compressed = file_handle.read(block_size - extra_length - 12 - BGZF_FOOTER_SIZE)
+    file_handle.read(BGZF_FOOTER_SIZE)
+    return zlib.decompress(compressed, -15), coffset + block_size
+
+class TabixIndex(object):
+    def __init__(self, fmt, col_seq, col_beg, col_end, meta_char, skip, names, bins, linear):
+        self.format = fmt
+        self.col_seq = col_seq
+        self.col_beg = col_beg
+        self.col_end = col_end
+        self.meta_char = meta_char
+        self.skip = skip
+        self.names = names
+        self.name_to_tid = dict((name, tid) for tid, name in enumerate(names))
+        self.bins = bins
+        self.linear = linear
+
+def read_bgzf_file(path):
+    chunks = []
+    with open(path, 'rb') as file_handle:
+        coffset = 0
+        while True:
+            data, coffset = read_bgzf_block(file_handle, coffset)
+            if data is None:
+                break
+            chunks.append(data)
+
+    return "".join(chunks)
+
+def parse_tabix_index(index_path):
+    data = read_bgzf_file(index_path)
+    if data[:4] != TBI_MAGIC:
+        raise TabixReaderError(index_path, "not a tabix index")
+
+    n_ref, fmt, col_seq, col_beg, col_end, meta, skip, l_nm = struct.unpack("<8i", data[4:36])
+    position = 36
+    names = data[position:position + l_nm].rstrip("\0").split("\0")
+    position += l_nm
+
+    all_bins = []
+    all_linear = []
+    for tid in xrange(n_ref):
+        bins = {}
+        n_bin = struct.unpack("<i", data[position:position + 4])[0]
+        position += 4
+        for b in xrange(n_bin):
+            bin_number, n_chunk = struct.unpack("<Ii", data[position:position + 8])
+            position += 8
+            chunk_values = struct.unpack("<" + str(2 * n_chunk) + "Q", data[position:position + 16 * n_chunk])
+            position += 16 * n_chunk
+            bins[bin_number] = zip(chunk_values[0::2], chunk_values[1::2])
+
+        n_intv = struct.unpack("<i", data[position:position + 4])[0]
+        position += 4
+        linear = struct.unpack("<" + str(n_intv) + "Q", data[position:position + 8 * n_intv])
+        position += 8 * n_intv
+
+        all_bins.append(bins)
+        all_linear.append(linear)
+
+    return TabixIndex(fmt, col_seq, col_beg, col_end, chr(meta), skip, names, all_bins, all_linear)
+
+def region_to_bins(beg, end):
+    # Bins that may contain records overlapping the zero-based, half-open interval [beg, end).
+    # See section 5.3 of the SAM specification.
+    end -= 1
+    bins = [0]
+    for shift, offset in ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)):
+        bins.extend(xrange(offset + (beg >> shift), offset + (end >> shift) + 1))
+    return bins
+
+def parse_region(chromosome, start, end):
+    # Tabix regions are one-based and inclusive, e.g. "chr1:12345-12345".
+    return chromosome, max(int(start) - 1, 0), int(end)
+
+class TabixReader(object):
+    def __init__(self, path, index_path=None):
+        self.path = path
+        self.index_path = index_path or path + ".tbi"
+        self.signature = file_signature(path)
+        self.index = parse_tabix_index(self.index_path)
+
+    def read_block(self, file_handle, coffset):
+        cache = BLOCK_CACHE
+        if cache is None:
+            return read_bgzf_block(file_handle, coffset)
+
+        key = (self.path, self.signature, coffset)
+        block = cache.get(key)
+        if block is None:
+            block = read_bgzf_block(file_handle, coffset)
+            if block[0] is not None:
+                cache.put(key, block)
+        return block
+
+    def _record_interval(self, fields):
+        index = self.index
+        # Zero-based, half-open interval covered by the record.
+        beg = int(fields[index.col_beg - 1])
+        if not index.format & TBI_FORMAT_ZERO_BASED:
+            beg -= 1
+        end = beg + 1
+        if (index.format & 0xffff) == TBI_FORMAT_VCF:
+            end = beg + len(fields[3])
+        elif index.col_end and index.col_end != index.col_beg:
+            end = int(fields[index.col_end - 1])
+        return beg, end
+
+    def _query_chunks(self, tid, beg, end):
+        bins = self.index.bins[tid]
+        linear = self.index.linear[tid]
+        min_offset = 0
+        if len(linear) > 0:
+            min_offset = linear[min(beg >> TBI_LINEAR_SHIFT, len(linear) - 1)]
+
+        chunks = []
+        for bin_number in region_to_bins(beg, end):
+            for chunk_beg, chunk_end in bins.get(bin_number, []):
+                if chunk_end > min_offset:
+                    chunks.append((max(chunk_beg, min_offset), chunk_end))
+
+        chunks.sort()
+        merged = []
+        for chunk in chunks:
+            if merged and chunk[0] <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], chunk[1]))
+            else:
+                merged.append(chunk)
+        return merged
+
+    def _iter_chunk_lines(self, file_handle, voffset_beg, voffset_end):
+        coffset = voffset_beg >> 16
+        uoffset = voffset_beg & 0xffff
+        end_coffset = voffset_end >> 16
+        end_uoffset = voffset_end & 0xffff
+        remainder = ""
+
+        while coffset <= end_coffset:
+            data, next_coffset = self.read_block(file_handle, coffset)
+            if data is None:
+                break
+            # The virtual end offset points inside the last block of the chunk.
+            stop = len(data)
+            if coffset == end_coffset:
+                stop = end_uoffset
+            buffered = remainder + data[uoffset:stop]
+            lines = buffered.split("\n")
+            remainder = lines.pop()
+            for line in lines:
+                yield line
+            if coffset == end_coffset:
+                # A line starting before the chunk end may continue past it.
+                if remainder:
+                    tail = data[stop:]
+                    newline = tail.find("\n")
+                    while newline < 0:
+                        remainder += tail
+                        data, next_coffset = self.read_block(file_handle, next_coffset)
+                        if data is None:
+                            break
+                        tail = data
+                        newline = tail.find("\n")
+                    if newline >= 0:
+                        remainder += tail[:newline]
+                    yield remainder
+                    remainder = ""
+                break
+            coffset = next_coffset
+            uoffset = 0
+
+        if remainder:
+            yield remainder
+
+    def fetch(self, chromosome, start, end):
+        sequence, beg, end = parse_region(chromosome, start, end)
+        tid = self.index.name_to_tid.get(sequence)
+        if tid is None:
+            return
+
+        col_seq = self.index.col_seq - 1
+        meta_char = self.index.meta_char
+        with open(self.path, 'rb') as file_handle:
+            for chunk_beg, chunk_end in self._query_chunks(tid, beg, end):
+                for line in self._iter_chunk_lines(file_handle, chunk_beg, chunk_end):
+                    if not line or line[0] == meta_char:
+                        continue
+                    fields = line.split('\t')
+                    if fields[col_seq] != sequence:
+                        continue
+                    record_beg, record_end = self._record_interval(fields)
+                    if record_beg >= end:
+                        return
+                    if record_end > beg:
+                        yield line
+
+    def header(self):
+        # Same header lines as 'tabix -h': leading lines starting with the meta character, plus
+        # the number of lines the index was told to skip.
+        meta_char = self.index.meta_char
+        lines = []
+        with open(self.path, 'rb') as file_handle:
+            line_iter = self._iter_chunk_lines(file_handle, 0, os.path.getsize(self.path) << 16)
+            for line_number, line in enumerate(line_iter):
+                if line_number >= self.index.skip and not line.startswith(meta_char):
+                    break
+                lines.append(line)
+        return lines
+
+    def query(self, chromosome, start, end, include_header=False):
+        # Returns text equivalent to the output of 'tabix [-h] file chr:start-end'.
+        lines = []
+        if include_header:
+            lines.extend(self.header())
+        lines.extend(self.fetch(chromosome, start, end))
+        if len(lines) == 0:
+            return ""
+        return "\n".join(lines) + "\n"
+
+READERS = {}
+
+def get_reader(path):
+    # Readers are cached per data file, and the index is parsed again when either file changes.
+    signature = (file_signature(path), file_signature(path + ".tbi"))
+    cached = READERS.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    reader = TabixReader(path)
+    READERS[path] = (signature, reader)
+    return reader
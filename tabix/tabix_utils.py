@@ -1,6 +1,18 @@
+import bisect
 import csv
+import logging
 import StringIO
 import subprocess
+import tempfile
+
+import presence_index as presence
+import tabix_reader
+from lru_cache import LRUCache
+
+# Lookups either spawn the tabix executable, or read the bgzip file and its index in process.
+TABIX_READER_SUBPROCESS = "subprocess"
+TABIX_READER_NATIVE = "native"
+TABIX_READERS = frozenset([TABIX_READER_SUBPROCESS, TABIX_READER_NATIVE])
 
 # #CHROM  POS     ID      REF     ALT     QUAL    FILTER  INFO    FORMAT    <values ..... >
 VCF_SNP_ID_COLUMN_INDEX = 2
@@ -9,6 +21,15 @@ VCF_ALT_COLUMN_INDEX = 4
 VCF_INFO_COLUMN_INDEX = 7
 VCF_VALUE_START_INDEX = 9
 
+# CHR POS <values ...>
+TRIOTYPE_VALUE_START_INDEX = 2
+
+# (file path, value start index) -> (file signature, RowHeader)
+HEADER_IDENTIFIERS = {}
+
+# (id(RowHeader), sample IDs, include_family_members) -> (RowHeader, SampleProjection)
+SAMPLE_PROJECTIONS = LRUCache(1024, size_fn=lambda entry: 1)
+
 def query_description(chromosome, start, end):
     return "chr" + str(chromosome) + ":" + str(start) + "-" + str(end)
 
@@ -38,6 +59,12 @@ class UnexpectedTabixOutputError(Exception):
     def __str__(self):
         return "Tabix - unexpected output: " + repr(self.msg)
 
+class UnknownSampleError(Exception):
+    def __init__(self, sample_ids):
+        self.sample_ids = sample_ids
+    def __str__(self):
+        return "Unknown sample IDs: " + repr(self.sample_ids)
+
 class TabixExecutionError(Exception):
     def __init__(self, error, output=""):
         self.error = error
@@ -45,7 +72,9 @@ class TabixExecutionError(Exception):
     def __str__(self):
         return "Tabix - execution failed: " + repr(self.output)
 
-class MultilineTabixResult():
+class MultilineTabixResult(object):
+    __slots__ = ('_chromosome', '_start', '_end', '_values', '_snpid', '_ref', '_alt', '_info')
+
     def __init__(self, chromosome, start, end, values, info=None, snpid=None, ref=None, alt=None):
         self.set_chromosome(chromosome)
         self.set_start(start)
@@ -55,66 +84,66 @@ class MultilineTabixResult():
         self.set_ref(ref)
         self.set_alt(alt)
         self.set_info(info)
-    
+
     def get_chromosome(self):
-        return self.chromosome
+        return self._chromosome
 
     def set_chromosome(self, chromosome):
-        self.chromosome = chromosome
+        self._chromosome = chromosome
 
     def get_start(self):
-        return self.start
-    
+        return self._start
+
     def set_start(self, coordinate):
-        self.start = int(coordinate)
-    
+        self._start = int(coordinate)
+
     def get_end(self):
-        return self.end
-    
+        return self._end
+
     def set_end(self, coordinate):
-        self.end = int(coordinate)
-    
+        self._end = int(coordinate)
+
     def get_values(self):
-        return self.values
-    
+        return self._values
+
     def set_values(self, values):
-        self.values = values
+        self._values = values
 
     def get_snpid(self):
-        return self.snpid
-    
+        return self._snpid
+
     def set_snpid(self, snpid):
         if snpid == None:
-            self.snpid = ""
+            self._snpid = ""
         else:
-            self.snpid = snpid
+            self._snpid = snpid
 
     def get_ref(self):
-        return self.ref
-    
+        return self._ref
+
     def set_ref(self, ref):
         if ref == None:
-            self.ref = ""
+            self._ref = ""
         else:
-            self.ref = ref
+            self._ref = ref
 
     def get_alt(self):
-        return self.alt
-    
+        return self._alt
+
     def set_alt(self, alt):
         if alt == None:
-            self.alt = ""
+            self._alt = ""
         else:
-            self.alt = alt
-            
+            self._alt = alt
+
     def get_info(self):
-        return self.info
-    
+        return self._info
+
     def set_info(self, info):
         if info == None:
-            self.info = {}
+            self._info = {}
         else:
-            self.info = info
+            self._info = info
 
     chromosome = property(get_chromosome, set_chromosome)
     start = property(get_start, set_start)
@@ -125,12 +154,188 @@ class MultilineTabixResult():
     alt = property(get_alt, set_alt)
     info = property(get_info, set_info)
 
+class RowHeader(object):
+    # Field names shared by all rows parsed from the same header line.
+    __slots__ = ('names', 'index')
+
+    def __init__(self, names):
+        self.names = tuple(names)
+        # As with dict(zip(names, values)), the last of any duplicate names wins.
+        self.index = dict((name, position) for position, name in enumerate(self.names))
+
+class SampleProjection(object):
+    # Value column positions of a subset of samples, and the header of the projected rows.
+    __slots__ = ('columns', 'header')
+
+    def __init__(self, columns, header):
+        self.columns = tuple(columns)
+        self.header = header
+
+class SharedHeaderRow(object):
+    # Read-only, dictionary-like view of one row of values. Rows keep a reference to the shared
+    # header and a list of values instead of a dictionary each; the dictionary is only built when
+    # the row is serialized.
+    __slots__ = ('header', 'value_list')
+
+    def __init__(self, header, value_list):
+        self.header = header
+        self.value_list = value_list
+
+    def __getitem__(self, key):
+        position = self.header.index[key]
+        if position >= len(self.value_list):
+            raise KeyError(key)
+        return self.value_list[position]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.header.index.get(key, len(self.value_list)) < len(self.value_list)
+
+    has_key = __contains__
+
+    def iteritems(self):
+        value_list = self.value_list
+        size = len(value_list)
+        for key, position in self.header.index.iteritems():
+            if position < size:
+                yield key, value_list[position]
+
+    def iterkeys(self):
+        for key, value in self.iteritems():
+            yield key
+
+    def itervalues(self):
+        for key, value in self.iteritems():
+            yield value
+
+    __iter__ = iterkeys
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def __len__(self):
+        if len(self.value_list) >= len(self.header.names):
+            return len(self.header.index)
+        return sum(1 for key in self.iterkeys())
+
+    def as_dict(self):
+        return dict(self.iteritems())
+
+    def __eq__(self, other):
+        if isinstance(other, SharedHeaderRow):
+            other = other.as_dict()
+        return self.as_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self.as_dict())
+
+def json_default(obj):
+    # For json.dumps(..., default=json_default), so that rows are serialized as dictionaries.
+    if isinstance(obj, SharedHeaderRow):
+        return obj.as_dict()
+    raise TypeError(repr(obj) + " is not JSON serializable")
+
 def create_tabix_command(tabix_path, vcf_path, chromosome, start, end):
     # Example command for running tabix to fetch one coordinate:
     # tabix file.vcf.gz chr1:12345-12345
     return tabix_path + " " + vcf_path + " chr" + str(chromosome) + ":" + str(start) + "-" + str(end)
 
-def parse_vcf_line(row, identifiers=None):
+def log_tabix_errors(command, returncode, errors):
+    # Messages that tabix wrote to stderr before a non-zero exit, when kept apart from the output
+    if errors:
+        logging.error("Command '" + command + "' returned non-zero exit status " + str(returncode) + ": " + errors.strip())
+
+def run_tabix(tabix_path, file_path, chromosome, start, end, reader=None, stderr=subprocess.STDOUT):
+    # With 'stderr' None, the messages of tabix are kept apart from the output, and logged if it
+    # fails.
+    if reader == TABIX_READER_NATIVE:
+        # The native reader honors the '-h' flag the same way the executable does.
+        include_header = "-h" in tabix_path.split()[1:]
+        try:
+            return tabix_reader.get_reader(file_path).query("chr" + str(chromosome), start, end, include_header)
+        except (IOError, OSError, tabix_reader.TabixReaderError) as e:
+            raise TabixExecutionError(str(e), str(e))
+
+    command = create_tabix_command(tabix_path, file_path, chromosome, start, end)
+
+    if stderr is None:
+        process = subprocess.Popen(command.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, errors = process.communicate()
+        if process.returncode != 0:
+            log_tabix_errors(command, process.returncode, errors)
+            raise TabixExecutionError("Command '" + command + "' returned non-zero exit status " + str(process.returncode),
+                                      errors or output)
+        return output
+
+    try:
+        return subprocess.check_output(command.split(), stderr=stderr)
+    except subprocess.CalledProcessError as cpe:
+        raise TabixExecutionError(str(cpe), cpe.output)
+
+def iter_tabix_lines(tabix_path, file_path, chromosome, start, end, reader=None):
+    # Yields the lines of the tabix output one at a time, without the trailing newline, so that
+    # large regions never have to be held in memory as a whole.
+    if reader == TABIX_READER_NATIVE:
+        try:
+            native_reader = tabix_reader.get_reader(file_path)
+            if "-h" in tabix_path.split()[1:]:
+                for line in native_reader.header():
+                    yield line
+            for line in native_reader.fetch("chr" + str(chromosome), start, end):
+                yield line
+        except (IOError, OSError, tabix_reader.TabixReaderError) as e:
+            raise TabixExecutionError(str(e), str(e))
+        return
+
+    command = create_tabix_command(tabix_path, file_path, chromosome, start, end)
+    # The process must not inherit the sockets of the server, which would keep client connections
+    # open for as long as it runs. Messages on stderr go to a temporary file, which is read if tabix
+    # fails, so that a full stderr pipe cannot block the output.
+    errors_file = tempfile.TemporaryFile()
+    process = subprocess.Popen(command.split(), stdout=subprocess.PIPE, stderr=errors_file, close_fds=True)
+    completed = False
+    try:
+        for line in iter(process.stdout.readline, ''):
+            yield line.rstrip('\r\n')
+        completed = True
+    finally:
+        # Also reached when the consumer closes the generator early, as the streaming handler
+        # does when the client goes away.
+        if not completed and process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+        errors_file.seek(0)
+        errors = errors_file.read()
+        errors_file.close()
+
+    if process.returncode != 0:
+        log_tabix_errors(command, process.returncode, errors)
+        raise TabixExecutionError("Command '" + command + "' returned non-zero exit status " + str(process.returncode),
+                                  errors)
+
+def select_values(split_row, value_start_index, columns=None):
+    # Strips either all values from 'value_start_index' on, or only those at the given value
+    # column positions.
+    if columns is None:
+        return map(lambda x: x.strip(), split_row[value_start_index:])
+    return [split_row[value_start_index + column].strip() for column in columns]
+
+def parse_vcf_line(row, identifiers=None, columns=None):
 
     split_row = row.split('\t')
     chromosome, coordinate = split_row[:2]
@@ -138,13 +343,15 @@ def parse_vcf_line(row, identifiers=None):
     ref = split_row[VCF_REF_COLUMN_INDEX]
     alt = split_row[VCF_ALT_COLUMN_INDEX]
     info_field = split_row[VCF_INFO_COLUMN_INDEX]
-    values = map(lambda x: x.strip(), split_row[VCF_VALUE_START_INDEX:])
+    values = select_values(split_row, VCF_VALUE_START_INDEX, columns)
     result_values = None
 
     if identifiers is None:
         result_values = values
     else:
-        result_values = {key: value for (key, value) in zip(identifiers, values)}
+        if not isinstance(identifiers, RowHeader):
+            identifiers = RowHeader(identifiers)
+        result_values = SharedHeaderRow(identifiers, values)
 
     return MultilineTabixResult(chromosome,
                                 coordinate,
@@ -156,37 +363,79 @@ def parse_vcf_line(row, identifiers=None):
                                 alt=alt)
 
 def parse_region_lookup_result(data, header_line_identifier='#', line_filter="##"):
-    lines = [line for line in data if not line.startswith(line_filter)]
-
-    reader = csv.DictReader(StringIO.StringIO(data), delimiter='\t')
-    values = []
-    for row in reader:
-        result = {}
-        # Remove leading header line identifier characters from field keys.
-        for key, v in row.iteritems():
-            if key.startswith(header_line_identifier):
-                result[key.lstrip(header_line_identifier)] = v
-            else:
-                result[key] = v
-
-        values.append(result)
-
-    return values
+    return list(iter_region_lookup_rows(StringIO.StringIO(data), header_line_identifier, line_filter))
+
+def iter_region_lookup_rows(lines, header_line_identifier='#', line_filter="##"):
+    # Yields one row per data line. All rows share the field keys read from the header line. When
+    # closed before the end, 'lines' is closed as well, so that a tabix process is stopped.
+    #
+    # Rows have the keys and values of the rows of csv.DictReader, with two differences: lines
+    # starting with 'line_filter' are skipped, where csv.DictReader read a leading meta line as the
+    # header line; and rows with the expected number of fields or fewer are SharedHeaderRow objects
+    # rather than dictionaries. Longer rows are dictionaries with the extra fields under the None key.
+    source = lines
+    try:
+        lines = (line for line in lines if not line.startswith(line_filter))
+        reader = csv.reader(lines, delimiter='\t')
+
+        header = None
+        for row in reader:
+            if len(row) == 0:
+                continue
+
+            if header is None:
+                # Remove leading header line identifier characters from field keys.
+                header = RowHeader(key.lstrip(header_line_identifier) if key.startswith(header_line_identifier) else key
+                                   for key in row)
+                field_count = len(header.names)
+                continue
+
+            if len(row) < field_count:
+                # Missing fields are None, as with csv.DictReader.
+                row.extend([None] * (field_count - len(row)))
+            elif len(row) > field_count:
+                # Extra fields are listed under the None key, as with csv.DictReader.
+                result = dict(zip(header.names, row))
+                result[None] = row[field_count:]
+                yield result
+                continue
+
+            yield SharedHeaderRow(header, row)
+    finally:
+        if hasattr(source, 'close'):
+            source.close()
 
 def split_and_remove_empty_lines(data):
     lines = data.split('\n')
     return [line for line in lines if line.strip() != '']
 
-def vcf_singleline_lookup(tabix_path, vcf_path, chromosome, start_coordinate, end_coordinate):
-    coordinate = start_coordinate
-    command = create_tabix_command(tabix_path, vcf_path, chromosome, coordinate, coordinate)
-    
-    tabix_output = None
-
+def check_presence(file_path, chromosome, start_coordinate, end_coordinate, description):
+    # Raises CoordinateRangeEmptyError without running tabix if the presence index of the file has
+    # no record starting at the start coordinate. Only for lookups of the record at one position,
+    # see PresenceIndex.has_record.
     try:
-        tabix_output = subprocess.check_output(command.split(), stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as cpe:
-        raise TabixExecutionError(str(cpe), cpe.output)
+        found = presence.has_record(file_path, chromosome, start_coordinate, start_coordinate)
+    except (IOError, OSError, tabix_reader.TabixReaderError) as e:
+        raise TabixExecutionError(str(e), str(e))
+
+    if not found:
+        raise CoordinateRangeEmptyError(chromosome, start_coordinate, end_coordinate, description + " - presence index")
+
+def vcf_singleline_lookup(tabix_path, vcf_path, chromosome, start_coordinate, end_coordinate, reader=None,
+                          samples=None, include_family_members=False, presence_index=False):
+    # With 'samples', only the values of those sample IDs are returned, see get_sample_projection.
+    # With 'presence_index', positions without a record are answered from the presence index.
+    if presence_index:
+        check_presence(vcf_path, chromosome, start_coordinate, end_coordinate, "VCF lookup")
+
+    columns = None
+    if samples is not None:
+        header = get_header_identifiers(tabix_path, vcf_path, chromosome, start_coordinate, VCF_VALUE_START_INDEX,
+                                        reader)
+        columns = get_sample_projection(header, samples, include_family_members).columns
+
+    coordinate = start_coordinate
+    tabix_output = run_tabix(tabix_path, vcf_path, chromosome, coordinate, coordinate, reader)
 
     output = split_and_remove_empty_lines(tabix_output)
     if (len(output) == 0):
@@ -195,7 +444,7 @@ def vcf_singleline_lookup(tabix_path, vcf_path, chromosome, start_coordinate, en
     if (len(output) > 1):
         raise UnexpectedTabixOutputError("expected 1 line, found " + str(len(output)))
 
-    result = parse_vcf_line(tabix_output)
+    result = parse_vcf_line(tabix_output, columns=columns)
     if result.chromosome[3:] != chromosome or result.start != int(coordinate):
         errmsg = "got " + str(result.chromosome) + ":" + str(result.start) + ", full line \'" + repr(output) + "\'"
         raise WrongLineFoundError(chromosome, start_coordinate, end_coordinate, errmsg)
@@ -209,57 +458,136 @@ def get_vcf_lookup_identifiers_from_header(header_line):
 
     return identifiers
 
-def vcf_singleline_lookup_with_header(tabix_path, vcf_path, chromosome, start_coordinate, end_coordinate):
-    # Use '-h' flag to include headers in the tabix output.
-    tabix_path = tabix_path + " -h"
-
-    coordinate = start_coordinate
-    command = create_tabix_command(tabix_path, vcf_path, chromosome, coordinate, coordinate)
-
-    tabix_output = None
-
+def read_header_lines(tabix_path, file_path, chromosome, coordinate, reader=None):
+    # Returns the header lines of a tabix-indexed file, read with the configured reader. 'tabix -h'
+    # needs a region, and prints the header lines before the records of that region.
+    if reader == TABIX_READER_NATIVE:
+        try:
+            return tabix_reader.get_reader(file_path).header()
+        except (IOError, OSError, tabix_reader.TabixReaderError) as e:
+            raise TabixExecutionError(str(e), str(e))
+
+    if "-h" not in tabix_path.split()[1:]:
+        tabix_path = tabix_path + " -h"
+    # Messages of tabix on stderr are not mixed into the header lines.
+    tabix_output = run_tabix(tabix_path, file_path, chromosome, coordinate, coordinate, reader, stderr=None)
+
+    header_lines = []
+    for line in tabix_output.split('\n'):
+        if not line.startswith('#'):
+            break
+        header_lines.append(line)
+    return header_lines
+
+def get_header_identifiers(tabix_path, file_path, chromosome, coordinate, value_start_index, reader=None,
+                           line_filter="##"):
+    # Returns the identifiers from the last header line of a tabix-indexed file as a RowHeader of
+    # interned strings.
+    # The header is read once per file version, instead of with 'tabix -h' on every lookup. The
+    # region of the lookup is only used if the header has to be read again.
+    key = (file_path, value_start_index)
     try:
-        tabix_output = subprocess.check_output(command.split(), stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as cpe:
-        raise TabixExecutionError(str(cpe), cpe.output)
-
-    line_filter = "##"
-    output = split_and_remove_empty_lines(tabix_output)
-    output = [line for line in output  if not line.startswith(line_filter)]
-
-    if (len(output) == 1):
-        raise CoordinateRangeEmptyError(chromosome, start_coordinate, end_coordinate, "VCF lookup")
-
-    if (len(output) > 2):
-        raise UnexpectedTabixOutputError("expected 2 lines, found " + str(len(output)))
-
-    identifiers = get_vcf_lookup_identifiers_from_header(output[0])
-    result = parse_vcf_line(output[1], identifiers)
-    if result.chromosome[3:] != chromosome or result.start != int(coordinate):
-        errmsg = "got " + str(result.chromosome) + ":" + str(result.start) + ", full line \'" + repr(output) + "\'"
-        raise WrongLineFoundError(chromosome, start_coordinate, end_coordinate, errmsg)
+        signature = tabix_reader.file_signature(file_path)
+    except (IOError, OSError) as e:
+        raise TabixExecutionError(str(e), str(e))
+
+    cached = HEADER_IDENTIFIERS.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    header_lines = read_header_lines(tabix_path, file_path, chromosome, coordinate, reader)
+    header_lines = [line for line in header_lines if not line.startswith(line_filter)]
+    if len(header_lines) == 0:
+        raise UnexpectedTabixOutputError("header line not found in " + file_path)
+
+    split_header_line = header_lines[-1].split('\t')[value_start_index:]
+    header = RowHeader(intern(value.strip()) for value in split_header_line)
+    HEADER_IDENTIFIERS[key] = (signature, header)
+    return header
+
+def get_sample_projection(header, sample_ids, include_family_members=False):
+    # Resolves sample IDs to value column positions in a header. The projection is computed once
+    # per header and list of IDs. With 'include_family_members', a family ID also selects the
+    # columns of its members ("<family>-F", "<family>-M", ...), a sample ID also selects the column
+    # of its family, and IDs that are not in this header are skipped as long as at least one column
+    # is selected.
+    key = (id(header), tuple(sample_ids), include_family_members)
+    cached = SAMPLE_PROJECTIONS.get(key)
+    if cached is not None and cached[0] is header:
+        return cached[1]
+
+    if include_family_members:
+        selected = frozenset(sample_ids)
+        families = frozenset(sample_id.rsplit('-', 1)[0] for sample_id in sample_ids)
+        columns = [position for position, name in enumerate(header.names)
+                   if name in selected or name in families or name.rsplit('-', 1)[0] in selected]
+        if len(columns) == 0:
+            raise UnknownSampleError(list(sample_ids))
+    else:
+        unknown = [sample_id for sample_id in sample_ids if sample_id not in header.index]
+        if len(unknown) > 0:
+            raise UnknownSampleError(unknown)
+        columns = [header.index[sample_id] for sample_id in sample_ids]
+
+    projection = SampleProjection(columns, RowHeader(header.names[column] for column in columns))
+    # The header is kept in the entry, so that its id() is not reused while the entry exists.
+    SAMPLE_PROJECTIONS.put(key, (header, projection))
+    return projection
+
+def get_sample_selection(config, samples=None, cohort=None):
+    # Returns the list of sample IDs from a comma-separated 'samples' argument, or from a cohort
+    # configured under "cohorts" in 'config', or None if neither is given.
+    if samples is not None and cohort is not None:
+        raise ValueError("only one of samples and cohort can be given")
+
+    if cohort is not None:
+        cohorts = config.get('cohorts', {})
+        if cohort not in cohorts:
+            raise ValueError("unknown cohort " + repr(cohort))
+        return list(cohorts[cohort])
+
+    if samples is not None:
+        sample_ids = [sample_id.strip() for sample_id in samples.split(',') if len(sample_id.strip()) > 0]
+        if len(sample_ids) == 0:
+            raise ValueError("empty sample list")
+        return sample_ids
+
+    return None
+
+def vcf_singleline_lookup_with_header(tabix_path, vcf_path, chromosome, start_coordinate, end_coordinate, reader=None,
+                                      samples=None, include_family_members=False, presence_index=False):
+    header = get_header_identifiers(tabix_path, vcf_path, chromosome, start_coordinate, VCF_VALUE_START_INDEX, reader)
+    if samples is not None:
+        header = get_sample_projection(header, samples, include_family_members).header
+
+    result = vcf_singleline_lookup(tabix_path, vcf_path, chromosome, start_coordinate, end_coordinate, reader,
+                                   samples, include_family_members, presence_index)
+    result.values = SharedHeaderRow(header, result.values)
 
     return result
 
-def parse_triotype_line(row, result_dict=False):
-    # CHR POS <values ...>
-    TRIOTYPE_VALUE_START_INDEX = 2
-
+def parse_triotype_line(row, result_dict=False, columns=None, identifiers=None):
     split_row = row.split('\t')
     chromosome, coordinate = split_row[:2]
-    values = map(lambda x: x.strip(), split_row[TRIOTYPE_VALUE_START_INDEX:])
+    values = select_values(split_row, TRIOTYPE_VALUE_START_INDEX, columns)
+    if identifiers is not None:
+        values = SharedHeaderRow(identifiers, values)
     return MultilineTabixResult(chromosome, coordinate, coordinate, values)
 
-def triotype_singleline_lookup(tabix_path, tsv_path, chromosome, start_coordinate, end_coordinate):
-    coordinate = start_coordinate
-    command = create_tabix_command(tabix_path, tsv_path, chromosome, coordinate, coordinate)
+def triotype_singleline_lookup(tabix_path, tsv_path, chromosome, start_coordinate, end_coordinate, reader=None,
+                               samples=None, include_family_members=False, presence_index=False):
+    # With 'samples', only the values of those family IDs are returned, see get_sample_projection.
+    if presence_index:
+        check_presence(tsv_path, chromosome, start_coordinate, end_coordinate, "triotype lookup")
 
-    tabix_output = None
+    columns = None
+    if samples is not None:
+        header = get_header_identifiers(tabix_path, tsv_path, chromosome, start_coordinate, TRIOTYPE_VALUE_START_INDEX,
+                                        reader)
+        columns = get_sample_projection(header, samples, include_family_members).columns
 
-    try:
-        tabix_output = subprocess.check_output(command.split(), stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as cpe:
-        raise TabixExecutionError(str(cpe), cpe.output)
+    coordinate = start_coordinate
+    tabix_output = run_tabix(tabix_path, tsv_path, chromosome, coordinate, coordinate, reader)
 
     output = split_and_remove_empty_lines(tabix_output)
     if (len(output) == 0):
@@ -268,7 +596,7 @@ def triotype_singleline_lookup(tabix_path, tsv_path, chromosome, start_coordinat
     if (len(output) > 1):
         raise UnexpectedTabixOutputError("expected 1 line, found " + str(len(output)))
 
-    result = parse_triotype_line(tabix_output)
+    result = parse_triotype_line(tabix_output, columns=columns)
 
     if result.chromosome[3:] != chromosome or result.start != int(coordinate):
         errmsg = "got " + str(result.chromosome) + ":" + str(result.start) + ", full line \'" + repr(output) + "\'"
@@ -287,45 +615,127 @@ def parse_triotype_lookup_with_headers(data, header_line_identifier='#', line_fi
 
     chromosome, coordinate = split_value_line[:2]
 
-    identifiers = split_header_line[2:]
-    triotype_values = split_value_line[2:]
+    identifiers = split_header_line[TRIOTYPE_VALUE_START_INDEX:]
+    triotype_values = split_value_line[TRIOTYPE_VALUE_START_INDEX:]
 
-    values = {key: value for (key, value) in zip(identifiers, triotype_values)}
+    values = SharedHeaderRow(RowHeader(identifiers), triotype_values)
 
     return MultilineTabixResult(chromosome, coordinate, coordinate, values)
 
-def triotype_singleline_lookup_with_header(tabix_path, tsv_path, chromosome, start_coordinate, end_coordinate):
-    # Use '-h' flag to include headers in the tabix output.
-    tabix_path = tabix_path + " -h"
-
-    coordinate = start_coordinate
-    command = create_tabix_command(tabix_path, tsv_path, chromosome, coordinate, coordinate)
+def triotype_singleline_lookup_with_header(tabix_path, tsv_path, chromosome, start_coordinate, end_coordinate, reader=None,
+                                           samples=None, include_family_members=False, presence_index=False):
+    header = get_header_identifiers(tabix_path, tsv_path, chromosome, start_coordinate, TRIOTYPE_VALUE_START_INDEX,
+                                    reader)
+    if samples is not None:
+        header = get_sample_projection(header, samples, include_family_members).header
 
-    tabix_output = None
-
-    try:
-        tabix_output = subprocess.check_output(command.split(), stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as cpe:
-        raise TabixExecutionError(str(cpe), cpe.output)
-
-    output = split_and_remove_empty_lines(tabix_output)
-    if (len(output) == 1):
-        raise CoordinateRangeEmptyError(chromosome, start_coordinate, end_coordinate, "triotype lookup")
-
-    if (len(output) > 2):
-        raise UnexpectedTabixOutputError("expected 2 lines, found " + str(len(output)))
-
-    result = parse_triotype_lookup_with_headers(output, header_line_identifier='#', line_filter='##')
-
-    if result.chromosome[3:] != chromosome or result.start != int(coordinate):
-        errmsg = "got " + str(result.chromosome) + ":" + str(result.start) + ", full line \'" + repr(output) + "\'"
-        raise WrongLineFoundError(chromosome, start_coordinate, end_coordinate, errmsg)
+    result = triotype_singleline_lookup(tabix_path, tsv_path, chromosome, start_coordinate, end_coordinate, reader,
+                                        samples, include_family_members, presence_index)
+    result.values = SharedHeaderRow(header, result.values)
 
     return result
 
-def tsv_region_lookup(tabix_path, tsv_path, chromosome, start, end):
-    command = create_tabix_command(tabix_path, tsv_path, chromosome, start, end)
-    tabix_output = subprocess.check_output(command.split())
+def iter_region_records(tabix_path, file_path, chromosome, start, end, reader, parse_fn, value_start_index,
+                        samples=None):
+    # Parses the records of a region as tabix reads them, in one pass. All records share the header
+    # of the file, or the header of the projection to 'samples'.
+    header = get_header_identifiers(tabix_path, file_path, chromosome, start, value_start_index, reader)
+    columns = None
+    if samples is not None:
+        projection = get_sample_projection(header, samples)
+        header = projection.header
+        columns = projection.columns
+
+    for line in iter_tabix_lines(tabix_path, file_path, chromosome, start, end, reader):
+        if line.strip() == '' or line.startswith('#'):
+            continue
+        yield parse_fn(line, identifiers=header, columns=columns)
+
+def vcf_region_lookup(tabix_path, vcf_path, chromosome, start, end, reader=None, samples=None):
+    # Returns all records in the region. The values of the result are MultilineTabixResult
+    # objects, the values of which are keyed by sample ID.
+    records = list(iter_region_records(tabix_path, vcf_path, chromosome, start, end, reader, parse_vcf_line,
+                                       VCF_VALUE_START_INDEX, samples))
+    return MultilineTabixResult(chromosome, start, end, records)
+
+def triotype_region_lookup(tabix_path, tsv_path, chromosome, start, end, reader=None, samples=None):
+    # Like vcf_region_lookup, for triotype files.
+    records = list(iter_region_records(tabix_path, tsv_path, chromosome, start, end, reader, parse_triotype_line,
+                                       TRIOTYPE_VALUE_START_INDEX, samples))
+    return MultilineTabixResult(chromosome, start, end, records)
+
+def tsv_region_lookup(tabix_path, tsv_path, chromosome, start, end, reader=None):
+    tabix_output = run_tabix(tabix_path, tsv_path, chromosome, start, end, reader, stderr=None)
     values = parse_region_lookup_result(tabix_output)
     
     return MultilineTabixResult(chromosome, start, end, values)
+
+def tsv_region_lookup_iter(tabix_path, tsv_path, chromosome, start, end, reader=None):
+    # Like tsv_region_lookup, but yields the rows as they are read. The "-h" flag has to be included
+    # in tabix_path, so that the field keys can be read from the header line.
+    return iter_region_lookup_rows(iter_tabix_lines(tabix_path, tsv_path, chromosome, start, end, reader))
+
+def group_coordinates(coordinates, max_gap):
+    # Sorts (chromosome, start, end) tuples and merges those on the same chromosome that lie within
+    # 'max_gap' bases of each other. Returns (chromosome, start, end, member_indexes) tuples, where
+    # the member indexes point into the 'coordinates' list.
+    order = sorted(xrange(len(coordinates)), key=lambda i: (str(coordinates[i][0]), int(coordinates[i][1])))
+    groups = []
+    for index in order:
+        chromosome, start, end = coordinates[index]
+        start = int(start)
+        end = int(end)
+        if groups and groups[-1][0] == chromosome and start - groups[-1][2] <= max_gap:
+            group = groups[-1]
+            group[2] = max(group[2], end)
+            group[3].append(index)
+        else:
+            groups.append([chromosome, start, end, [index]])
+
+    return [tuple(group) for group in groups]
+
+def singleline_batch_lookup(tabix_path, file_path, file_type, coordinates, max_gap=0, reader=None,
+                            presence_index=False):
+    # Runs one region scan per group of nearby coordinates, and assigns the records found to each
+    # requested (chromosome, position, position) by position, see parse_batch_coordinates in
+    # tabix_lookup.py. Returns one result per coordinate, in request order: None if no
+    # record was found, as CoordinateRangeEmptyError would signal for a single lookup, or an
+    # UnexpectedTabixOutputError if several records were found, so that one such coordinate does not
+    # fail the others. With 'presence_index', single positions without a record are not scanned;
+    # ranges are always scanned, as the index cannot answer them.
+    if file_type == 'vcf':
+        parse_fn = parse_vcf_line
+    elif file_type == 'trio':
+        parse_fn = parse_triotype_line
+    else:
+        raise UnexpectedTabixOutputError("batch lookups not supported for type " + repr(file_type))
+
+    positions = [(chromosome, int(start), int(start)) for chromosome, start, end in coordinates]
+    candidates = range(len(positions))
+    if presence_index:
+        try:
+            candidates = [index for index in candidates if int(coordinates[index][2]) != positions[index][1] or
+                          presence.has_record(file_path, *positions[index])]
+        except (IOError, OSError, tabix_reader.TabixReaderError) as e:
+            raise TabixExecutionError(str(e), str(e))
+
+    results = [None] * len(coordinates)
+    for chromosome, group_start, group_end, group_members in group_coordinates([positions[index] for index in candidates],
+                                                                               max_gap):
+        members = [candidates[member] for member in group_members]
+        tabix_output = run_tabix(tabix_path, file_path, chromosome, group_start, group_end, reader)
+        records = [parse_fn(line) for line in split_and_remove_empty_lines(tabix_output)]
+        records = [record for record in records if record.chromosome[3:] == chromosome]
+        record_positions = [record.start for record in records]
+
+        for index in members:
+            start = positions[index][1]
+            first = bisect.bisect_left(record_positions, start)
+            last = bisect.bisect_right(record_positions, start)
+            if last - first > 1:
+                results[index] = UnexpectedTabixOutputError("expected 1 line, found " + str(last - first) + " for " +
+                                                            query_description(chromosome, start, start))
+            elif last - first == 1:
+                results[index] = records[first]
+
+    return results
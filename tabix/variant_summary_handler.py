@@ -1,14 +1,36 @@
 from tornado.options import logging
+import tornado.gen
 import tornado.web
 
 import json
 
 import variant_summary_lookup as vsl
+from association_scan import STATISTICS
+from single_flight import get_single_flight
 
 from tabix_utils import CoordinateRangeEmptyError, WrongLineFoundError, TabixExecutionError, UnexpectedTabixOutputError
+from tabix_utils import UnknownSampleError, get_sample_selection
 from feature_data_source import FeatureNotFoundError
 
 REQUIRED_ARGUMENTS = frozenset(['chromosome', 'coordinate', 'feature_id'])
+OPTIONAL_ARGUMENTS = frozenset(['samples', 'cohort'])
+SCAN_ARGUMENTS = frozenset(['chromosome', 'coordinate', 'scan', 'top', 'statistic'])
+
+# Several features can be summarized in one request, with repeated feature_id arguments or with a
+# POST body such as
+#   {"chromosome": "1", "coordinate": 12345, "feature_ids": ["B:CLIN:...", ...], "cohort": "..."}
+# The response then maps each feature ID to its summary.
+MAX_FEATURE_IDS = 1000
+
+# With scan=<source> instead of feature IDs, all features of the feature matrix are ranked by the
+# association of their categories with the values of the position, and the 'top' features with the
+# highest 'statistic' are returned. Sources are listed in variant_summary_lookup.SCAN_SOURCES.
+DEFAULT_SCAN_TOP = 20
+MAX_SCAN_TOP = 1000
+DEFAULT_SCAN_STATISTIC = "chi2"
+
+# Identical queries in flight at the same time are run once, see single_flight.py
+QUERIES = get_single_flight("variant_summary")
 
 class VariantSummaryHandler(tornado.web.RequestHandler):
     def initialize(self):
@@ -23,6 +45,7 @@ class VariantSummaryHandler(tornado.web.RequestHandler):
         else:
             self.write("Server error occurred")
 
+    @tornado.web.asynchronous
     def get(self, *uri_path):
         sub_path = self.request.path.replace("/variant_summary", "")
         uri_parts = sub_path.split("/")
@@ -35,7 +58,11 @@ class VariantSummaryHandler(tornado.web.RequestHandler):
 
         config = self._config_map[data_id]
 
-        if not set(self.request.arguments).issubset(REQUIRED_ARGUMENTS):
+        if "scan" in self.request.arguments:
+            self.get_scan(data_id, config)
+            return
+
+        if not set(self.request.arguments).issubset(REQUIRED_ARGUMENTS | OPTIONAL_ARGUMENTS):
             logging.error("Variant Summary - invalid arguments: [%s]" % str(self.request.arguments))
             self.send_error(400)
             return
@@ -50,19 +77,122 @@ class VariantSummaryHandler(tornado.web.RequestHandler):
             self.send_error(400)
             return
 
-        feature_id = self.get_argument("feature_id")
+        feature_ids = self.get_arguments("feature_id")
+        if len(feature_ids) == 0 or len(feature_ids) > MAX_FEATURE_IDS:
+            logging.error("Variant Summary - expected 1 to " + str(MAX_FEATURE_IDS) + " feature IDs, got " + str(len(feature_ids)))
+            self.send_error(400)
+            return
+
+        try:
+            samples = get_sample_selection(config, self.get_argument("samples", None), self.get_argument("cohort", None))
+        except ValueError as ve:
+            logging.error("Variant Summary - invalid sample selection: " + str(ve))
+            self.send_error(400)
+            return
 
-        logging.debug("Querying Variant Summary for \'" + str((chromosome, coordinate, feature_id)) + "\'")
+        if len(feature_ids) > 1:
+            self.run_query(data_id, config, chromosome, coordinate, feature_ids, samples)
+        else:
+            self.run_query(data_id, config, chromosome, coordinate, feature_ids[0], samples)
+
+    def get_scan(self, data_id, config):
+        if not set(self.request.arguments).issubset(SCAN_ARGUMENTS | OPTIONAL_ARGUMENTS):
+            logging.error("Variant Summary - invalid scan arguments: [%s]" % str(self.request.arguments))
+            self.send_error(400)
+            return
 
         try:
-            result = vsl.do_query(config, chromosome, coordinate, feature_id)
+            chromosome = self.get_argument("chromosome")
+            coordinate = int(self.get_argument("coordinate"))
+            source = self.get_argument("scan")
+            if source not in vsl.SCAN_SOURCES:
+                raise ValueError("unknown scan source " + source)
+            statistic = self.get_argument("statistic", DEFAULT_SCAN_STATISTIC)
+            if statistic not in STATISTICS:
+                raise ValueError("unknown statistic " + statistic)
+            top = int(self.get_argument("top", DEFAULT_SCAN_TOP))
+            if top < 1 or top > MAX_SCAN_TOP:
+                raise ValueError("expected top between 1 and " + str(MAX_SCAN_TOP))
+            samples = get_sample_selection(config, self.get_argument("samples", None), self.get_argument("cohort", None))
+        except (ValueError, tornado.web.HTTPError) as e:
+            logging.error("Variant Summary - invalid scan request: " + str(e))
+            self.send_error(400)
+            return
+
+        self.run_scan(data_id, config, chromosome, coordinate, source, statistic, top, samples)
+
+    @tornado.web.asynchronous
+    def post(self, *uri_path):
+        sub_path = self.request.path.replace("/variant_summary", "")
+        uri_parts = sub_path.split("/")
+        data_id = uri_parts[1]
+
+        if data_id not in self._config_map.keys():
+            logging.error("Unknown Variant Summary data lookup ID [%s]" % data_id)
+            self.send_error(400)
+            return
+
+        config = self._config_map[data_id]
+
+        try:
+            query = json.loads(self.request.body)
+            chromosome = str(query["chromosome"])
+            coordinate = int(query["coordinate"])
+            if not isinstance(query["feature_ids"], list) or len(query["feature_ids"]) > MAX_FEATURE_IDS:
+                raise ValueError("expected a list of at most " + str(MAX_FEATURE_IDS) + " feature IDs")
+            feature_ids = [str(feature_id) for feature_id in query["feature_ids"]]
+            samples = query.get("samples")
+            if isinstance(samples, list):
+                samples = ",".join(samples)
+            samples = get_sample_selection(config, samples, query.get("cohort"))
+        except (ValueError, TypeError, KeyError) as e:
+            logging.error("Variant Summary - invalid request: " + str(e))
+            self.send_error(400)
+            return
+
+        self.run_query(data_id, config, chromosome, coordinate, feature_ids, samples)
+
+    @tornado.gen.engine
+    def run_query(self, data_id, config, chromosome, coordinate, feature_ids, samples):
+        # 'feature_ids' is either a single feature ID, or a list for a summary keyed by feature ID.
+        logging.debug("Querying Variant Summary for \'" + str((chromosome, coordinate, feature_ids)) + "\'")
+
+        if isinstance(feature_ids, list):
+            query_key = (data_id, chromosome, coordinate, tuple(feature_ids), True, tuple(samples or ()))
+            outcome = yield tornado.gen.Task(QUERIES.run, query_key, vsl.do_multi_feature_query, config, chromosome,
+                                             coordinate, feature_ids, samples)
+        else:
+            query_key = (data_id, chromosome, coordinate, feature_ids, tuple(samples or ()))
+            outcome = yield tornado.gen.Task(QUERIES.run, query_key, vsl.do_query, config, chromosome, coordinate,
+                                             feature_ids, samples)
+
+        self.write_outcome(outcome)
+
+    @tornado.gen.engine
+    def run_scan(self, data_id, config, chromosome, coordinate, source, statistic, top, samples):
+        logging.debug("Scanning Variant Summary for \'" + str((chromosome, coordinate, source, statistic, top)) + "\'")
+
+        query_key = (data_id, chromosome, coordinate, "scan", source, statistic, top, tuple(samples or ()))
+        outcome = yield tornado.gen.Task(QUERIES.run, query_key, vsl.do_association_scan, config, chromosome,
+                                         coordinate, source, statistic, top, samples)
+        self.write_outcome(outcome)
+
+    def write_outcome(self, outcome):
+        try:
+            result = outcome.get()
             self.write(json.dumps(result, sort_keys=True))
             self.set_status(200)
+            self.finish()
 
         except CoordinateRangeEmptyError as cnf:
             logging.info(cnf)
             self.write(json.dumps({}, sort_keys=True))
             self.set_status(200)
+            self.finish()
+
+        except UnknownSampleError as use:
+            logging.error(use)
+            self.send_error(400)
 
         except WrongLineFoundError as wlf:
             logging.error(wlf)
@@ -80,6 +210,7 @@ class VariantSummaryHandler(tornado.web.RequestHandler):
             logging.info(fnf)
             self.write(json.dumps({}, sort_keys=True))
             self.set_status(200)
+            self.finish()
 
         except Exception as e:
             logging.error("Running Variant Summary service failed: " + str(e))
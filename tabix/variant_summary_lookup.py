@@ -1,9 +1,20 @@
 from collections import Counter
+from tornado.options import logging
 
 import argparse
+import time
 
-from tabix_utils import vcf_singleline_lookup_with_header, triotype_singleline_lookup_with_header
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from tabix_utils import vcf_singleline_lookup_with_header, triotype_singleline_lookup_with_header, check_presence
+from lru_cache import LRUCache
+import association_scan
+import lookup_executor
 import feature_data_source
+import variant_summary_store
 
 CHROMOSOME_SET = frozenset([str(x) for x in xrange(1, 23)] + list(['M', 'X', 'Y']))
 TRIO_TYPES = ['12','21','22','31','40','41','42','50','51','60','NA','MIE']
@@ -15,11 +26,6 @@ class BarGroup:
         self.type = type
         self.label = label
 
-class VCFValue:
-    def __init__(self, id, value):
-        self.id = id
-        self.value = value
-
 DEFAULT_COUNT_MAP = {
     '0/1': '0/1 1/0',
     '1/0': '0/1 1/0'
@@ -32,13 +38,195 @@ DEFAULT_BAR_GROUPS = [
     BarGroup('./.', './.')
 ]
 
-def process_triotypes(data, feature):
-    plot_data = []
-    category_trio_types = {}
-    values = [VCFValue(x[0], x[1]) for x in data.values.iteritems()]
+###############
+# Aggregation #
+###############
+
+# The IDs of a triotype or VCF header are indexed once per header: the family of each ID, and the
+# role of each VCF sample. With NumPy installed, counts are computed from integer codes instead of
+# per-sample Python loops, and the feature category of each family is computed once per header and
+# feature. Without NumPy, and for rows with missing trailing values, the loops below are used.
+
+ROLE_F = 0
+ROLE_M = 1
+ROLE_NB = 2
+ROLE_OTHER = 3
+# All IDs of a triotype header
+ROLE_ALL = -1
+
+CATEGORY_CODES = dict((category, code) for code, category in enumerate(FEATURE_CATEGORIES))
+CATEGORY_OTHER = len(FEATURE_CATEGORIES)
+
+# (id(RowHeader), is_vcf) -> (RowHeader, SampleIndex)
+SAMPLE_INDEXES = LRUCache(256, size_fn=lambda entry: 1)
+# (id(SampleIndex), id(FeatureData)) -> (SampleIndex, FeatureData, category code per family)
+FAMILY_CATEGORIES = LRUCache(1024, size_fn=lambda entry: 1)
+
+def get_vcf_role(sample_id):
+    role = sample_id.split('-')[2]
+    if role == 'F':
+        return ROLE_F
+    elif role == 'M':
+        return ROLE_M
+    elif role.startswith('NB'):
+        return ROLE_NB
+    return ROLE_OTHER
+
+class SampleIndex:
+    def __init__(self, header, is_vcf):
+        # The distinct IDs, as SharedHeaderRow.iteritems returns them
+        items = sorted(header.index.iteritems(), key=lambda item: item[1])
+        self.size = len(header.names)
+        # Position and ID of VCF samples without a role. Rows with a value for them are not summarized.
+        self.malformed = []
+
+        family_index = {}
+        self.family_ids = []
+        family_codes = []
+        roles = []
+        for sample_id, position in items:
+            family_id = sample_id
+            role = ROLE_ALL
+            if is_vcf:
+                family_id = sample_id.rsplit('-', 1)[0]
+                try:
+                    role = get_vcf_role(sample_id)
+                except IndexError:
+                    self.malformed.append((position, sample_id))
+                    role = ROLE_OTHER
+            if family_id not in family_index:
+                family_index[family_id] = len(self.family_ids)
+                self.family_ids.append(family_id)
+            family_codes.append(family_index[family_id])
+            roles.append(role)
+
+        # (position, family ID) of the units counted for each role: all IDs of a triotype header,
+        # or the F, M and NB samples of a VCF header.
+        self.members = dict((role, []) for role in (ROLE_ALL, ROLE_F, ROLE_M, ROLE_NB))
+        for (sample_id, position), family_code, role in zip(items, family_codes, roles):
+            if role in self.members:
+                self.members[role].append((position, self.family_ids[family_code]))
+
+        # Families that are looked up in the feature values
+        needed = set(family_id for role_members in self.members.itervalues() for position, family_id in role_members)
+        self.needed_families = [family_id in needed for family_id in self.family_ids]
+
+        if numpy is not None:
+            self.positions = numpy.array([position for sample_id, position in items], dtype=numpy.intp)
+            self.family_codes = numpy.array(family_codes, dtype=numpy.intp)
+            self.roles = numpy.array(roles, dtype=numpy.intp)
+
+    def check_roles(self, row_size):
+        for position, sample_id in self.malformed:
+            if position < row_size:
+                raise IndexError("no role in sample ID \'" + sample_id + "\'")
+
+    def row_members(self, value_list, role):
+        # (family ID, value) of the units of 'role' in a row
+        size = len(value_list)
+        self.check_roles(size)
+        return [(family_id, value_list[position]) for position, family_id in self.members[role] if position < size]
+
+def get_sample_index(header, is_vcf):
+    key = (id(header), is_vcf)
+    cached = SAMPLE_INDEXES.get(key)
+    if cached is not None and cached[0] is header:
+        return cached[1]
+
+    index = SampleIndex(header, is_vcf)
+    SAMPLE_INDEXES.put(key, (header, index))
+    return index
+
+def get_family_categories(index, feature):
+    key = (id(index), id(feature))
+    cached = FAMILY_CATEGORIES.get(key)
+    if cached is not None and cached[0] is index and cached[1] is feature:
+        return cached[2]
+
+    # Raises KeyError for families missing from the feature, as the loops below do.
+    categories = numpy.array([CATEGORY_CODES.get(feature.values[family_id], CATEGORY_OTHER) if needed else CATEGORY_OTHER
+                              for family_id, needed in zip(index.family_ids, index.needed_families)], dtype=numpy.intp)
+    FAMILY_CATEGORIES.put(key, (index, feature, categories))
+    return categories
+
+def can_vectorize(data):
+    # Rows with missing trailing values are left to the loops.
+    return numpy is not None and len(data.values.value_list) >= len(data.values.header.names)
+
+class DecodedRow:
+    # Codes of the values of one triotype or VCF row. Summaries of several features over the same
+    # row share the decoded values.
+    def __init__(self, data, is_vcf):
+        self.index = get_sample_index(data.values.header, is_vcf)
+        self.index.check_roles(len(data.values.value_list))
+        values = numpy.array(data.values.value_list)[self.index.positions]
+        self.distinct_values, self.value_inverse = numpy.unique(values, return_inverse=True)
+        self._value_codes = {}
+
+    def value_codes(self, group_types, count_map):
+        # Integer code per distinct ID: the index of its value in 'group_types' after 'count_map'
+        # is applied, or len(group_types) for other values.
+        key = (tuple(group_types), tuple(sorted(count_map.iteritems())))
+        if key not in self._value_codes:
+            group_index = dict((group_type, index) for index, group_type in enumerate(group_types))
+            lookup = numpy.array([group_index.get(count_map.get(value, value), len(group_types))
+                                  for value in self.distinct_values], dtype=numpy.intp)
+            self._value_codes[key] = lookup[self.value_inverse]
+        return self._value_codes[key]
+
+def count_by_category(category_codes, value_codes, group_types):
+    # Returns {category: {group type: count}}, with the counts as Python ints.
+    group_count = len(group_types) + 1
+    counts = numpy.bincount(category_codes * group_count + value_codes,
+                            minlength=(CATEGORY_OTHER + 1) * group_count).reshape(CATEGORY_OTHER + 1, group_count)
+
+    result = {}
     for category in FEATURE_CATEGORIES:
-        category_values = [x.value for x in values if feature.values[x.id] == category]
-        category_trio_types[category] = Counter(category_values)
+        category_counts = counts[CATEGORY_CODES[category]]
+        result[category] = dict((group_type, int(category_counts[index]))
+                                for index, group_type in enumerate(group_types) if category_counts[index] > 0)
+    return result
+
+def count_family_members(members, feature, count_map):
+    # 'members' is a list of (family ID, value) pairs
+    category_family_members = {}
+
+    for category in FEATURE_CATEGORIES:
+        category_values = []
+
+        for family_id, value in members:
+            if feature.values[family_id] == category:
+                if value in count_map:
+                    category_values.append(count_map[value])
+                else:
+                    category_values.append(value)
+
+        category_family_members[category] = Counter(category_values)
+
+    return category_family_members
+
+def count_role(data, feature, role, count_map, group_types, decoded=None):
+    # Counts per feature category and group of the units of 'role' in the row. 'decoded' is the
+    # DecodedRow of the row, if it is vectorized.
+    if decoded is None:
+        index = get_sample_index(data.values.header, role != ROLE_ALL)
+        return count_family_members(index.row_members(data.values.value_list, role), feature, count_map)
+
+    index = decoded.index
+    family_categories = get_family_categories(index, feature)
+    value_codes = decoded.value_codes(group_types, count_map)
+    if role == ROLE_ALL:
+        return count_by_category(family_categories[index.family_codes], value_codes, group_types)
+
+    selected = index.roles == role
+    return count_by_category(family_categories[index.family_codes[selected]], value_codes[selected], group_types)
+
+def process_triotypes(data, feature, decoded=None):
+    # 'decoded' is the DecodedRow of 'data' if the row is summarized for several features.
+    plot_data = []
+    if decoded is None and can_vectorize(data):
+        decoded = DecodedRow(data, False)
+    category_trio_types = count_role(data, feature, ROLE_ALL, {}, TRIO_TYPES, decoded)
 
     for mtype in TRIO_TYPES:
         cat_data = []
@@ -71,22 +259,8 @@ def process_triotypes(data, feature):
         'plot_data': plot_data
     }
 
-def process_vcf_sample_data(values, feature, count_map, bar_groups):
+def summarize_vcf_counts(category_family_members, feature, bar_groups):
     plot_data = []
-    category_family_members = {}
-
-    for category in FEATURE_CATEGORIES:
-        category_values = []
-
-        for v in values:
-            family_id = v.id.rsplit('-', 1)[0]
-            if feature.values[family_id] == category:
-                if v.value in count_map:
-                    category_values.append(count_map[v.value])
-                else:
-                    category_values.append(v.value)
-
-        category_family_members[category] = Counter(category_values)
 
     for groupinfo in bar_groups:
         cat_data = []
@@ -120,70 +294,288 @@ def process_vcf_sample_data(values, feature, count_map, bar_groups):
         'plot_data': plot_data
     }
 
-def process_vcf_F(filtered_values, feature, chromosome_digit):
-    if chromosome_digit in ['X', 'Y', 'M']:
-        count_map = {}
-
-        bar_groups = [
-            BarGroup('0', 'Reference'),
-            BarGroup('1', 'Non-Reference'),
-            BarGroup('.', 'Missing data')
-        ]
+HAPLOID_BAR_GROUPS = [
+    BarGroup('0', 'Reference'),
+    BarGroup('1', 'Non-Reference'),
+    BarGroup('.', 'Missing data')
+]
 
-        return process_vcf_sample_data(filtered_values, feature, count_map, bar_groups)
+def get_F_count_map_and_bar_groups(chromosome_digit):
+    if chromosome_digit in ['X', 'Y', 'M']:
+        return {}, HAPLOID_BAR_GROUPS
     else:
-        return process_vcf_sample_data(filtered_values, feature, DEFAULT_COUNT_MAP, DEFAULT_BAR_GROUPS)
-
-
-def process_vcf_NB_or_M(filtered_values, feature):
-    return process_vcf_sample_data(filtered_values, feature, DEFAULT_COUNT_MAP, DEFAULT_BAR_GROUPS)
-
-def process_vcf(data, feature, chromosome_digit):
-    values = [VCFValue(x[0], x[1]) for x in data.values.iteritems()]
-
-    f_result = process_vcf_F([v for v in values if v.id.split('-')[2] == 'F'], feature, chromosome_digit)
-    m_result = process_vcf_NB_or_M([v for v in values if v.id.split('-')[2] == 'M'], feature)
-    nb_result = process_vcf_NB_or_M([v for v in values if v.id.split('-')[2].startswith('NB')], feature)
-
-    return {
-        'f': f_result,
-        'm': m_result,
-        'nb': nb_result
-    }
+        return DEFAULT_COUNT_MAP, DEFAULT_BAR_GROUPS
+
+def get_vcf_role_groups(chromosome_digit):
+    # (result key, role, count map, bar groups) of the summaries of a VCF row
+    f_count_map, f_bar_groups = get_F_count_map_and_bar_groups(chromosome_digit)
+    return [('f', ROLE_F, f_count_map, f_bar_groups),
+            ('m', ROLE_M, DEFAULT_COUNT_MAP, DEFAULT_BAR_GROUPS),
+            ('nb', ROLE_NB, DEFAULT_COUNT_MAP, DEFAULT_BAR_GROUPS)]
+
+def process_vcf(data, feature, chromosome_digit, decoded=None):
+    # 'decoded' is the DecodedRow of 'data' if the row is summarized for several features.
+    if decoded is None and can_vectorize(data):
+        decoded = DecodedRow(data, True)
+
+    results = {}
+    for key, role, count_map, bar_groups in get_vcf_role_groups(chromosome_digit):
+        group_types = [groupinfo.type for groupinfo in bar_groups]
+        counts = count_role(data, feature, role, count_map, group_types, decoded)
+        results[key] = summarize_vcf_counts(counts, feature, bar_groups)
+    return results
 
 ########################
 # Data loading methods #
 ########################
 
-def get_triotype_data(tabix_exe, data_file_path, chromosome, coordinate):
-    result = triotype_singleline_lookup_with_header(tabix_exe, data_file_path, chromosome, coordinate, coordinate)
+def get_triotype_data(tabix_exe, data_file_path, chromosome, coordinate, reader=None, samples=None,
+                      presence_index=False):
+    result = triotype_singleline_lookup_with_header(tabix_exe, data_file_path, chromosome, coordinate, coordinate,
+                                                    reader=reader, samples=samples, include_family_members=True,
+                                                    presence_index=presence_index)
     return result
 
-def get_vcf_data(tabix_exe, data_file_path, chromosome, coordinate):
-    result = vcf_singleline_lookup_with_header(tabix_exe, data_file_path, chromosome, coordinate, coordinate)
+def get_vcf_data(tabix_exe, data_file_path, chromosome, coordinate, reader=None, samples=None,
+                 presence_index=False):
+    result = vcf_singleline_lookup_with_header(tabix_exe, data_file_path, chromosome, coordinate, coordinate,
+                                               reader=reader, samples=samples, include_family_members=True,
+                                               presence_index=presence_index)
     return result
 
+def selected_families(samples):
+    # The family IDs of a list of family or sample IDs
+    families = set(samples)
+    families.update(sample_id.rsplit('-', 1)[0] for sample_id in samples)
+    return families
+
+def select_feature_families(feature, samples):
+    # Restricts the feature values, and thereby the category sizes, to the families of the given
+    # family or sample IDs.
+    families = selected_families(samples)
+    value_dict = dict((family_id, value) for family_id, value in feature.values.iteritems() if family_id in families)
+    return feature_data_source.FeatureData(feature.id, value_dict)
+
+# Runs the feature, triotype and VCF fetches of a query at the same time when configured. This is
+# a pool of its own, as do_query itself runs on the lookup executor's pool. Each fetch on this pool
+# holds a lookup slot, so that --tabix_max_processes also bounds the tabix processes of the
+# fetches, see lookup_executor.py.
+FETCH_POOL = None
+
+def configure_fetch_pool(max_workers):
+    global FETCH_POOL
+
+    if FETCH_POOL is not None:
+        FETCH_POOL.terminate()
+        FETCH_POOL = None
+
+    if max_workers is not None and max_workers > 0:
+        from multiprocessing.pool import ThreadPool
+        FETCH_POOL = ThreadPool(max_workers)
+
+def timed(stage, fn, *args):
+    started = time.time()
+    try:
+        return fn(*args)
+    finally:
+        logging.debug("Variant Summary - %s took %.1f ms" % (stage, (time.time() - started) * 1000.0))
+
+class DeferredResult:
+    # Same interface as the AsyncResult of a pool, for a call made when its result is read.
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+
+    def get(self):
+        return self.fn(*self.args)
+
+def timed_in_slot(stage, fn, *args):
+    try:
+        return timed(stage, fn, *args)
+    finally:
+        lookup_executor.release_slot()
+
+def start_fetch(stage, fn, *args):
+    # Without a free lookup slot, the fetch runs in the slot of the query when its result is read.
+    if FETCH_POOL is None or not lookup_executor.try_acquire_slot():
+        return DeferredResult(timed, (stage, fn) + args)
+    return FETCH_POOL.apply_async(timed_in_slot, (stage, fn) + args)
+
 #############
 # Query API #
 #############
 
-def do_query(configuration, chromosome_digit, coordinate, feature_id):
-    chromosome = str(chromosome_digit)
+def start_row_fetches(configuration, chromosome, coordinate, samples):
     tabix_exe = configuration['tabix_executable']
+    reader = configuration.get('reader')
+    presence_index = configuration.get('presence_index', False)
 
-    feature = feature_data_source.get_feature_by_id(configuration['feature_matrix'], feature_id)
+    triotype_fetch = start_fetch("triotype fetch", get_triotype_data, tabix_exe, configuration['triotype_file'],
+                                 chromosome, coordinate, reader, samples, presence_index)
+    vcf_fetch = start_fetch("VCF fetch", get_vcf_data, tabix_exe, configuration['vcf_file'],
+                            chromosome, coordinate, reader, samples, presence_index)
+    return triotype_fetch, vcf_fetch
 
-    triotypes = get_triotype_data(tabix_exe, configuration['triotype_file'], chromosome, coordinate)
-    triotype_response = process_triotypes(triotypes, feature)
+def do_query(configuration, chromosome_digit, coordinate, feature_id, samples=None):
+    # With 'samples', a list of family or sample IDs, only those families are summarized.
+    chromosome = str(chromosome_digit)
+
+    if samples is None:
+        # Summaries precomputed by variant_summary_store.py, if configured and up to date
+        stored = variant_summary_store.get_stored_summary(configuration, chromosome, coordinate, feature_id)
+        if stored is not None:
+            return stored
+
+    if configuration.get('presence_index', False):
+        # Answers empty positions before the feature matrix is queried.
+        check_presence(configuration['triotype_file'], chromosome, coordinate, coordinate, "triotype lookup")
+
+    started = time.time()
+    # Results are read in the same order as before, so that the same error is reported first.
+    feature_fetch = start_fetch("feature fetch", feature_data_source.get_feature_by_id,
+                                configuration['feature_matrix'], feature_id)
+    triotype_fetch, vcf_fetch = start_row_fetches(configuration, chromosome, coordinate, samples)
 
-    vcf_data = get_vcf_data(tabix_exe, configuration['vcf_file'], chromosome, coordinate)
-    vcf_response = process_vcf(vcf_data, feature, chromosome_digit)
+    feature = feature_fetch.get()
+    if samples is not None:
+        feature = select_feature_families(feature, samples)
+
+    triotype_response = timed("triotype summary", process_triotypes, triotype_fetch.get(), feature)
+    vcf_response = timed("VCF summary", process_vcf, vcf_fetch.get(), feature, chromosome_digit)
+
+    logging.debug("Variant Summary - query took %.1f ms" % ((time.time() - started) * 1000.0))
 
     return {
         'triotypes': triotype_response,
         'vcf': vcf_response
     }
 
+def summarize_features(triotypes, vcf_data, features, chromosome_digit):
+    # Summaries of one triotype and VCF row for several (feature ID, FeatureData) pairs, keyed by
+    # feature ID. The rows are decoded once.
+    decoded_triotypes = None
+    if can_vectorize(triotypes):
+        decoded_triotypes = DecodedRow(triotypes, False)
+    decoded_vcf = None
+    if can_vectorize(vcf_data):
+        decoded_vcf = DecodedRow(vcf_data, True)
+
+    results = {}
+    for feature_id, feature in features:
+        results[feature_id] = {
+            'triotypes': process_triotypes(triotypes, feature, decoded_triotypes),
+            'vcf': process_vcf(vcf_data, feature, chromosome_digit, decoded_vcf)
+        }
+    return results
+
+def do_multi_feature_query(configuration, chromosome_digit, coordinate, feature_ids, samples=None):
+    # Summaries of one position for several features, keyed by feature ID. The triotype and VCF
+    # rows are fetched and decoded once. Features that are not found map to an empty object, as
+    # for a single feature.
+    chromosome = str(chromosome_digit)
+
+    results = {}
+    if samples is None:
+        results = variant_summary_store.get_stored_summaries(configuration, chromosome, coordinate, feature_ids)
+        if len(results) == len(set(feature_ids)):
+            return results
+
+    if configuration.get('presence_index', False):
+        check_presence(configuration['triotype_file'], chromosome, coordinate, coordinate, "triotype lookup")
+
+    started = time.time()
+    feature_fetches = []
+    for feature_id in feature_ids:
+        if feature_id in results:
+            continue
+        feature_fetches.append((feature_id, start_fetch("feature fetch", feature_data_source.get_feature_by_id,
+                                                        configuration['feature_matrix'], feature_id)))
+    triotype_fetch, vcf_fetch = start_row_fetches(configuration, chromosome, coordinate, samples)
+
+    triotypes = triotype_fetch.get()
+    vcf_data = vcf_fetch.get()
+
+    features = []
+    for feature_id, feature_fetch in feature_fetches:
+        try:
+            feature = feature_fetch.get()
+        except feature_data_source.FeatureNotFoundError as fnf:
+            logging.info(fnf)
+            results[feature_id] = {}
+            continue
+
+        if samples is not None:
+            feature = select_feature_families(feature, samples)
+        features.append((feature_id, feature))
+
+    results.update(summarize_features(triotypes, vcf_data, features, chromosome_digit))
+
+    logging.debug("Variant Summary - query of %d features took %.1f ms" % (len(feature_ids), (time.time() - started) * 1000.0))
+    return results
+
+# Sources of an association scan: the families of the triotype row, or the samples of one role
+# in the VCF row.
+SCAN_SOURCES = ['triotypes', 'f', 'm', 'nb']
+
+def get_scan_groups(source, chromosome_digit):
+    if source == 'triotypes':
+        return {}, TRIO_TYPES
+    elif source == 'f':
+        count_map, bar_groups = get_F_count_map_and_bar_groups(chromosome_digit)
+    else:
+        count_map, bar_groups = DEFAULT_COUNT_MAP, DEFAULT_BAR_GROUPS
+    return count_map, [groupinfo.type for groupinfo in bar_groups]
+
+def get_scan_units(data, source, samples):
+    # Returns the family IDs and values of the units of 'source' in the row.
+    role = {'f': ROLE_F, 'm': ROLE_M, 'nb': ROLE_NB}.get(source, ROLE_ALL)
+    index = get_sample_index(data.values.header, role != ROLE_ALL)
+    members = index.row_members(data.values.value_list, role)
+
+    if samples is not None:
+        families = selected_families(samples)
+        members = [(family_id, value) for family_id, value in members if family_id in families]
+
+    return [family_id for family_id, value in members], [value for family_id, value in members]
+
+def do_association_scan(configuration, chromosome_digit, coordinate, source, statistic, top, samples=None):
+    # Ranks all features of the feature matrix by the association of their categories with the
+    # trio types or genotypes of one position, see association_scan.py.
+    chromosome = str(chromosome_digit)
+
+    if configuration.get('presence_index', False):
+        check_presence(configuration['triotype_file'], chromosome, coordinate, coordinate, "triotype lookup")
+
+    started = time.time()
+    tabix_exe = configuration['tabix_executable']
+    reader = configuration.get('reader')
+    presence_index = configuration.get('presence_index', False)
+    if source == 'triotypes':
+        data = timed("triotype fetch", get_triotype_data, tabix_exe, configuration['triotype_file'],
+                     chromosome, coordinate, reader, samples, presence_index)
+    else:
+        data = timed("VCF fetch", get_vcf_data, tabix_exe, configuration['vcf_file'],
+                     chromosome, coordinate, reader, samples, presence_index)
+
+    count_map, group_types = get_scan_groups(source, chromosome_digit)
+    unit_families, unit_values = get_scan_units(data, source, samples)
+    families = None
+    if samples is not None:
+        families = selected_families(samples)
+    feature_bitsets = timed("feature encoding", association_scan.get_feature_bitsets,
+                            configuration['feature_matrix'], unit_families, families)
+    group_bits = association_scan.encode_groups(unit_values, group_types, count_map)
+    features = timed("scan", association_scan.scan, feature_bitsets, group_bits, group_types, statistic, top)
+
+    logging.debug("Variant Summary - scan of %d features took %.1f ms" % (len(feature_bitsets.feature_ids), (time.time() - started) * 1000.0))
+
+    return {
+        'source': source,
+        'statistic': statistic,
+        'units': len(unit_families),
+        'features': features
+    }
+
 def main():
     mainparser = argparse.ArgumentParser(description="Variant summary service")
 
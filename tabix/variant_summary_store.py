@@ -0,0 +1,135 @@
+from tornado.options import logging
+
+import cPickle
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import feature_data_source
+import tabix_reader
+
+# Precomputed Variant Summary results of a list of features at every position of the triotype
+# file. The store is a directory with one SQLite file per chromosome, "<store>/chr<chromosome>.sqlite",
+# of pickled, compressed summaries keyed by (coordinate, feature ID). Each file records the
+# signatures of the VCF and triotype files and the version of the feature matrix it was built
+# from, and is not used after any of them changes.
+#
+# Configured with "summary_store": "<store directory>" in the Variant Summary configuration, and
+# built with variant_summary_store_builder.py. Whether a file is up to date is checked at most every
+# "summary_store_refresh_interval" seconds of the configuration.
+
+STORE_VERSION = 1
+
+DEFAULT_STORE_REFRESH_INTERVAL = 60
+
+# shard path -> StoreShard
+SHARDS = {}
+SHARDS_LOCK = threading.Lock()
+
+# shard path -> (time of the check, StoreShard or None if the file is missing or out of date)
+CURRENT_SHARDS = {}
+
+def shard_path(store_dir, chromosome):
+    return os.path.join(store_dir, "chr" + str(chromosome) + ".sqlite")
+
+def source_signatures(configuration):
+    # As stored in the meta table of a shard: lists of numbers and strings
+    feature_matrix_version = [value if value is None or isinstance(value, (int, long, float)) else str(value)
+                              for value in feature_data_source.feature_matrix_version(configuration['feature_matrix'])]
+
+    return {
+        "vcf_file": list(tabix_reader.file_signature(configuration['vcf_file'])),
+        "triotype_file": list(tabix_reader.file_signature(configuration['triotype_file'])),
+        "feature_matrix": feature_matrix_version
+    }
+
+class StoreShard(object):
+    def __init__(self, path):
+        self.path = path
+        self.signature = tabix_reader.file_signature(path)
+        # Read from the lookup executor's threads, one query at a time
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        meta = dict(self.connection.execute("SELECT key, value FROM meta"))
+        self.version = int(meta.get("version", 0))
+        self.source_signatures = json.loads(meta.get("source_signatures", "null"))
+
+    def get(self, coordinate, feature_id):
+        with self.lock:
+            row = self.connection.execute("SELECT summary FROM summaries WHERE coordinate = ? AND feature_id = ?",
+                                          (coordinate, feature_id)).fetchone()
+        if row is None:
+            return None
+        return cPickle.loads(zlib.decompress(str(row[0])))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+def get_shard(path):
+    # Returns None if there is no store file for the chromosome. A rebuilt file is opened again.
+    try:
+        signature = tabix_reader.file_signature(path)
+    except OSError:
+        return None
+
+    shard = SHARDS.get(path)
+    if shard is not None and shard.signature == signature:
+        return shard
+
+    with SHARDS_LOCK:
+        shard = SHARDS.get(path)
+        if shard is None or shard.signature != signature:
+            if shard is not None:
+                shard.close()
+            try:
+                shard = StoreShard(path)
+            except sqlite3.Error as e:
+                logging.warn("Variant Summary store \'" + path + "\' could not be read: " + str(e))
+                return None
+            SHARDS[path] = shard
+        return shard
+
+def get_current_shard(configuration, chromosome):
+    # Returns the store file of the chromosome if it was built from the current source files, or
+    # None. The result is kept for the refresh interval, so that lookups do not stat the files or
+    # query the feature matrix version each time.
+    store_dir = configuration.get('summary_store')
+    if store_dir is None:
+        return None
+
+    path = shard_path(store_dir, chromosome)
+    refresh_interval = configuration.get('summary_store_refresh_interval', DEFAULT_STORE_REFRESH_INTERVAL)
+    checked = CURRENT_SHARDS.get(path)
+    if checked is not None and time.time() - checked[0] <= refresh_interval:
+        return checked[1]
+
+    shard = get_shard(path)
+    if shard is not None and (shard.version != STORE_VERSION or shard.source_signatures != source_signatures(configuration)):
+        logging.debug("Variant Summary store \'" + shard.path + "\' is out of date")
+        shard = None
+    CURRENT_SHARDS[path] = (time.time(), shard)
+    return shard
+
+def get_stored_summary(configuration, chromosome, coordinate, feature_id):
+    # Returns the stored summary, or None if it has to be computed.
+    shard = get_current_shard(configuration, chromosome)
+    if shard is None:
+        return None
+    return shard.get(int(coordinate), feature_id)
+
+def get_stored_summaries(configuration, chromosome, coordinate, feature_ids):
+    # Stored summaries of several features, keyed by feature ID. Features without one are left out.
+    shard = get_current_shard(configuration, chromosome)
+    if shard is None:
+        return {}
+
+    summaries = {}
+    for feature_id in feature_ids:
+        summary = shard.get(int(coordinate), feature_id)
+        if summary is not None:
+            summaries[feature_id] = summary
+    return summaries
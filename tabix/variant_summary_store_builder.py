@@ -0,0 +1,152 @@
+from tornado.options import logging
+
+import argparse
+import cPickle
+import itertools
+import json
+import os
+import sqlite3
+import time
+import zlib
+
+import feature_data_source
+import presence_index
+import variant_summary_lookup as vsl
+from tabix_utils import iter_region_records, parse_triotype_line, parse_vcf_line
+from tabix_utils import TRIOTYPE_VALUE_START_INDEX, VCF_VALUE_START_INDEX
+from variant_summary_store import STORE_VERSION, shard_path, source_signatures
+
+# Builds the precomputed Variant Summary store read by variant_summary_store.py:
+#
+#   python variant_summary_store_builder.py --config source.json --output <store directory> \
+#       --features B:CLIN:... B:CLIN:... --processes 8
+#
+# where source.json holds the configuration of the Variant Summary source. Each chromosome is
+# built by one worker process, which reads the triotype and VCF records of the chromosome with one
+# region lookup per file.
+
+# Largest position of a tabix index, the end of the region of a whole chromosome
+CHROMOSOME_END = (1 << 29) - 1
+
+def create_shard(path, signatures):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+    connection.execute("CREATE TABLE summaries (coordinate INTEGER, feature_id TEXT, summary BLOB, "
+                       "PRIMARY KEY (coordinate, feature_id)) WITHOUT ROWID")
+    connection.executemany("INSERT INTO meta VALUES (?, ?)", [
+        ("version", str(STORE_VERSION)),
+        ("source_signatures", json.dumps(signatures, sort_keys=True))
+    ])
+    return connection
+
+def iter_chromosome_records(configuration, file_key, chromosome, parse_fn, value_start_index):
+    return iter_region_records(configuration['tabix_executable'], configuration[file_key], chromosome, 1,
+                               CHROMOSOME_END, configuration.get('reader'), parse_fn, value_start_index)
+
+def iter_summarized_sites(triotype_records, vcf_records):
+    # Yields (coordinate, triotype record, VCF record) for the positions at which the single-line
+    # lookups of do_query each find exactly one record, starting at the position. Both lists of
+    # records are read once, in position order. As with tabix, the lookup of a position also finds
+    # the VCF records that start before it and whose reference allele covers it.
+    vcf_records = iter(vcf_records)
+    next_vcf_record = next(vcf_records, None)
+    overlapping = []
+    for coordinate, records in itertools.groupby(triotype_records, key=lambda record: record.start):
+        records = list(records)
+        while next_vcf_record is not None and next_vcf_record.start <= coordinate:
+            overlapping.append(next_vcf_record)
+            next_vcf_record = next(vcf_records, None)
+        overlapping = [record for record in overlapping if record.start + len(record.ref) > coordinate]
+
+        if len(records) == 1 and len(overlapping) == 1 and overlapping[0].start == coordinate:
+            yield coordinate, records[0], overlapping[0]
+
+def build_shard(configuration, chromosome, position_count, feature_ids, store_dir, signatures):
+    # Summarizes the features at the positions of one chromosome, as do_query would without a sample
+    # selection. Positions that do_query cannot summarize are left out, and are computed when
+    # queried.
+    started = time.time()
+    features = []
+    for feature_id in feature_ids:
+        try:
+            features.append((feature_id, feature_data_source.get_feature_by_id(configuration['feature_matrix'], feature_id)))
+        except feature_data_source.FeatureNotFoundError as fnf:
+            logging.warn(fnf)
+
+    path = shard_path(store_dir, chromosome)
+    # Written to a temporary file first, so that the service never reads a partial store.
+    temp_path = path + "." + str(os.getpid()) + ".tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    connection = create_shard(temp_path, signatures)
+
+    triotype_records = iter_chromosome_records(configuration, 'triotype_file', chromosome, parse_triotype_line,
+                                               TRIOTYPE_VALUE_START_INDEX)
+    vcf_records = iter_chromosome_records(configuration, 'vcf_file', chromosome, parse_vcf_line, VCF_VALUE_START_INDEX)
+
+    stored = 0
+    for coordinate, triotypes, vcf_data in iter_summarized_sites(triotype_records, vcf_records):
+        summaries = vsl.summarize_features(triotypes, vcf_data, features, chromosome)
+        connection.executemany("INSERT OR REPLACE INTO summaries VALUES (?, ?, ?)",
+                               [(coordinate, feature_id, buffer(zlib.compress(cPickle.dumps(summary, cPickle.HIGHEST_PROTOCOL))))
+                                for feature_id, summary in summaries.iteritems()])
+        stored += 1
+
+    connection.commit()
+    connection.close()
+    os.rename(temp_path, path)
+    return chromosome, position_count, stored, time.time() - started
+
+def build_shard_star(args):
+    return build_shard(*args)
+
+def build_store(configuration, feature_ids, store_dir, processes=None, chromosomes=None):
+    # One task per chromosome of the triotype file, run in a process pool
+    from multiprocessing import Pool
+
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+
+    signatures = source_signatures(configuration)
+    positions = presence_index.get_presence_index(configuration['triotype_file']).positions
+
+    tasks = []
+    for sequence, sequence_positions in positions.iteritems():
+        chromosome = sequence[3:] if sequence.startswith("chr") else sequence
+        if chromosomes is not None and chromosome not in chromosomes:
+            continue
+        tasks.append((configuration, chromosome, len(set(sequence_positions)), feature_ids, store_dir, signatures))
+    # Largest chromosomes first, so that they do not finish last
+    tasks.sort(key=lambda task: task[2], reverse=True)
+
+    pool = Pool(processes)
+    try:
+        for chromosome, position_count, stored, elapsed in pool.imap_unordered(build_shard_star, tasks):
+            logging.info("Variant Summary store - chr%s: %d of %d positions in %.1f s" % (chromosome, stored, position_count, elapsed))
+    finally:
+        pool.close()
+        pool.join()
+
+def main():
+    parser = argparse.ArgumentParser(description="Builds the precomputed Variant Summary store")
+    parser.add_argument('--config', required=True, help='JSON file with the Variant Summary source configuration')
+    parser.add_argument('--output', required=True, help='Store directory')
+    parser.add_argument('--features', nargs='*', default=[], help='Feature IDs')
+    parser.add_argument('--features-file', help='File with one feature ID per line')
+    parser.add_argument('--chromosomes', nargs='+', help='Chromosomes to build, default all')
+    parser.add_argument('--processes', type=int, help='Worker processes, default the number of CPUs')
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        configuration = json.load(config_file)
+
+    feature_ids = list(args.features)
+    if args.features_file is not None:
+        with open(args.features_file) as features_file:
+            feature_ids.extend(line.strip() for line in features_file if line.strip())
+
+    build_store(configuration, feature_ids, args.output, args.processes, args.chromosomes)
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    main()
@@ -4,7 +4,8 @@ import tornado.web
 import json
 import sys
 
-from tabix_lookup import vcf_lookup, triotype_lookup
+from tabix_utils import vcf_singleline_lookup, triotype_singleline_lookup
+from standalone_server import run_server
 
 server_settings = {
     "xheaders" : True,
@@ -29,9 +30,9 @@ class TabixLookup(tornado.web.RequestHandler):
         file_path = file_info['path']
         lookup_fn = None
         if file_info['type'] == 'vcf':
-            lookup_fn = vcf_lookup
+            lookup_fn = vcf_singleline_lookup
         elif file_info['type'] == 'trio':
-            lookup_fn = triotype_lookup
+            lookup_fn = triotype_singleline_lookup
         else:
             logging.error("Unknown type for file " + file_path)
             raise tornado.web.HTTPError(404)
@@ -40,7 +41,7 @@ class TabixLookup(tornado.web.RequestHandler):
             result = lookup_fn(options.tabix_executable, file_path, chromosome, coordinate, coordinate)
             response = {
                 "chr": result.chromosome,
-                "coordinate": result.coordinate,
+                "coordinate": result.start,
                 "values": result.values
             }
             
@@ -63,6 +64,7 @@ def main():
     define("verbose", default=False, help="Prints debugging statements")
     define("tabix_executable", default=".", help="Path to tabix executable")
     define("vcf_config", default=".", help="Path to VCF configuration JSON")
+    define("processes", default=1, help="Number of server processes, 0 for one per CPU", type=int)
 
     tornado.options.parse_command_line()
 
@@ -70,6 +72,7 @@ def main():
     logging.info("--tabix_executable=%s" % options.tabix_executable)
     logging.info("--vcf_config=%s" % options.vcf_config)
     logging.info("--verbose=%s" % options.verbose)
+    logging.info("--processes=%s" % options.processes)
 
     # Try loading the VCF mapping
     logging.info("Loading VCF configuration file \'" + options.vcf_config + "\'...")
@@ -81,11 +84,9 @@ def main():
         logging.error(e)
         sys.exit(1)
 
-    application = tornado.web.Application([
+    run_server([
         (r"/(\w+)/(X|Y|M|\d{1,2})/(\d+)", TabixLookup)
-    ], **settings)
-    application.listen(options.port, **server_settings)
-    tornado.ioloop.IOLoop.instance().start()
+    ], settings, server_settings, options.port, options.processes)
 
 
 if __name__ == "__main__":
@@ -0,0 +1 @@
+# Run from the repository root with: python -m unittest discover -s tests -t .
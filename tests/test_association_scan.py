@@ -0,0 +1,108 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tabix import association_scan
+from tabix import tabix_utils
+from tabix import variant_summary_lookup as vsl
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(__file__), "data")
+
+# Eight families on chr1 and chrX, see test_variant_summary_store.py
+DATA_FILES = ["vs_triotypes.tsv.gz", "vs_triotypes.tsv.gz.tbi", "vs_variants.vcf.gz", "vs_variants.vcf.gz.tbi",
+              "vs_features.json"]
+FEATURE_IDS = ["B:CLIN:A", "B:CLIN:B"]
+SOURCES = ["triotypes", "f", "m", "nb"]
+
+LOOKUP_ERRORS = (tabix_utils.CoordinateRangeEmptyError, tabix_utils.WrongLineFoundError,
+                 tabix_utils.UnexpectedTabixOutputError)
+
+class AssociationScanTest(unittest.TestCase):
+    # The counts and category sizes of a scan are those of do_query for the same position.
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name in DATA_FILES:
+            shutil.copyfile(os.path.join(DATA_DIRECTORY, name), os.path.join(self.directory, name))
+        self.feature_path = os.path.join(self.directory, "vs_features.json")
+        self.configuration = {
+            "tabix_executable": "tabix",
+            "reader": tabix_utils.TABIX_READER_NATIVE,
+            "triotype_file": os.path.join(self.directory, "vs_triotypes.tsv.gz"),
+            "vcf_file": os.path.join(self.directory, "vs_variants.vcf.gz"),
+            "feature_matrix": {"type": "json", "path": self.feature_path}
+        }
+        association_scan.FEATURE_BITSETS.clear()
+
+    def tearDown(self):
+        association_scan.FEATURE_BITSETS.clear()
+        shutil.rmtree(self.directory)
+
+    def query(self, chromosome, coordinate, feature_id, samples):
+        try:
+            return vsl.do_query(self.configuration, chromosome, coordinate, feature_id, samples)
+        except LOOKUP_ERRORS:
+            return None
+
+    def check_position(self, chromosome, coordinate, samples):
+        summaries = dict((feature_id, self.query(chromosome, coordinate, feature_id, samples)) for feature_id in FEATURE_IDS)
+        if summaries[FEATURE_IDS[0]] is None:
+            return False
+
+        for source in SOURCES:
+            result = vsl.do_association_scan(self.configuration, chromosome, coordinate, source, "chi2",
+                                             len(FEATURE_IDS), samples)
+            group_types = vsl.get_scan_groups(source, chromosome)[1]
+            self.assertEqual(sorted(feature["id"] for feature in result["features"]), FEATURE_IDS)
+            for feature in result["features"]:
+                summary = summaries[feature["id"]]
+                if source == "triotypes":
+                    summary = summary["triotypes"]
+                else:
+                    summary = summary["vcf"][source]
+                self.assertEqual(feature["category_sizes"], summary["category_sizes"])
+                for group_type, group in zip(group_types, summary["plot_data"]):
+                    for category in group["categories"]:
+                        self.assertEqual(feature["counts"][category["name"]][group_type], category["count"])
+        return True
+
+    def check_positions(self, samples):
+        checked = 0
+        for chromosome in ["1", "X"]:
+            for coordinate in xrange(100, 300):
+                if self.check_position(chromosome, coordinate, samples):
+                    checked += 1
+        self.assertTrue(checked > 20)
+
+    def test_counts(self):
+        self.check_positions(None)
+
+    def test_counts_of_samples(self):
+        # Category sizes only count the selected families.
+        self.check_positions(["ITMI-1", "ITMI-4-NB", "ITMI-5-F"])
+
+    def test_missing_family(self):
+        # As do_query, the scan raises a KeyError for a family without a feature value.
+        with open(self.feature_path) as json_file:
+            matrix = json.load(json_file)
+        del matrix["sample_id_array"][3]
+        for values in matrix["feature_value_array"]:
+            del values[3]
+        with open(self.feature_path, "w") as json_file:
+            json.dump(matrix, json_file)
+
+        for coordinate in xrange(100, 300):
+            if self.query("1", coordinate, FEATURE_IDS[0], ["ITMI-4"]) is not None:
+                break
+        self.assertRaises(KeyError, vsl.do_query, self.configuration, "1", coordinate, FEATURE_IDS[0])
+        self.assertRaises(KeyError, vsl.do_association_scan, self.configuration, "1", coordinate, "triotypes", "chi2", 2)
+
+    def test_cache_size(self):
+        # The cache is bounded by the bytes of the bitsets.
+        for coordinate in xrange(100, 300):
+            if self.query("1", coordinate, FEATURE_IDS[0], None) is not None:
+                break
+        vsl.do_association_scan(self.configuration, "1", coordinate, "triotypes", "chi2", 2)
+        stats = association_scan.FEATURE_BITSETS.stats()
+        self.assertTrue(0 < stats["bytes"] <= 2 * len(FEATURE_IDS) * 1)
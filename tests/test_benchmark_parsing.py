@@ -0,0 +1,43 @@
+import unittest
+
+from tabix import benchmark_parsing
+
+def result(stage, samples, ops_per_sec):
+    return {"stage": stage, "samples": samples, "ops": 10, "ops_per_sec": ops_per_sec,
+            "mean_us": 1e6 / ops_per_sec, "setup_rss_kb": 1000, "peak_rss_kb": 2000}
+
+class CompareToBaselineTest(unittest.TestCase):
+    def setUp(self):
+        self.baseline = {"results": [result("parse_vcf_line", 100, 1000.0), result("parse_vcf_line", 1000, 100.0),
+                                     result("process_vcf", 100, 500.0)]}
+
+    def test_regressions(self):
+        # Slower by more than the threshold is a regression, slower by less or faster is not.
+        results = [result("parse_vcf_line", 100, 850.0), result("parse_vcf_line", 1000, 95.0),
+                   result("process_vcf", 100, 600.0)]
+        regressions = benchmark_parsing.compare_to_baseline(results, self.baseline, 0.1)
+        self.assertEqual(regressions, [results[0]])
+        self.assertAlmostEqual(results[0]["change"], -0.15)
+        self.assertEqual([r["regression"] for r in results], [True, False, False])
+        self.assertEqual(results[2]["baseline_ops_per_sec"], 500.0)
+
+        self.assertTrue("REGRESSION" in benchmark_parsing.format_result(results[0]))
+        self.assertFalse("REGRESSION" in benchmark_parsing.format_result(results[1]))
+
+    def test_threshold(self):
+        results = [result("parse_vcf_line", 100, 850.0)]
+        self.assertEqual(benchmark_parsing.compare_to_baseline(results, self.baseline, 0.2), [])
+
+    def test_not_in_baseline(self):
+        # Stages and sample counts without a baseline result are not compared.
+        results = [result("parse_vcf_line", 10000, 1.0), result("process_triotypes", 100, 1.0)]
+        self.assertEqual(benchmark_parsing.compare_to_baseline(results, self.baseline, 0.1), [])
+        self.assertFalse("change" in results[0])
+        self.assertFalse("REGRESSION" in benchmark_parsing.format_result(results[0]))
+
+class MeasureTest(unittest.TestCase):
+    def test_stages(self):
+        for stage in benchmark_parsing.STAGES:
+            measured = benchmark_parsing.measure(stage, 30, 5, 0.01)
+            self.assertEqual((measured["stage"], measured["samples"]), (stage, 30))
+            self.assertTrue(measured["ops"] > 0)
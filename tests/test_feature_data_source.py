@@ -0,0 +1,59 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tabix import feature_data_source
+
+class FeatureMatrixTest(unittest.TestCase):
+    # A JSON feature matrix is parsed again when its modification time or size changes.
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "features.json")
+        self.config = {"type": "json", "path": self.path}
+        self.write_matrix(["true", "false", "true"], 1000000000)
+        feature_data_source.FEATURE_MATRICES.clear()
+
+    def tearDown(self):
+        feature_data_source.FEATURE_MATRICES.clear()
+        shutil.rmtree(self.directory)
+
+    def write_matrix(self, values, mtime):
+        with open(self.path, "w") as json_file:
+            json.dump({"sample_id_array": ["101-1", "101-2", "101-3"],
+                       "ordered_list": [["B:CLIN:A", "A"]],
+                       "feature_value_array": [values]}, json_file)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_shared_features(self):
+        matrix = feature_data_source.get_feature_matrix(self.path)
+        self.assertTrue(feature_data_source.get_feature_matrix(self.path) is matrix)
+
+        feature = feature_data_source.get_feature_by_id(self.config, "B:CLIN:A")
+        self.assertEqual(feature.values, {"101-1": "true", "101-2": "false", "101-3": "true"})
+        self.assertEqual(feature.aggregate, {"true": 2, "false": 1})
+        self.assertTrue(feature_data_source.get_feature_by_id(self.config, "B:CLIN:A") is feature)
+        self.assertRaises(feature_data_source.FeatureNotFoundError, feature_data_source.get_feature_by_id,
+                          self.config, "B:CLIN:B")
+
+    def test_changed_mtime(self):
+        matrix = feature_data_source.get_feature_matrix(self.path)
+        # Same size, other modification time
+        self.write_matrix(["false", "false", "true"], 1000000010)
+        self.assertFalse(feature_data_source.get_feature_matrix(self.path) is matrix)
+        self.assertEqual(feature_data_source.get_feature_by_id(self.config, "B:CLIN:A").aggregate,
+                         {"true": 1, "false": 2})
+
+    def test_changed_size(self):
+        matrix = feature_data_source.get_feature_matrix(self.path)
+        # Same modification time, other size
+        self.write_matrix(["false", "NA", "true"], 1000000000)
+        self.assertFalse(feature_data_source.get_feature_matrix(self.path) is matrix)
+        self.assertEqual(feature_data_source.get_feature_by_id(self.config, "B:CLIN:A").values["101-2"], "NA")
+
+    def test_version(self):
+        version = feature_data_source.feature_matrix_version(self.config)
+        self.assertEqual(feature_data_source.feature_matrix_version(self.config), version)
+        self.write_matrix(["true", "false", "true"], 1000000010)
+        self.assertNotEqual(feature_data_source.feature_matrix_version(self.config), version)
@@ -0,0 +1,81 @@
+import threading
+import time
+
+import tornado.ioloop
+import tornado.testing
+
+from tabix import lookup_executor
+
+class SlotLimitTest(tornado.testing.AsyncTestCase):
+    # At most 'max_workers' lookups run at any time, the others wait for a slot.
+    POOL_SIZE = 2
+
+    def get_new_ioloop(self):
+        # Lookups hand their outcome to the IOLoop instance, see lookup_executor.py
+        return tornado.ioloop.IOLoop.instance()
+
+    def setUp(self):
+        super(SlotLimitTest, self).setUp()
+        lookup_executor.configure(self.POOL_SIZE)
+        self.lock = threading.Lock()
+        self.release = threading.Event()
+        self.running = 0
+        self.max_running = 0
+
+    def tearDown(self):
+        self.release.set()
+        lookup_executor.configure(0)
+        super(SlotLimitTest, self).tearDown()
+
+    def lookup(self, number):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        self.release.wait(10)
+        with self.lock:
+            self.running -= 1
+        return number
+
+    def wait_until(self, condition, timeout=10):
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                return False
+            self.io_loop.add_timeout(time.time() + 0.02, self.stop)
+            self.wait()
+        return True
+
+    def test_waiting_lookups(self):
+        results = []
+        for number in xrange(5):
+            lookup_executor.run(self.lookup, number, callback=lambda outcome: results.append(outcome.get()))
+
+        self.assertTrue(self.wait_until(lambda: self.running == self.POOL_SIZE))
+        self.assertEqual(lookup_executor.slot_stats(), {"size": 2, "used": 2, "waiting": 3})
+        self.assertFalse(lookup_executor.try_acquire_slot())
+
+        self.release.set()
+        self.assertTrue(self.wait_until(lambda: len(results) == 5))
+        self.assertEqual(sorted(results), range(5))
+        self.assertEqual(self.max_running, self.POOL_SIZE)
+        self.assertEqual(lookup_executor.slot_stats(), {"size": 2, "used": 0, "waiting": 0})
+
+    def test_failed_lookup_releases_slot(self):
+        def failing_lookup():
+            raise ValueError("lookup failed")
+
+        outcomes = []
+        for number in xrange(3):
+            lookup_executor.run(failing_lookup, callback=outcomes.append)
+        self.assertTrue(self.wait_until(lambda: len(outcomes) == 3))
+        self.assertRaises(ValueError, outcomes[0].get)
+        self.assertEqual(lookup_executor.slot_stats()["used"], 0)
+
+    def test_without_pool(self):
+        # Lookups run synchronously on the IOLoop and are not limited.
+        lookup_executor.configure(0)
+        self.assertEqual(lookup_executor.slot_stats(), None)
+        self.assertTrue(lookup_executor.try_acquire_slot())
+        outcomes = []
+        lookup_executor.run(lambda: "result", callback=outcomes.append)
+        self.assertEqual(outcomes[0].get(), "result")
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tabix import presence_index
+from tabix import tabix_utils
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(__file__), "data")
+
+def copy_data_file(name, path):
+    shutil.copyfile(os.path.join(DATA_DIRECTORY, name), path)
+    shutil.copyfile(os.path.join(DATA_DIRECTORY, name + ".tbi"), path + ".tbi")
+
+class PresenceIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_path = os.path.join(self.directory, "data.gz")
+        self.index_path = self.data_path + presence_index.PRESENCE_INDEX_SUFFIX
+        copy_data_file("regions.tsv.gz", self.data_path)
+        presence_index.INDEXES.clear()
+        self.saved_build = presence_index.build_presence_index
+
+    def tearDown(self):
+        presence_index.build_presence_index = self.saved_build
+        presence_index.INDEXES.clear()
+        shutil.rmtree(self.directory)
+
+    def test_index_file(self):
+        index = presence_index.get_presence_index(self.data_path)
+        self.assertTrue(os.path.exists(self.index_path))
+        self.assertEqual(list(index.positions["chr1"]), range(10, 25001, 10))
+        self.assertTrue(presence_index.has_record(self.data_path, "2", 25000, 25000))
+        self.assertFalse(presence_index.has_record(self.data_path, "2", 25001, 30000))
+        self.assertFalse(presence_index.has_record(self.data_path, "1", 11, 19))
+        self.assertFalse(presence_index.has_record(self.data_path, "3", 1, 30000))
+
+        # A new process reads the saved index instead of the data file.
+        presence_index.INDEXES.clear()
+        def build_presence_index(file_path):
+            raise AssertionError("index built again")
+        presence_index.build_presence_index = build_presence_index
+        loaded = presence_index.get_presence_index(self.data_path)
+        self.assertEqual(loaded.positions, index.positions)
+
+    def test_rebuild_on_signature_change(self):
+        index = presence_index.get_presence_index(self.data_path)
+
+        copy_data_file("small.vcf.gz", self.data_path)
+        os.utime(self.data_path, (index.signature[0] + 10, index.signature[0] + 10))
+
+        rebuilt = presence_index.get_presence_index(self.data_path)
+        self.assertFalse(rebuilt is index)
+        self.assertEqual(list(rebuilt.positions["chr1"]), [100, 200, 202, 300])
+        self.assertTrue(presence_index.has_record(self.data_path, "1", 201, 202))
+        self.assertFalse(presence_index.has_record(self.data_path, "1", 1000, 1010))
+
+        # The saved index was replaced as well.
+        presence_index.INDEXES.clear()
+        self.assertEqual(presence_index.load_presence_index(self.index_path, rebuilt.signature).positions,
+                         rebuilt.positions)
+
+    def test_lookup_after_rewrite(self):
+        # A lookup with the presence index finds the records of the rewritten file.
+        copy_data_file("small.vcf.gz", self.data_path)
+        lookup_args = ("tabix", self.data_path, "1", 110, 110, tabix_utils.TABIX_READER_NATIVE)
+        self.assertRaises(tabix_utils.CoordinateRangeEmptyError, tabix_utils.triotype_singleline_lookup,
+                          *lookup_args, presence_index=True)
+        index = presence_index.get_presence_index(self.data_path)
+
+        copy_data_file("regions.tsv.gz", self.data_path)
+        os.utime(self.data_path, (index.signature[0] + 10, index.signature[0] + 10))
+        result = tabix_utils.triotype_singleline_lookup(*lookup_args, presence_index=True)
+        self.assertEqual((result.chromosome, result.start), ("chr1", 110))
+        self.assertFalse(presence_index.get_presence_index(self.data_path) is index)
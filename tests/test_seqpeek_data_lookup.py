@@ -0,0 +1,59 @@
+import json
+
+import tornado.ioloop
+import tornado.testing
+import tornado.web
+from tornado.options import define, options
+
+from tabix import lookup_executor
+from tabix import seqpeek_data_lookup
+from tabix.seqpeek_data_lookup import SeqPeekDataHandler
+
+if "verbose" not in options:
+    define("verbose", default=False, type=bool)
+
+class FeaturesParameterTest(tornado.testing.AsyncHTTPTestCase):
+    def get_new_ioloop(self):
+        # Lookups hand their outcome to the IOLoop instance, see lookup_executor.py
+        return tornado.ioloop.IOLoop.instance()
+
+    def setUp(self):
+        SeqPeekDataHandler.seqpeek_data_map = {"sp": {}}
+        lookup_executor.configure(0)
+        # Stands in for the gene query, which needs the region and feature databases.
+        self.queries = []
+        self.saved_query = seqpeek_data_lookup.sds.do_gene_query
+        seqpeek_data_lookup.sds.do_gene_query = self.do_gene_query
+        super(FeaturesParameterTest, self).setUp()
+
+    def tearDown(self):
+        super(FeaturesParameterTest, self).tearDown()
+        seqpeek_data_lookup.sds.do_gene_query = self.saved_query
+
+    def get_app(self):
+        return tornado.web.Application([
+            (r"/seqpeek_data/(.*)", SeqPeekDataHandler)
+        ])
+
+    def do_gene_query(self, seqObj):
+        self.queries.append((seqObj.gene_name, seqObj.feature_ids))
+        return {"gene": seqObj.gene_name}
+
+    def fetch(self, path):
+        self.http_client.fetch(self.get_url(path), self.stop)
+        return self.wait()
+
+    def test_features(self):
+        response = self.fetch("/seqpeek_data/sp?gene=TP53&features=B:CLIN:A,B:CLIN:B&features=B:CLIN:C")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body), {"gene": "TP53"})
+        self.assertEqual(self.queries, [("TP53", ["B:CLIN:A", "B:CLIN:B", "B:CLIN:C"])])
+
+    def test_all_features(self):
+        self.assertEqual(self.fetch("/seqpeek_data/sp?gene=TP53").code, 200)
+        self.assertEqual(self.queries, [("TP53", None)])
+
+    def test_empty_feature_list(self):
+        for arguments in ["features=", "features=,", "features=%20,&features="]:
+            self.assertEqual(self.fetch("/seqpeek_data/sp?gene=TP53&" + arguments).code, 400)
+        self.assertEqual(self.queries, [])
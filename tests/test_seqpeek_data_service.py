@@ -0,0 +1,124 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from tabix import seqpeek_data_service as sds
+
+class FeatureCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "features.json")
+        self.config = {'feature_matrix': {'type': 'json', 'path': self.path}}
+        self.key = sds.feature_matrix_key(self.config['feature_matrix'])
+        self.write_matrix(["true", "false", "true"])
+        sds.FEATURE_CACHE.clear()
+
+    def tearDown(self):
+        sds.FEATURE_CACHE.clear()
+        shutil.rmtree(self.directory)
+
+    def write_matrix(self, values):
+        with open(self.path, "w") as json_file:
+            json.dump({"sample_id_array": ["101-1", "101-2", "101-3"],
+                       "ordered_list": [["B:CLIN:A", "A"]],
+                       "feature_value_array": [values]}, json_file)
+
+    def load(self):
+        seqObj = sds.SeqPeekResult(self.config)
+        sds.load_features(seqObj)
+        return seqObj
+
+    def test_shared_by_requests(self):
+        first = self.load()
+        self.assertEqual(first.features, {"B:CLIN:A": {"101-1": "true", "101-2": "false", "101-3": "true"}})
+        self.assertEqual(first.feature_aggregates, {"B:CLIN:A": {"true": 2, "false": 1}})
+
+        second = self.load()
+        self.assertTrue(second.features is first.features)
+        self.assertTrue(second.feature_aggregates is first.feature_aggregates)
+
+    def test_reload_on_file_change(self):
+        first = self.load()
+        mtime = os.stat(self.path).st_mtime
+        self.write_matrix(["false", "false", "true"])
+        os.utime(self.path, (mtime + 10, mtime + 10))
+
+        second = self.load()
+        self.assertFalse(second.features is first.features)
+        self.assertEqual(second.feature_aggregates, {"B:CLIN:A": {"true": 1, "false": 2}})
+
+    def test_reload_after_refresh_interval(self):
+        first = self.load()
+        sds.FEATURE_CACHE[self.key].loaded -= sds.DEFAULT_FEATURE_REFRESH_INTERVAL + 1
+        self.assertFalse(self.load().features is first.features)
+
+    def test_select_features(self):
+        seqObj = self.load()
+        seqObj.feature_ids = ["B:CLIN:A", "B:CLIN:MISSING"]
+        sds.select_features(seqObj)
+        self.assertEqual(seqObj.features.keys(), ["B:CLIN:A"])
+        self.assertEqual(seqObj.feature_aggregates.keys(), ["B:CLIN:A"])
+
+class CountFeatureValuesTest(unittest.TestCase):
+    # count_feature_values_vectorized returns the same statistics as count_feature_values.
+    def setUp(self):
+        self.random = random.Random(25)
+        self.families = ["%d-%d" % (101, number) for number in xrange(30)] + [""]
+        # Families without a value count as 'na'.
+        self.features = dict(("B:CLIN:%d" % number,
+                              dict((family_id, self.random.choice(["true", "false", "NA"])) for family_id in self.families
+                                   if self.random.random() < 0.8))
+                             for number in xrange(5))
+
+    def count(self, row_count, key_count):
+        row_keys = [self.random.randrange(key_count) for row in xrange(row_count)]
+        row_families = [self.random.randrange(len(self.families)) for row in xrange(row_count)]
+        args = (self.features, row_keys, row_families, self.families, key_count)
+        return sds.count_feature_values(*args), sds.count_feature_values_vectorized(*args)
+
+    def test_counts(self):
+        for row_count, key_count in [(1, 1), (50, 50), (500, 20), (2000, 3)]:
+            loop, vectorized = self.count(row_count, key_count)
+            self.assertEqual(len(loop), key_count)
+            self.assertEqual(vectorized, loop)
+
+    def test_large_counts(self):
+        # Counts too large for a flat index into a table of all possible counts
+        self.features = {"B:CLIN:A": dict((family_id, str(number)) for number, family_id in enumerate(self.families))}
+        loop, vectorized = self.count(100000, 2)
+        self.assertEqual(vectorized, loop)
+
+    def test_no_features(self):
+        self.features = {}
+        loop, vectorized = self.count(10, 4)
+        self.assertEqual(loop, [{}, {}, {}, {}])
+        self.assertEqual(vectorized, loop)
+        self.assertEqual(sds.count_feature_values_vectorized(self.features, [], [], [], 0), [])
+
+class FeatureArgumentTest(unittest.TestCase):
+    # --features of the command-line tool selects the features to count.
+    def parse(self, arguments):
+        seqObj = sds.SeqPeekResult({})
+        sds.set_parameters(seqObj, sds.create_argument_parser().parse_args(arguments))
+        return seqObj
+
+    def test_features(self):
+        seqObj = self.parse(["--gene_name", "TP53", "--features", "B:CLIN:A", "B:CLIN:C"])
+        self.assertEqual(seqObj.feature_ids, ["B:CLIN:A", "B:CLIN:C"])
+
+        seqObj.features = {"B:CLIN:A": {"101-1": "true"}, "B:CLIN:B": {"101-1": "false"}}
+        seqObj.feature_aggregates = {"B:CLIN:A": {"true": 1}, "B:CLIN:B": {"false": 1}}
+        sds.select_features(seqObj)
+        self.assertEqual(seqObj.features, {"B:CLIN:A": {"101-1": "true"}})
+        self.assertEqual(seqObj.feature_aggregates, {"B:CLIN:A": {"true": 1}})
+
+    def test_all_features(self):
+        seqObj = self.parse(["--gene_name", "TP53"])
+        self.assertFalse(hasattr(seqObj, "feature_ids"))
+        seqObj.features = {"B:CLIN:A": {"101-1": "true"}}
+        seqObj.feature_aggregates = {"B:CLIN:A": {"true": 1}}
+        sds.select_features(seqObj)
+        self.assertEqual(seqObj.features.keys(), ["B:CLIN:A"])
@@ -0,0 +1,69 @@
+import threading
+
+import tornado.ioloop
+import tornado.testing
+
+from tabix import lookup_executor
+from tabix.single_flight import SingleFlight
+
+class SingleFlightTest(tornado.testing.AsyncTestCase):
+    def get_new_ioloop(self):
+        # Lookups hand their outcome to the IOLoop instance, see lookup_executor.py
+        return tornado.ioloop.IOLoop.instance()
+
+    def setUp(self):
+        super(SingleFlightTest, self).setUp()
+        lookup_executor.configure(2)
+        self.single_flight = SingleFlight("test")
+        self.proceed = threading.Event()
+        self.calls = []
+        self.outcomes = []
+
+    def tearDown(self):
+        self.proceed.set()
+        lookup_executor.configure(0)
+        super(SingleFlightTest, self).tearDown()
+
+    def lookup(self, key):
+        self.calls.append(key)
+        self.proceed.wait(5)
+        if key == "missing":
+            raise KeyError(key)
+        return [key]
+
+    def start(self, key, expected):
+        def on_outcome(outcome):
+            self.outcomes.append((key, outcome))
+            if len(self.outcomes) == expected:
+                self.stop()
+        self.single_flight.run(key, self.lookup, key, callback=on_outcome)
+
+    def test_coalescing(self):
+        for key in ["a", "a", "b", "a"]:
+            self.start(key, 4)
+        self.assertEqual(self.single_flight.stats(), {"requests": 4, "deduplicated": 2, "in_flight": 2})
+
+        self.proceed.set()
+        self.wait()
+        self.assertEqual(sorted(self.calls), ["a", "b"])
+        self.assertEqual(sorted(key for key, outcome in self.outcomes), ["a", "a", "a", "b"])
+        # The requests for one key share the result.
+        results = [outcome.get() for key, outcome in self.outcomes if key == "a"]
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(self.single_flight.stats()["in_flight"], 0)
+
+        # Later requests run the lookup again.
+        self.start("a", 5)
+        self.wait()
+        self.assertEqual(sorted(self.calls), ["a", "a", "b"])
+
+    def test_error_propagation(self):
+        self.start("missing", 2)
+        self.start("missing", 2)
+        self.proceed.set()
+        self.wait()
+
+        self.assertEqual(self.calls, ["missing"])
+        for key, outcome in self.outcomes:
+            self.assertRaises(KeyError, outcome.get)
+        self.assertEqual(self.single_flight.stats()["in_flight"], 0)
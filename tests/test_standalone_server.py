@@ -0,0 +1,77 @@
+import unittest
+
+import tornado.httpserver
+import tornado.ioloop
+import tornado.netutil
+import tornado.process
+import tornado.web
+
+from tabix import standalone_server
+
+class RecordingServer(object):
+    # Stands in for HTTPServer, without listening.
+    servers = []
+
+    def __init__(self, application, **kwargs):
+        self.application = application
+        self.kwargs = kwargs
+        self.servers.append(self)
+
+    def listen(self, port, address=""):
+        self.port = port
+
+    def add_sockets(self, sockets):
+        self.sockets = sockets
+
+class RecordingApplication(object):
+    # Stands in for Application, which would start autoreload in debug mode.
+    def __init__(self, handlers, **settings):
+        self.settings = settings
+
+    def listen(self, port, **kwargs):
+        tornado.httpserver.HTTPServer(self, **kwargs).listen(port)
+
+class StoppedIOLoop(object):
+    def start(self):
+        pass
+
+class RunServerTest(unittest.TestCase):
+    def setUp(self):
+        # The IOLoop.instance staticmethod itself, as a plain function would become an unbound method.
+        self.saved = (tornado.web.Application, tornado.httpserver.HTTPServer, tornado.ioloop.IOLoop.__dict__["instance"],
+                      tornado.netutil.bind_sockets, tornado.process.fork_processes, tornado.process.task_id)
+        self.forked = []
+        RecordingServer.servers = []
+        tornado.web.Application = RecordingApplication
+        tornado.httpserver.HTTPServer = RecordingServer
+        tornado.ioloop.IOLoop.instance = staticmethod(lambda: StoppedIOLoop())
+        tornado.netutil.bind_sockets = lambda port, address="": ["socket:%d" % port]
+        tornado.process.fork_processes = self.forked.append
+        tornado.process.task_id = lambda: 0
+
+    def tearDown(self):
+        (tornado.web.Application, tornado.httpserver.HTTPServer, tornado.ioloop.IOLoop.instance,
+         tornado.netutil.bind_sockets, tornado.process.fork_processes, tornado.process.task_id) = self.saved
+
+    def run_server(self, processes):
+        settings = {"debug": True}
+        standalone_server.run_server([], settings, {"address": "127.0.0.1"}, 8321, processes)
+        # The settings of the caller are not changed.
+        self.assertEqual(settings, {"debug": True})
+        self.assertEqual(len(RecordingServer.servers), 1)
+        return RecordingServer.servers[0]
+
+    def test_single_process(self):
+        server = self.run_server(1)
+        self.assertTrue(server.application.settings["debug"])
+        self.assertEqual(server.port, 8321)
+        self.assertEqual(self.forked, [])
+
+    def test_forked_processes(self):
+        for processes in [0, 4]:
+            RecordingServer.servers = []
+            server = self.run_server(processes)
+            self.assertFalse(server.application.settings["debug"])
+            self.assertEqual(server.sockets, ["socket:8321"])
+            self.assertFalse("address" in server.kwargs)
+        self.assertEqual(self.forked, [0, 4])
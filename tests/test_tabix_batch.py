@@ -0,0 +1,116 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import tornado.ioloop
+import tornado.testing
+import tornado.web
+from tornado.options import define, options
+
+from tabix import lookup_executor
+from tabix.tabix_lookup import TabixLookupHandler
+
+if "tabix_executable" not in options:
+    define("tabix_executable", default="tabix")
+if "tabix_batch_max_size" not in options:
+    define("tabix_batch_max_size", default=1000, type=int)
+if "tabix_batch_merge_distance" not in options:
+    define("tabix_batch_merge_distance", default=10000, type=int)
+
+# Stands in for the tabix executable: prints the records of RECORDS in the requested region. There
+# are two records at position 1000.
+FAKE_TABIX = """
+import sys
+
+RECORDS = [
+    ("chr1", 1000, "rs1"),
+    ("chr1", 1000, "rs2"),
+    ("chr1", 1500, "rs3"),
+    ("chr1", 3000, "rs4")
+]
+
+sequence, region = sys.argv[-1].split(":")
+start, end = [int(coordinate) for coordinate in region.split("-")]
+for chromosome, position, snpid in RECORDS:
+    if chromosome == sequence and start <= position <= end:
+        sys.stdout.write("\\t".join([chromosome, str(position), snpid, "A", "G", ".", "PASS", ".", "GT", "0/1"]) + "\\n")
+"""
+
+class BatchLookupTest(tornado.testing.AsyncHTTPTestCase):
+    def get_new_ioloop(self):
+        # Lookups hand their outcome to the IOLoop instance, see lookup_executor.py
+        return tornado.ioloop.IOLoop.instance()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        fake_tabix = os.path.join(self.directory, "fake_tabix.py")
+        with open(fake_tabix, "w") as script:
+            script.write(FAKE_TABIX)
+
+        self.saved_executable = options.tabix_executable
+        options.tabix_executable = sys.executable + " " + fake_tabix
+        TabixLookupHandler.tabix_file_map = {"v": {"type": "vcf", "path": os.path.join(self.directory, "data.vcf.gz")}}
+        lookup_executor.configure(0)
+        super(BatchLookupTest, self).setUp()
+
+    def tearDown(self):
+        super(BatchLookupTest, self).tearDown()
+        options.tabix_executable = self.saved_executable
+        shutil.rmtree(self.directory)
+
+    def get_app(self):
+        return tornado.web.Application([
+            (r"/tabix/(\w+)/(X|Y|M|\d{1,2})/(\d+)", TabixLookupHandler),
+            (r"/tabix/(\w+)/(X|Y|M|\d{1,2})/(\d+)/(\d+)", TabixLookupHandler),
+            (r"/tabix/(\w+)/batch", TabixLookupHandler)
+        ])
+
+    def post_batch(self, coordinates):
+        self.http_client.fetch(self.get_url("/tabix/v/batch"), self.stop, method="POST",
+                               body=json.dumps({"coordinates": coordinates}))
+        return self.wait()
+
+    def get_lookup(self, path):
+        self.http_client.fetch(self.get_url(path), self.stop)
+        response = self.wait()
+        self.assertEqual(response.code, 200)
+        return json.loads(response.body)
+
+    def test_mixed_batch(self):
+        response = self.post_batch([["1", 1000, 1000], ["1", 1500, 1500], ["1", 1600], ["1", 3000]])
+        self.assertEqual(response.code, 200)
+        items = json.loads(response.body)["items"]
+        self.assertEqual(len(items), 4)
+
+        # Two records at the coordinate: an error for this item only
+        self.assertTrue("expected 1 line, found 2" in items[0]["error"])
+        self.assertEqual((items[0]["chr"], items[0]["start"], items[0]["values"]), ("1", "1000", []))
+
+        self.assertEqual((items[1]["start"], items[1]["snpid"]), (1500, "rs3"))
+        self.assertFalse("error" in items[1])
+
+        self.assertEqual((items[2]["start"], items[2]["snpid"], items[2]["values"]), ("1600", "", []))
+        self.assertEqual((items[3]["start"], items[3]["snpid"]), (3000, "rs4"))
+
+    def test_same_as_get(self):
+        # Items are the responses to a GET of the same coordinate.
+        items = json.loads(self.post_batch([["1", 1500], ["1", 1600]]).body)["items"]
+        self.assertEqual(items, [self.get_lookup("/tabix/v/1/1500"), self.get_lookup("/tabix/v/1/1600")])
+
+    def test_region_in_batch(self):
+        # Ranges are region lookups for a GET, which batches do not run.
+        self.assertEqual(self.post_batch([["1", 1500], ["1", 1000, 2000]]).code, 400)
+
+    def test_get_on_batch_route(self):
+        self.http_client.fetch(self.get_url("/tabix/v/batch"), self.stop)
+        response = self.wait()
+        self.assertEqual(response.code, 405)
+        self.assertEqual(response.headers.get("Allow"), "POST")
+
+    def test_post_on_lookup_route(self):
+        self.http_client.fetch(self.get_url("/tabix/v/1/1500"), self.stop, method="POST", body="{}")
+        response = self.wait()
+        self.assertEqual(response.code, 405)
+        self.assertEqual(response.headers.get("Allow"), "GET")
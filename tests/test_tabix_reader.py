@@ -0,0 +1,137 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from tabix import tabix_reader
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(__file__), "data")
+
+# Two chromosomes of 2500 records each, one every 10 bases, over four BGZF blocks. Records are
+# split across the block boundaries.
+REGIONS_PATH = os.path.join(DATA_DIRECTORY, "regions.tsv.gz")
+# VCF records at chr1:100, chr1:200 (REF ATGC), chr1:202, chr1:300 and chr2:100
+VCF_PATH = os.path.join(DATA_DIRECTORY, "small.vcf.gz")
+
+def read_lines(path):
+    with gzip.open(path) as data_file:
+        return data_file.read().splitlines()
+
+def expected_records(lines, chromosome, start, end):
+    # Records of a file with one position per record, as tabix returns them for the region
+    records = []
+    for line in lines:
+        if line.startswith("#"):
+            continue
+        fields = line.split("\t")
+        if fields[0] == chromosome and start <= int(fields[1]) <= end:
+            records.append(line)
+    return records
+
+class TabixReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.lines = read_lines(REGIONS_PATH)
+        self.reader = tabix_reader.TabixReader(REGIONS_PATH)
+
+    def test_fetch(self):
+        for chromosome, start, end in [("chr1", 10, 10), ("chr1", 1, 25000), ("chr2", 995, 1015),
+                                       ("chr1", 12345, 23456), ("chr2", 24990, 30000)]:
+            self.assertEqual(list(self.reader.fetch(chromosome, start, end)),
+                             expected_records(self.lines, chromosome, start, end))
+
+    def test_fetch_without_records(self):
+        self.assertEqual(list(self.reader.fetch("chr1", 11, 19)), [])
+        self.assertEqual(list(self.reader.fetch("chr1", 25001, 30000)), [])
+        self.assertEqual(list(self.reader.fetch("chr3", 1, 30000)), [])
+
+    def test_fetch_records_at_block_edges(self):
+        # The records that start in one block and end in the next are found whole.
+        with open(REGIONS_PATH, "rb") as file_handle:
+            block_ends = []
+            offset = 0
+            coffset = 0
+            while True:
+                data, coffset = tabix_reader.read_bgzf_block(file_handle, coffset)
+                if data is None:
+                    break
+                offset += len(data)
+                block_ends.append(offset)
+
+        line_start = 0
+        edge_lines = []
+        for line in self.lines:
+            line_end = line_start + len(line) + 1
+            if any(line_start < block_end < line_end for block_end in block_ends):
+                edge_lines.append(line)
+            line_start = line_end
+        self.assertTrue(len(edge_lines) > 0)
+
+        for line in edge_lines:
+            chromosome, position = line.split("\t")[:2]
+            self.assertEqual(list(self.reader.fetch(chromosome, position, position)), [line])
+
+    def test_header(self):
+        self.assertEqual(self.reader.header(), ["#chr\tstart\tvalue"])
+        self.assertEqual(tabix_reader.TabixReader(VCF_PATH).header(), read_lines(VCF_PATH)[:2])
+
+    def test_query(self):
+        records = expected_records(self.lines, "chr2", 100, 130)
+        self.assertEqual(self.reader.query("chr2", 100, 130), "\n".join(records) + "\n")
+        self.assertEqual(self.reader.query("chr2", 100, 130, include_header=True),
+                         "\n".join(["#chr\tstart\tvalue"] + records) + "\n")
+        self.assertEqual(self.reader.query("chr2", 101, 109), "")
+
+    def test_vcf_records_overlapping_region(self):
+        # The record at 200 covers 200 to 203 with its reference allele.
+        reader = tabix_reader.TabixReader(VCF_PATH)
+        positions = [int(line.split("\t")[1]) for line in reader.fetch("chr1", 202, 202)]
+        self.assertEqual(positions, [200, 202])
+        positions = [int(line.split("\t")[1]) for line in reader.fetch("chr1", 204, 300)]
+        self.assertEqual(positions, [300])
+
+    def test_get_reader(self):
+        reader = tabix_reader.get_reader(REGIONS_PATH)
+        self.assertTrue(tabix_reader.get_reader(REGIONS_PATH) is reader)
+
+class BlockCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_path = os.path.join(self.directory, "data.gz")
+        self.copy_data_file(REGIONS_PATH)
+        tabix_reader.configure_block_cache(1024 * 1024)
+
+    def tearDown(self):
+        tabix_reader.configure_block_cache(0)
+        tabix_reader.READERS.pop(self.data_path, None)
+        shutil.rmtree(self.directory)
+
+    def copy_data_file(self, source_path):
+        shutil.copyfile(source_path, self.data_path)
+        shutil.copyfile(source_path + ".tbi", self.data_path + ".tbi")
+
+    def test_blocks_shared_by_readers(self):
+        records = list(tabix_reader.TabixReader(self.data_path).fetch("chr1", 1, 25000))
+        misses = tabix_reader.block_cache_stats()["misses"]
+        self.assertTrue(misses > 0)
+
+        self.assertEqual(list(tabix_reader.TabixReader(self.data_path).fetch("chr1", 1, 25000)), records)
+        stats = tabix_reader.block_cache_stats()
+        self.assertEqual(stats["misses"], misses)
+        self.assertTrue(stats["hits"] >= misses)
+
+    def test_changed_file(self):
+        # Blocks of the previous version of a file are not used for the new one.
+        reader = tabix_reader.get_reader(self.data_path)
+        self.assertEqual(len(list(reader.fetch("chr1", 100, 300))), 21)
+
+        self.copy_data_file(VCF_PATH)
+        os.utime(self.data_path, (reader.signature[0] + 10, reader.signature[0] + 10))
+
+        reader = tabix_reader.get_reader(self.data_path)
+        self.assertEqual(list(reader.fetch("chr1", 100, 300)), read_lines(VCF_PATH)[2:6])
+
+    def test_disabled(self):
+        tabix_reader.configure_block_cache(0)
+        self.assertEqual(tabix_reader.block_cache_stats(), None)
+        self.assertEqual(len(list(tabix_reader.TabixReader(self.data_path).fetch("chr2", 1, 100))), 10)
@@ -0,0 +1,75 @@
+import json
+import os
+import shutil
+import tempfile
+
+import tornado.ioloop
+import tornado.testing
+import tornado.web
+from tornado.options import define, options
+
+from tabix import lookup_executor
+from tabix import tabix_lookup
+from tabix.tabix_lookup import TabixLookupHandler
+
+if "tabix_executable" not in options:
+    define("tabix_executable", default="tabix")
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(__file__), "data")
+
+class ResultCacheTest(tornado.testing.AsyncHTTPTestCase):
+    def get_new_ioloop(self):
+        # Lookups hand their outcome to the IOLoop instance, see lookup_executor.py
+        return tornado.ioloop.IOLoop.instance()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_path = os.path.join(self.directory, "data.tsv.gz")
+        self.copy_data_file("regions.tsv.gz")
+
+        TabixLookupHandler.tabix_file_map = {"t": {"type": "tsv", "path": self.data_path, "reader": "native",
+                                                   "result_cache": {"max_bytes": 1024 * 1024}}}
+        tabix_lookup.RESULT_CACHES.clear()
+        lookup_executor.configure(0)
+        super(ResultCacheTest, self).setUp()
+
+    def tearDown(self):
+        super(ResultCacheTest, self).tearDown()
+        tabix_lookup.RESULT_CACHES.clear()
+        shutil.rmtree(self.directory)
+
+    def get_app(self):
+        return tornado.web.Application([
+            (r"/tabix/(\w+)/(X|Y|M|\d{1,2})/(\d+)/(\d+)", TabixLookupHandler)
+        ])
+
+    def copy_data_file(self, name):
+        shutil.copyfile(os.path.join(DATA_DIRECTORY, name), self.data_path)
+        shutil.copyfile(os.path.join(DATA_DIRECTORY, name + ".tbi"), self.data_path + ".tbi")
+
+    def lookup(self, path):
+        self.http_client.fetch(self.get_url(path), self.stop)
+        response = self.wait()
+        self.assertEqual(response.code, 200)
+        return response.body
+
+    def test_cached_response(self):
+        body = self.lookup("/tabix/t/1/100/300")
+        self.assertEqual(len(json.loads(body)["values"]), 21)
+        self.assertEqual(self.lookup("/tabix/t/1/100/300"), body)
+        self.assertEqual(tabix_lookup.RESULT_CACHES["t"].stats()["hits"], 1)
+
+        # Other regions are looked up.
+        self.assertEqual(len(json.loads(self.lookup("/tabix/t/1/100/200"))["values"]), 11)
+        self.assertEqual(tabix_lookup.RESULT_CACHES["t"].stats()["hits"], 1)
+
+    def test_changed_file(self):
+        self.lookup("/tabix/t/1/100/300")
+        mtime = os.stat(self.data_path).st_mtime
+
+        self.copy_data_file("small.vcf.gz")
+        os.utime(self.data_path, (mtime + 10, mtime + 10))
+
+        values = json.loads(self.lookup("/tabix/t/1/100/300"))["values"]
+        self.assertEqual([value["POS"] for value in values], ["100", "200", "202", "300"])
+        self.assertEqual(tabix_lookup.RESULT_CACHES["t"].stats()["hits"], 0)
@@ -0,0 +1,224 @@
+import csv
+import glob
+import os
+import shutil
+import socket
+import StringIO
+import sys
+import tempfile
+import time
+import unittest
+
+import tornado.ioloop
+import tornado.iostream
+import tornado.testing
+import tornado.web
+from tornado.options import define, options
+
+from tabix import lookup_executor
+from tabix import tabix_utils
+from tabix.tabix_lookup import TabixLookupHandler
+
+if "tabix_executable" not in options:
+    define("tabix_executable", default="tabix")
+
+# Stands in for the tabix executable: records its process ID next to the data file, and writes
+# rows until it is stopped, so that it only goes away if the server stops it.
+FAKE_TABIX = """
+import os
+import sys
+
+file_path = [arg for arg in sys.argv[1:] if not arg.startswith("-") and not arg.startswith("chr")][0]
+with open(file_path + ".pid." + str(os.getpid()), "w") as pid_file:
+    pid_file.write(str(os.getpid()))
+
+sys.stdout.write("#chr\\tstart\\tvalue\\n")
+position = 0
+while True:
+    position += 1
+    sys.stdout.write("chr1\\t" + str(position) + "\\t" + "x" * 100 + "\\n")
+"""
+
+# Writes a message to stderr and fails, as tabix does for a file without an index.
+FAILING_TABIX = """
+import sys
+
+sys.stdout.write("#chr\\tstart\\tvalue\\n")
+sys.stderr.write("[tabix] the index file could not be loaded\\n")
+sys.exit(1)
+"""
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+class StreamDisconnectTest(tornado.testing.AsyncHTTPTestCase):
+    POOL_SIZE = 0
+
+    def get_new_ioloop(self):
+        # Lookups hand their outcome to the IOLoop instance, see lookup_executor.py
+        return tornado.ioloop.IOLoop.instance()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        fake_tabix = os.path.join(self.directory, "fake_tabix.py")
+        with open(fake_tabix, "w") as script:
+            script.write(FAKE_TABIX)
+        self.data_path = os.path.join(self.directory, "data.tsv.gz")
+        open(self.data_path, "w").close()
+
+        self.saved_executable = options.tabix_executable
+        options.tabix_executable = sys.executable + " " + fake_tabix
+        TabixLookupHandler.tabix_file_map = {"t": {"type": "tsv", "path": self.data_path}}
+        lookup_executor.configure(self.POOL_SIZE)
+        super(StreamDisconnectTest, self).setUp()
+
+    def tearDown(self):
+        super(StreamDisconnectTest, self).tearDown()
+        lookup_executor.configure(0)
+        options.tabix_executable = self.saved_executable
+        for pid_path in glob.glob(self.data_path + ".pid.*"):
+            pid = int(pid_path.rsplit(".", 1)[1])
+            if is_running(pid):
+                os.kill(pid, 9)
+        shutil.rmtree(self.directory)
+
+    def get_app(self):
+        return tornado.web.Application([
+            (r"/tabix/(\w+)/(X|Y|M|\d{1,2})/(\d+)/(\d+)", TabixLookupHandler)
+        ])
+
+    def tabix_pids(self):
+        return [int(pid_path.rsplit(".", 1)[1]) for pid_path in glob.glob(self.data_path + ".pid.*")]
+
+    def wait_until(self, condition, timeout=10):
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                return False
+            self.io_loop.add_timeout(time.time() + 0.05, self.stop)
+            self.wait()
+        return True
+
+    def read_and_disconnect(self, path, size=256 * 1024):
+        # Reads the start of the response, then drops the connection.
+        stream = tornado.iostream.IOStream(socket.socket(socket.AF_INET, socket.SOCK_STREAM), io_loop=self.io_loop)
+        stream.connect(("localhost", self.get_http_port()), self.stop)
+        self.wait()
+        stream.write("GET " + path + " HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        stream.read_bytes(size, self.stop)
+        data = self.wait()
+        stream.close()
+        return data
+
+    def check_disconnect(self, path):
+        data = self.read_and_disconnect(path)
+        self.assertTrue(data.startswith("HTTP/1.1 200"))
+
+        pids = self.tabix_pids()
+        self.assertEqual(len(pids), 1)
+        self.assertTrue(self.wait_until(lambda: not is_running(pids[0])), "tabix process still running")
+        if lookup_executor.is_async():
+            self.assertTrue(self.wait_until(lambda: lookup_executor.stream_slot_stats()["used"] == 0), "stream slot not released")
+
+    def test_stream_disconnect(self):
+        self.check_disconnect("/tabix/t/1/1/1000000?stream=ndjson")
+
+    def test_raw_disconnect(self):
+        self.check_disconnect("/tabix/t/1/1/1000000?output=raw")
+
+class PooledStreamDisconnectTest(StreamDisconnectTest):
+    POOL_SIZE = 2
+
+    def test_stream_holds_slot(self):
+        stream = tornado.iostream.IOStream(socket.socket(socket.AF_INET, socket.SOCK_STREAM), io_loop=self.io_loop)
+        stream.connect(("localhost", self.get_http_port()), self.stop)
+        self.wait()
+        stream.write("GET /tabix/t/1/1/1000000?output=raw HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        stream.read_bytes(1024, self.stop)
+        self.wait()
+
+        # Open streams have slots of their own, and leave the lookup slots to other lookups.
+        self.assertEqual(lookup_executor.stream_slot_stats()["used"], 1)
+        self.assertEqual(lookup_executor.slot_stats()["used"], 0)
+        stream.close()
+        self.assertTrue(self.wait_until(lambda: lookup_executor.stream_slot_stats()["used"] == 0), "stream slot not released")
+
+class LookupSlotsTest(tornado.testing.AsyncTestCase):
+    def get_new_ioloop(self):
+        return tornado.ioloop.IOLoop.instance()
+
+    def test_waiting_lookup_gets_released_slot(self):
+        slots = lookup_executor.LookupSlots(1)
+        acquired = []
+        slots.acquire(lambda: acquired.append("first"))
+        slots.acquire(lambda: acquired.append("second"))
+        self.assertEqual(acquired, ["first"])
+        self.assertEqual(slots.stats(), {"size": 1, "used": 1, "waiting": 1})
+
+        slots.release()
+        self.io_loop.add_callback(self.stop)
+        self.wait()
+        self.assertEqual(acquired, ["first", "second"])
+        self.assertEqual(slots.stats(), {"size": 1, "used": 1, "waiting": 0})
+
+        slots.release()
+        self.assertEqual(slots.stats(), {"size": 1, "used": 0, "waiting": 0})
+
+    def test_try_acquire(self):
+        slots = lookup_executor.LookupSlots(2)
+        self.assertTrue(slots.try_acquire())
+        self.assertTrue(slots.try_acquire())
+        self.assertFalse(slots.try_acquire())
+        self.assertEqual(slots.stats(), {"size": 2, "used": 2, "waiting": 0})
+
+        slots.release()
+        self.assertTrue(slots.try_acquire())
+        slots.release()
+        slots.release()
+        self.assertEqual(slots.stats(), {"size": 2, "used": 0, "waiting": 0})
+
+class RegionLookupRowsTest(unittest.TestCase):
+    # Rows have the keys and values of the rows of csv.DictReader.
+    DATA = "#chr\tstart\tvalue\nchr1\t10\ta\n\nchr1\t20\nchr1\t30\tc\textra\tmore\nchr1\t40\t\n"
+
+    def test_dict_reader_rows(self):
+        rows = tabix_utils.parse_region_lookup_result(self.DATA)
+        expected = list(csv.DictReader(StringIO.StringIO(self.DATA.replace("#chr", "chr")), delimiter="\t"))
+        self.assertEqual([dict(row.iteritems()) for row in rows], expected)
+        self.assertEqual(rows[2][None], ["extra", "more"])
+
+    def test_meta_lines(self):
+        # Meta lines before the header line are skipped.
+        rows = tabix_utils.parse_region_lookup_result("##source=test\n" + self.DATA)
+        self.assertEqual([row["start"] for row in rows], ["10", "20", "30", "40"])
+
+class TabixErrorsTest(unittest.TestCase):
+    # Messages of a failing tabix are kept in the error, apart from the output.
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        fake_tabix = os.path.join(self.directory, "fake_tabix.py")
+        with open(fake_tabix, "w") as script:
+            script.write(FAILING_TABIX)
+        self.tabix_exe = sys.executable + " " + fake_tabix
+        self.data_path = os.path.join(self.directory, "data.tsv.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_error(self, fn, *args):
+        try:
+            fn(*args)
+        except tabix_utils.TabixExecutionError as tee:
+            self.assertEqual(tee.output, "[tabix] the index file could not be loaded\n")
+        else:
+            self.fail("TabixExecutionError not raised")
+
+    def test_lines(self):
+        self.check_error(lambda *args: list(tabix_utils.iter_tabix_lines(*args)), self.tabix_exe, self.data_path, "1", 1, 10)
+
+    def test_region_lookup(self):
+        self.check_error(tabix_utils.tsv_region_lookup, self.tabix_exe, self.data_path, "1", 1, 10)
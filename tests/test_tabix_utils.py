@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tabix import tabix_utils
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(__file__), "data")
+
+def copy_data_file(name, path):
+    shutil.copyfile(os.path.join(DATA_DIRECTORY, name), path)
+    shutil.copyfile(os.path.join(DATA_DIRECTORY, name + ".tbi"), path + ".tbi")
+
+class HeaderCacheTest(unittest.TestCase):
+    # Headers are read once per version of a file.
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_path = os.path.join(self.directory, "data.vcf.gz")
+        copy_data_file("small.vcf.gz", self.data_path)
+        tabix_utils.HEADER_IDENTIFIERS.clear()
+        self.saved_read = tabix_utils.read_header_lines
+
+    def tearDown(self):
+        tabix_utils.read_header_lines = self.saved_read
+        tabix_utils.HEADER_IDENTIFIERS.clear()
+        shutil.rmtree(self.directory)
+
+    def header(self):
+        return tabix_utils.get_header_identifiers("tabix", self.data_path, "1", 100, tabix_utils.VCF_VALUE_START_INDEX,
+                                                  tabix_utils.TABIX_READER_NATIVE)
+
+    def test_read_once(self):
+        header = self.header()
+        self.assertEqual(header.names, ("S-1-F", "S-1-M", "S-1-NB"))
+
+        def read_header_lines(*args):
+            raise AssertionError("header read again")
+        tabix_utils.read_header_lines = read_header_lines
+        self.assertTrue(self.header() is header)
+
+    def test_changed_file(self):
+        header = self.header()
+        mtime = os.stat(self.data_path).st_mtime
+        copy_data_file("vs_variants.vcf.gz", self.data_path)
+        os.utime(self.data_path, (mtime + 10, mtime + 10))
+
+        new_header = self.header()
+        self.assertFalse(new_header is header)
+        self.assertEqual(new_header.names[:4], ("ITMI-0-F", "ITMI-0-M", "ITMI-0-NB", "ITMI-1-F"))
+
+    def test_per_value_start_index(self):
+        # The same file read as a triotype file has other identifiers.
+        self.header()
+        header = tabix_utils.get_header_identifiers("tabix", self.data_path, "1", 100, tabix_utils.TRIOTYPE_VALUE_START_INDEX,
+                                                    tabix_utils.TABIX_READER_NATIVE)
+        self.assertEqual(header.names[:2], ("ID", "REF"))
+
+class SampleProjectionTest(unittest.TestCase):
+    # Lookups with samples return the values of those samples only.
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.data_path = os.path.join(self.directory, "data.vcf.gz")
+        copy_data_file("vs_variants.vcf.gz", self.data_path)
+        tabix_utils.HEADER_IDENTIFIERS.clear()
+
+    def tearDown(self):
+        tabix_utils.HEADER_IDENTIFIERS.clear()
+        shutil.rmtree(self.directory)
+
+    def lookup(self, samples, include_family_members=False):
+        return tabix_utils.vcf_singleline_lookup_with_header("tabix", self.data_path, "1", 102, 102,
+                                                             tabix_utils.TABIX_READER_NATIVE, samples,
+                                                             include_family_members)
+
+    def test_samples(self):
+        full = self.lookup(None)
+        result = self.lookup(["ITMI-3-NB", "ITMI-0-F"])
+        self.assertEqual(result.values.header.names, ("ITMI-3-NB", "ITMI-0-F"))
+        self.assertEqual(dict(result.values.iteritems()),
+                         {"ITMI-3-NB": full.values["ITMI-3-NB"], "ITMI-0-F": full.values["ITMI-0-F"]})
+
+    def test_family_members(self):
+        result = self.lookup(["ITMI-2", "ITMI-5-M"], include_family_members=True)
+        self.assertEqual(result.values.header.names, ("ITMI-2-F", "ITMI-2-M", "ITMI-2-NB", "ITMI-5-M"))
+
+    def test_unknown_samples(self):
+        self.assertRaises(tabix_utils.UnknownSampleError, self.lookup, ["ITMI-0-F", "ITMI-99-F"])
+        self.assertRaises(tabix_utils.UnknownSampleError, self.lookup, ["ITMI-99"], True)
+
+    def test_sample_selection(self):
+        config = {"cohorts": {"parents": ["ITMI-0-F", "ITMI-0-M"]}}
+        self.assertEqual(tabix_utils.get_sample_selection(config, samples="ITMI-0-F, ITMI-1-M,"), ["ITMI-0-F", "ITMI-1-M"])
+        self.assertEqual(tabix_utils.get_sample_selection(config, cohort="parents"), ["ITMI-0-F", "ITMI-0-M"])
+        self.assertEqual(tabix_utils.get_sample_selection(config), None)
+        for samples, cohort in [(",", None), (None, "children"), ("ITMI-0-F", "parents")]:
+            self.assertRaises(ValueError, tabix_utils.get_sample_selection, config, samples, cohort)
+
+class RegionLookupTest(unittest.TestCase):
+    # Region lookups return all records in the region, with the values of the selected samples.
+    def setUp(self):
+        tabix_utils.HEADER_IDENTIFIERS.clear()
+        self.vcf_path = os.path.join(DATA_DIRECTORY, "vs_variants.vcf.gz")
+        self.triotype_path = os.path.join(DATA_DIRECTORY, "vs_triotypes.tsv.gz")
+
+    def tearDown(self):
+        tabix_utils.HEADER_IDENTIFIERS.clear()
+
+    def lookup(self, lookup_fn, path, samples=None):
+        return lookup_fn("tabix", path, "1", 100, 130, tabix_utils.TABIX_READER_NATIVE, samples)
+
+    def check_samples(self, lookup_fn, path, samples):
+        full = self.lookup(lookup_fn, path)
+        result = self.lookup(lookup_fn, path, samples)
+        self.assertTrue(len(result.values) > 1)
+        self.assertEqual([record.start for record in result.values], [record.start for record in full.values])
+        for record, full_record in zip(result.values, full.values):
+            self.assertEqual(record.values.header.names, tuple(samples))
+            self.assertEqual(dict(record.values.iteritems()),
+                             dict((sample_id, full_record.values[sample_id]) for sample_id in samples))
+
+    def test_vcf_samples(self):
+        self.check_samples(tabix_utils.vcf_region_lookup, self.vcf_path, ["ITMI-6-NB", "ITMI-1-F"])
+
+    def test_triotype_samples(self):
+        self.check_samples(tabix_utils.triotype_region_lookup, self.triotype_path, ["ITMI-7", "ITMI-2"])
+
+    def test_unknown_samples(self):
+        self.assertRaises(tabix_utils.UnknownSampleError, self.lookup, tabix_utils.vcf_region_lookup, self.vcf_path,
+                          ["ITMI-99-F"])
@@ -0,0 +1,47 @@
+import threading
+import unittest
+
+from tabix import lookup_executor
+from tabix import variant_summary_lookup as vsl
+
+class FetchSlotTest(unittest.TestCase):
+    def setUp(self):
+        lookup_executor.configure(2)
+        vsl.configure_fetch_pool(2)
+
+    def tearDown(self):
+        vsl.configure_fetch_pool(0)
+        lookup_executor.configure(0)
+
+    def test_fetch_runs_in_free_slot(self):
+        # The query itself holds one slot, the fetch takes the other one while it runs.
+        self.assertTrue(lookup_executor.try_acquire_slot())
+        running = threading.Event()
+        proceed = threading.Event()
+
+        def fetch():
+            running.set()
+            proceed.wait(5)
+            return lookup_executor.slot_stats()["used"]
+
+        result = vsl.start_fetch("test fetch", fetch)
+        self.assertTrue(running.wait(5))
+        self.assertFalse(lookup_executor.try_acquire_slot())
+        proceed.set()
+        self.assertEqual(result.get(), 2)
+
+        lookup_executor.release_slot()
+        self.assertEqual(lookup_executor.slot_stats()["used"], 0)
+
+    def test_fetch_without_free_slot_runs_in_caller(self):
+        self.assertTrue(lookup_executor.try_acquire_slot())
+        self.assertTrue(lookup_executor.try_acquire_slot())
+        caller = threading.current_thread()
+
+        result = vsl.start_fetch("test fetch", lambda: threading.current_thread() is caller)
+        self.assertTrue(isinstance(result, vsl.DeferredResult))
+        self.assertTrue(result.get())
+        self.assertEqual(lookup_executor.slot_stats()["used"], 2)
+
+        lookup_executor.release_slot()
+        lookup_executor.release_slot()
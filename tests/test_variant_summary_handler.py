@@ -0,0 +1,75 @@
+import json
+import os
+
+import tornado.ioloop
+import tornado.testing
+import tornado.web
+
+from tabix import lookup_executor
+from tabix import tabix_utils
+from tabix.variant_summary_handler import VariantSummaryHandler
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(__file__), "data")
+FEATURE_IDS = ["B:CLIN:A", "B:CLIN:B"]
+
+class MultiFeatureTest(tornado.testing.AsyncHTTPTestCase):
+    # Summaries of several features are keyed by feature ID, and equal the single summaries.
+    def get_new_ioloop(self):
+        # Lookups hand their outcome to the IOLoop instance, see lookup_executor.py
+        return tornado.ioloop.IOLoop.instance()
+
+    def setUp(self):
+        VariantSummaryHandler.data_map = {"vs": {
+            "tabix_executable": "tabix",
+            "reader": tabix_utils.TABIX_READER_NATIVE,
+            "triotype_file": os.path.join(DATA_DIRECTORY, "vs_triotypes.tsv.gz"),
+            "vcf_file": os.path.join(DATA_DIRECTORY, "vs_variants.vcf.gz"),
+            "feature_matrix": {"type": "json", "path": os.path.join(DATA_DIRECTORY, "vs_features.json")}
+        }}
+        lookup_executor.configure(0)
+        super(MultiFeatureTest, self).setUp()
+
+    def get_app(self):
+        return tornado.web.Application([
+            (r"/variant_summary/(.*)", VariantSummaryHandler)
+        ])
+
+    def fetch(self, path, **kwargs):
+        self.http_client.fetch(self.get_url(path), self.stop, **kwargs)
+        return self.wait()
+
+    def get_summary(self, *feature_ids):
+        arguments = "".join("&feature_id=" + feature_id for feature_id in feature_ids)
+        response = self.fetch("/variant_summary/vs?chromosome=1&coordinate=102" + arguments)
+        self.assertEqual(response.code, 200)
+        return json.loads(response.body)
+
+    def post_summary(self, query):
+        return self.fetch("/variant_summary/vs", method="POST", body=json.dumps(query))
+
+    def test_get(self):
+        single = [self.get_summary(feature_id) for feature_id in FEATURE_IDS]
+        self.assertEqual(sorted(single[0].keys()), ["triotypes", "vcf"])
+        self.assertNotEqual(single[0], single[1])
+        self.assertEqual(self.get_summary(*FEATURE_IDS), dict(zip(FEATURE_IDS, single)))
+
+    def test_post(self):
+        response = self.post_summary({"chromosome": "1", "coordinate": 102, "feature_ids": FEATURE_IDS + ["B:CLIN:C"]})
+        self.assertEqual(response.code, 200)
+        summaries = json.loads(response.body)
+        self.assertEqual(summaries["B:CLIN:C"], {})
+        del summaries["B:CLIN:C"]
+        self.assertEqual(summaries, self.get_summary(*FEATURE_IDS))
+
+    def test_post_samples(self):
+        query = {"chromosome": "1", "coordinate": 102, "feature_ids": FEATURE_IDS, "samples": ["ITMI-1", "ITMI-5"]}
+        summaries = json.loads(self.post_summary(query).body)
+        for feature_id in FEATURE_IDS:
+            self.assertEqual(sum(summaries[feature_id]["triotypes"]["category_sizes"].values()), 2)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.fetch("/variant_summary/vs?chromosome=1&coordinate=102").code, 400)
+        for query in [{"chromosome": "1", "coordinate": 102, "feature_ids": "B:CLIN:A"},
+                      {"chromosome": "1", "feature_ids": FEATURE_IDS},
+                      {"chromosome": "1", "coordinate": "x", "feature_ids": FEATURE_IDS}]:
+            self.assertEqual(self.post_summary(query).code, 400)
@@ -0,0 +1,146 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+from tabix import tabix_utils
+from tabix import variant_summary_lookup as vsl
+from tabix.feature_data_source import FeatureData
+
+FAMILIES = ["ITMI-%d" % number for number in xrange(40)]
+# Every family has parents and a newborn, some also a sibling that is not counted.
+SAMPLES = ["%s-%s" % (family_id, role) for family_id in FAMILIES for role in ("F", "M", "NB1")] + \
+          ["%s-S" % family_id for family_id in FAMILIES[::5]]
+GENOTYPES = ["0/0", "0/1", "1/0", "1/1", "./.", "0", "1", "."]
+
+# Stands in for the tabix executable: prints the header lines of a plain text data file with "-h",
+# and the records in the requested region.
+FAKE_TABIX = """
+import sys
+
+arguments = sys.argv[1:]
+sequence, region = arguments[-1].split(":")
+start, end = [int(coordinate) for coordinate in region.split("-")]
+for line in open(arguments[-2]):
+    fields = line.rstrip("\\n").split("\\t")
+    if line.startswith("#"):
+        if "-h" in arguments:
+            sys.stdout.write(line)
+    elif fields[0] == sequence and start <= int(fields[1]) <= end:
+        sys.stdout.write(line)
+"""
+
+def triotype_row(values):
+    return tabix_utils.parse_triotype_line("\t".join(["chr1", "1000"] + values),
+                                           identifiers=tabix_utils.RowHeader(FAMILIES))
+
+def vcf_row(values):
+    return tabix_utils.parse_vcf_line("\t".join(["chr1", "1000", ".", "A", "G", ".", "PASS", ".", "GT"] + values),
+                                      identifiers=tabix_utils.RowHeader(SAMPLES))
+
+class VectorizedCountTest(unittest.TestCase):
+    # The counts taken with NumPy are the same as those of the loops.
+    def setUp(self):
+        self.random = random.Random(17)
+        # Some families have a value of neither category.
+        value_dict = dict((family_id, self.random.choice(["true", "false", "NA"])) for family_id in FAMILIES)
+        self.feature = FeatureData("B:CLIN:A", value_dict)
+        self.saved_numpy = vsl.numpy
+
+    def tearDown(self):
+        vsl.numpy = self.saved_numpy
+
+    def summarize(self, process_fn, *args):
+        vectorized = process_fn(*args)
+        vsl.numpy = None
+        try:
+            return vectorized, process_fn(*args)
+        finally:
+            vsl.numpy = self.saved_numpy
+
+    def test_triotypes(self):
+        for trial in xrange(20):
+            row = triotype_row([self.random.choice(vsl.TRIO_TYPES + ["00"]) for family_id in FAMILIES])
+            self.assertTrue(vsl.can_vectorize(row))
+            vectorized, loop = self.summarize(vsl.process_triotypes, row, self.feature)
+            self.assertEqual(vectorized, loop)
+
+    def test_vcf(self):
+        for chromosome in ["1", "X", "Y", "M"]:
+            for trial in xrange(10):
+                row = vcf_row([self.random.choice(GENOTYPES) for sample_id in SAMPLES])
+                self.assertTrue(vsl.can_vectorize(row))
+                vectorized, loop = self.summarize(vsl.process_vcf, row, self.feature, chromosome)
+                self.assertEqual(vectorized, loop)
+
+    def test_shared_decoding(self):
+        # Summaries of several features over one row decode it once.
+        other = FeatureData("B:CLIN:B", dict((family_id, "true" if number < 10 else "false")
+                                             for number, family_id in enumerate(FAMILIES)))
+        triotypes = triotype_row([self.random.choice(vsl.TRIO_TYPES) for family_id in FAMILIES])
+        vcf_data = vcf_row([self.random.choice(GENOTYPES) for sample_id in SAMPLES])
+        summaries = vsl.summarize_features(triotypes, vcf_data, [("A", self.feature), ("B", other)], "1")
+        for feature_id, feature in [("A", self.feature), ("B", other)]:
+            self.assertEqual(summaries[feature_id]["triotypes"], vsl.process_triotypes(triotypes, feature))
+            self.assertEqual(summaries[feature_id]["vcf"], vsl.process_vcf(vcf_data, feature, "1"))
+
+    def test_short_row(self):
+        # Rows without the trailing values are counted by the loops.
+        row = vcf_row([self.random.choice(GENOTYPES) for sample_id in SAMPLES[:-10]])
+        self.assertFalse(vsl.can_vectorize(row))
+        vectorized, loop = self.summarize(vsl.process_vcf, row, self.feature, "1")
+        self.assertEqual(vectorized, loop)
+
+    def test_missing_family(self):
+        # Both raise a KeyError for a family without a feature value.
+        del self.feature.values[FAMILIES[3]]
+        row = triotype_row([self.random.choice(vsl.TRIO_TYPES) for family_id in FAMILIES])
+        self.assertRaises(KeyError, vsl.process_triotypes, row, self.feature)
+        vsl.numpy = None
+        self.assertRaises(KeyError, vsl.process_triotypes, row, self.feature)
+
+class HeaderChangeTest(unittest.TestCase):
+    # Rows of a rewritten file with another column order are counted with the new header.
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        fake_tabix = os.path.join(self.directory, "fake_tabix.py")
+        with open(fake_tabix, "w") as script:
+            script.write(FAKE_TABIX)
+        self.tabix_exe = sys.executable + " " + fake_tabix
+        self.data_path = os.path.join(self.directory, "data.vcf")
+
+        self.random = random.Random(22)
+        value_dict = dict((family_id, self.random.choice(["true", "false"])) for family_id in FAMILIES)
+        self.feature = FeatureData("B:CLIN:A", value_dict)
+        self.genotypes = dict((sample_id, self.random.choice(GENOTYPES[:5])) for sample_id in SAMPLES)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_file(self, sample_ids, mtime):
+        with open(self.data_path, "w") as data_file:
+            data_file.write("##fileformat=VCFv4.1\n")
+            data_file.write("\t".join(["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT"] + sample_ids) + "\n")
+            data_file.write("\t".join(["chr1", "1000", ".", "A", "G", ".", "PASS", ".", "GT"] +
+                                       [self.genotypes[sample_id] for sample_id in sample_ids]) + "\n")
+        os.utime(self.data_path, (mtime, mtime))
+
+    def summarize(self):
+        data = vsl.get_vcf_data(self.tabix_exe, self.data_path, "1", 1000)
+        return data.values.header, vsl.process_vcf(data, self.feature, "1")
+
+    def test_new_column_order(self):
+        expected = vsl.process_vcf(vcf_row([self.genotypes[sample_id] for sample_id in SAMPLES]), self.feature, "1")
+
+        self.write_file(SAMPLES, 1000000000)
+        header, summary = self.summarize()
+        self.assertEqual(summary, expected)
+
+        reordered = list(reversed(SAMPLES))
+        self.write_file(reordered, 1000000010)
+        new_header, summary = self.summarize()
+        self.assertFalse(new_header is header)
+        self.assertEqual(new_header.names, tuple(reordered))
+        self.assertEqual(summary, expected)
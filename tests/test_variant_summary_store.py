@@ -0,0 +1,100 @@
+import cPickle
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import zlib
+
+from tabix import tabix_utils
+from tabix import variant_summary_lookup as vsl
+from tabix import variant_summary_store
+from tabix import variant_summary_store_builder
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(__file__), "data")
+
+# Eight families on chr1 and chrX, with a few positions that have two triotype records or VCF
+# records overlapping from an earlier position, which do_query cannot summarize.
+DATA_FILES = ["vs_triotypes.tsv.gz", "vs_triotypes.tsv.gz.tbi", "vs_variants.vcf.gz", "vs_variants.vcf.gz.tbi",
+              "vs_features.json"]
+FEATURE_IDS = ["B:CLIN:A", "B:CLIN:B"]
+
+LOOKUP_ERRORS = (tabix_utils.CoordinateRangeEmptyError, tabix_utils.WrongLineFoundError,
+                 tabix_utils.UnexpectedTabixOutputError)
+
+class SummaryStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name in DATA_FILES:
+            shutil.copyfile(os.path.join(DATA_DIRECTORY, name), os.path.join(self.directory, name))
+
+        self.store_dir = os.path.join(self.directory, "store")
+        self.live_configuration = {
+            "tabix_executable": "tabix",
+            "reader": tabix_utils.TABIX_READER_NATIVE,
+            "triotype_file": os.path.join(self.directory, "vs_triotypes.tsv.gz"),
+            "vcf_file": os.path.join(self.directory, "vs_variants.vcf.gz"),
+            "feature_matrix": {"type": "json", "path": os.path.join(self.directory, "vs_features.json")}
+        }
+        self.configuration = dict(self.live_configuration, summary_store=self.store_dir,
+                                  summary_store_refresh_interval=0)
+        variant_summary_store_builder.build_store(self.live_configuration, FEATURE_IDS, self.store_dir, processes=1)
+
+    def tearDown(self):
+        for shard in variant_summary_store.SHARDS.values():
+            shard.close()
+        variant_summary_store.SHARDS.clear()
+        variant_summary_store.CURRENT_SHARDS.clear()
+        shutil.rmtree(self.directory)
+
+    def live_query(self, chromosome, coordinate, feature_id):
+        try:
+            return vsl.do_query(self.live_configuration, chromosome, coordinate, feature_id)
+        except LOOKUP_ERRORS:
+            return None
+
+    def test_stored_summaries(self):
+        # Every position that do_query can summarize is stored, with the same summary.
+        stored_count = 0
+        for chromosome in ["1", "X"]:
+            for coordinate in xrange(100, 300):
+                for feature_id in FEATURE_IDS:
+                    stored = variant_summary_store.get_stored_summary(self.configuration, chromosome, coordinate, feature_id)
+                    self.assertEqual(stored, self.live_query(chromosome, coordinate, feature_id))
+                    if stored is not None:
+                        stored_count += 1
+        self.assertTrue(stored_count > 50)
+
+        summaries = variant_summary_store.get_stored_summaries(self.configuration, "1", 102, FEATURE_IDS + ["B:CLIN:C"])
+        self.assertEqual(sorted(summaries.keys()), FEATURE_IDS)
+
+    def test_out_of_date_store(self):
+        # Marks the stored summaries, so that the query shows where its result came from.
+        coordinate = self.first_stored_coordinate("1")
+        connection = sqlite3.connect(variant_summary_store.shard_path(self.store_dir, "1"))
+        connection.execute("UPDATE summaries SET summary = ?",
+                           (buffer(zlib.compress(cPickle.dumps("stored"))),))
+        connection.commit()
+        connection.close()
+        self.assertEqual(vsl.do_query(self.configuration, "1", coordinate, FEATURE_IDS[0]), "stored")
+
+        vcf_file = self.configuration["vcf_file"]
+        mtime = os.stat(vcf_file).st_mtime
+        os.utime(vcf_file, (mtime + 10, mtime + 10))
+        self.assertEqual(variant_summary_store.get_stored_summary(self.configuration, "1", coordinate, FEATURE_IDS[0]), None)
+        self.assertEqual(vsl.do_query(self.configuration, "1", coordinate, FEATURE_IDS[0]),
+                         self.live_query("1", coordinate, FEATURE_IDS[0]))
+
+    def test_refresh_interval(self):
+        # Within the refresh interval, the store is not checked again.
+        configuration = dict(self.configuration, summary_store_refresh_interval=3600)
+        coordinate = self.first_stored_coordinate("1")
+        self.assertNotEqual(variant_summary_store.get_stored_summary(configuration, "1", coordinate, FEATURE_IDS[0]), None)
+
+        os.remove(configuration["feature_matrix"]["path"])
+        self.assertNotEqual(variant_summary_store.get_stored_summary(configuration, "1", coordinate, FEATURE_IDS[0]), None)
+
+    def first_stored_coordinate(self, chromosome):
+        for coordinate in xrange(100, 300):
+            if variant_summary_store.get_stored_summary(self.configuration, chromosome, coordinate, FEATURE_IDS[0]) is not None:
+                return coordinate